@@ -1,27 +1,115 @@
 import os
+import re
+import json
+import time
+import pickle
+import hashlib
 import asyncio
+import argparse
+import threading
+from collections import OrderedDict
 from langchain_community.llms import LlamaCpp
-from langchain_core.callbacks import CallbackManager, StreamingStdOutCallbackHandler
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManager, StreamingStdOutCallbackHandler
 from langchain_core.prompts import PromptTemplate
-from collections import deque
 
 model_path = os.path.join(os.path.dirname(__file__), "models--TheBloke--Llama-2-7B-Chat-GGUF", "blobs",
                           "e0b99920cf47b94c78d2fb06a1eceb9ed795176dfa3f7feac64629f1b52b997f")
 
-def load_model():
+
+# One lock per loaded model: the chat and the RAG answers must not decode on it at the same time
+_model_locks = {}
+
+
+class ModelLock:
+    ''' Lock around one model that counts the threads waiting for it, so background work can give way '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count_lock = threading.Lock()
+        self.waiting = 0
+
+    def __enter__(self):
+        with self.count_lock:
+            self.waiting += 1
+        self.lock.acquire()
+        with self.count_lock:
+            self.waiting -= 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+def model_lock(model):
+    return _model_locks.setdefault(id(model.client), ModelLock())
+
+
+class GenerationCancelled(Exception):
+    """Raised from the token callback to abort an in-flight generation."""
+
+
+class StreamHandler(BaseCallbackHandler):
+    ''' Forwards every generated token to on_token and records streaming stats '''
+    # Let GenerationCancelled propagate out of the LLM call instead of being logged
+    raise_error = True
+
+    def __init__(self, on_token=None):
+        self.on_token = on_token
+        self.cancelled = False
+        self.tokens = []
+        self.start_time = None
+        self.first_token_time = None
+        self.end_time = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.start_time = time.perf_counter()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.cancelled:
+            raise GenerationCancelled()
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.tokens.append(token)
+        if self.on_token is not None:
+            self.on_token(token)
+
+    def on_llm_end(self, response, **kwargs):
+        self.end_time = time.perf_counter()
+
+    def text(self):
+        return "".join(self.tokens)
+
+    def stats(self):
+        ''' Time to first token and decode speed (tokens after the first one per second) '''
+        if self.start_time is None or self.first_token_time is None:
+            return {"tokens": 0, "time_to_first_token": None, "tokens_per_sec": None}
+        end_time = self.end_time or time.perf_counter()
+        decode_time = end_time - self.first_token_time
+        return {
+            "tokens": len(self.tokens),
+            "time_to_first_token": self.first_token_time - self.start_time,
+            "tokens_per_sec": (len(self.tokens) - 1) / decode_time if decode_time > 0 else None,
+        }
+
+
+def load_model(callbacks=None):
     ''' Load Llama model with error handling '''
     if not os.path.exists(model_path):
         print("Model path does not exist:", model_path)
         return None
 
-    callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
+    callback_manager = CallbackManager(callbacks or [])
 
     try:
         llama_model = LlamaCpp(
             model_path=model_path,
             temperature=0.5,
             n_gpu_layers=16,
-            n_batch=1,
+            n_ctx=4096,
+            n_batch=512,
             max_tokens=512,
             top_p=0.9,
             callback_manager=callback_manager,
@@ -32,8 +120,11 @@ def load_model():
         print(f"Failed to load model due to an error: {e}")
         return None
 
-def generate_response(model, query, history):
-    """Generates a response with prompt template and history."""
+def generate_response(model, query, history, callbacks=None):
+    """Generates a response with prompt template and history.
+
+    Pass a StreamHandler in callbacks to receive tokens as they are generated.
+    """
     prompt_template = """
     {history}
     User Query: {query}
@@ -45,16 +136,420 @@ def generate_response(model, query, history):
         input_variables=["history", "query"], template=prompt_template
     )
     full_prompt = prompt.format(history="\n".join(history), query=query)
-    response = model(full_prompt)
+    response = model.invoke(full_prompt, config={"callbacks": callbacks or []})
     return response.strip()
 
+def normalize_text(text):
+    ''' Lowercase words only, so "What is RAG?" and "what is rag" compare equal '''
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+def trigram_similarity(a, b):
+    ''' Dice coefficient over character trigrams, 1.0 for identical strings '''
+    a_grams = {a[i:i + 3] for i in range(max(len(a) - 2, 1))}
+    b_grams = {b[i:i + 3] for i in range(max(len(b) - 2, 1))}
+    return 2 * len(a_grams & b_grams) / (len(a_grams) + len(b_grams))
+
+# Words too common to tell two questions apart; every other word must match for a near hit
+FILLER_WORDS = {"a", "an", "the", "is", "are", "was", "what", "whats", "s", "please", "me", "can", "you", "tell",
+                "of", "in", "on", "for", "to", "do", "does", "i", "how", "about"}
+
+def same_content(a, b):
+    ''' True if two normalized queries have the same numbers, negations and content words.
+
+    Trigram similarity alone treats "enable bluetooth"/"disable bluetooth" or "by 20"/"by
+    30" as the same question, so near hits are only allowed when no meaningful word differs.
+    '''
+    return {word for word in a.split() if word not in FILLER_WORDS} == {word for word in b.split() if word not in FILLER_WORDS}
+
+def model_fingerprint(path):
+    ''' Cheap model identity (path, size, mtime) instead of hashing gigabytes of weights '''
+    try:
+        stat = os.stat(path)
+        identity = f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        identity = path
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache:
+    ''' Bounded cache of chatbot responses with exact and near-duplicate lookup.
+
+    Entries are keyed on the normalized query plus a context key made of the last
+    history_turns turns, the sampling parameters and the model fingerprint. Near-duplicate
+    lookup is off by default; with similarity set (0.95 or more is sensible) it accepts a
+    cached query with the same context key that is that similar and differs only in
+    filler words, never in numbers, negations or content words. Eviction is LRU past max_entries and by age past ttl seconds.
+    '''
+
+    def __init__(self, path=None, max_entries=1000, ttl=7 * 24 * 3600, similarity=None, history_turns=1):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.history_turns = history_turns
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "evictions": 0}
+        if path and os.path.exists(path):
+            self.load()
+
+    def context_key(self, model, turns):
+        recent = turns[-self.history_turns:] if self.history_turns else []
+        context = {
+            "history": [[normalize_text(query), response] for query, response in recent],
+            "params": [model.temperature, model.top_p, model.max_tokens],
+            "model": model_fingerprint(model.model_path),
+        }
+        return hashlib.sha1(json.dumps(context).encode("utf-8")).hexdigest()
+
+    def get(self, model, turns, query):
+        normalized = normalize_text(query)
+        context = self.context_key(model, turns)
+        now = time.time()
+        with self.lock:
+            self.expire(now)
+            key = (context, normalized)
+            if key not in self.entries and self.similarity is not None:
+                scored = [(trigram_similarity(normalized, cached), (cached_context, cached))
+                          for cached_context, cached in self.entries
+                          if cached_context == context and same_content(normalized, cached)]
+                best = max(scored, default=None)
+                if best is not None and best[0] >= self.similarity:
+                    key = best[1]
+                    self.stats["near_hits"] += 1
+            if key not in self.entries:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, model, turns, query, response):
+        key = (self.context_key(model, turns), normalize_text(query))
+        with self.lock:
+            self.entries[key] = (response, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def expire(self, now):
+        if self.ttl is None:
+            return
+        expired = [key for key, (_, created) in self.entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        self.stats["evictions"] += len(expired)
+
+    def save(self):
+        with self.lock:
+            entries = [[context, query, response, created]
+                       for (context, query), (response, created) in self.entries.items()]
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable response cache {self.path}: {e}")
+            return
+        for context, query, response, created in entries[-self.max_entries:]:
+            self.entries[(context, query)] = (response, created)
+        self.expire(time.time())
+
+
+SUMMARY_PROMPT = """Summarize the conversation below in a few sentences. Keep names, numbers and facts the
+assistant may need later; leave out greetings and filler.
+
+Earlier summary: {summary}
+
+{transcript}
+Summary:"""
+
+
+class ChatSession:
+    ''' Multi-turn conversation that reuses the llama.cpp KV cache across turns.
+
+    The prompt is append-only (system prompt, then every finished turn), so each new
+    turn shares its whole prefix with what llama.cpp evaluated on the previous turn and
+    only the newly appended tokens are prefilled. The evaluated state can be saved to
+    disk and restored, so a resumed conversation does not pay the prefill again.
+
+    The prompt is kept within token_budget (by default n_ctx minus room for the answer).
+    Once it passes high_water of the budget, the oldest turns are folded into a running
+    summary on a background thread after the turn finishes, until it is back under
+    low_water. The summary gives way as soon as a turn or a RAG answer waits for the
+    model: it is abandoned between prefill slices or decoded tokens and retried after
+    the next turn. Turns are only dropped outright if the budget would overflow before
+    a summary completes. reset() never waits for the model: it abandons a summary in
+    progress, and a turn that finishes after it is not added.
+    '''
+
+    system_prompt = "Provide a concise and informative response to the user query without asking any further questions.\n"
+    # Tokens of the summary prompt evaluated at a time, so a waiting turn is not held up by the whole transcript
+    prefill_slice = 128
+
+    def __init__(self, model, cache=None, token_budget=None, high_water=0.75, low_water=0.4, summary_tokens=256):
+        self.model = model
+        self.cache = cache
+        self.llama = model.client
+        # With a shared inference server the KV cache lives in the server process
+        self.local = hasattr(self.llama, "save_state")
+        self.token_budget = token_budget or model.n_ctx - model.max_tokens - 64
+        self.high_water = high_water
+        self.low_water = low_water
+        self.summary_tokens = summary_tokens
+        self.turns = []
+        self.turn_tokens = []
+        self.summary = ""
+        self.base_tokens = self.count_tokens(self.prefix())
+        # Guards the model: generation, background summaries and RAG answers must not interleave
+        self.lock = model_lock(model)
+        # Guards the turns and the summary, and is only held to read or swap them
+        self.state_lock = threading.Lock()
+        # Bumped by reset(), so work started on the old conversation is discarded
+        self.epoch = 0
+        self.compaction = None
+        self.last_stats = {}
+
+    def count_tokens(self, text):
+        return len(self.llama.tokenize(text.encode("utf-8")))
+
+    @staticmethod
+    def format_turn(query, response):
+        return f"User Query: {query}\nAssistant Response: {response}\n"
+
+    def prefix(self, summary=None):
+        ''' System prompt plus the running (or the given) summary, the part of the prompt before the turns '''
+        summary = self.summary if summary is None else summary
+        if summary:
+            return f"{self.system_prompt}Summary of the earlier conversation: {summary}\n"
+        return self.system_prompt
+
+    def build_prompt(self, query):
+        parts = [self.prefix()]
+        for past_query, past_response in self.turns:
+            parts.append(self.format_turn(past_query, past_response))
+        parts.append(f"User Query: {query}\nAssistant Response:")
+        return "".join(parts)
+
+    def used_tokens(self):
+        return self.base_tokens + sum(self.turn_tokens)
+
+    def history(self):
+        ''' Turns as the flat "User Query: ..." / "Assistant Response: ..." list used by generate_response '''
+        history = []
+        for query, response in self.turns:
+            history.extend([f"User Query: {query}", f"Assistant Response: {response}"])
+        return history
+
+    def generate(self, query, callbacks=None):
+        ''' Answer query, streaming tokens to the callbacks, and append the turn on success '''
+        callbacks = callbacks or []
+        with self.lock:
+            response = self.generate_locked(query, callbacks)
+        self.compact_in_background()
+        return response
+
+    def generate_locked(self, query, callbacks):
+        epoch = self.epoch
+        if self.cache is not None:
+            cached = self.cache.get(self.model, self.turns, query)
+            if cached is not None:
+                for handler in callbacks:
+                    handler.on_llm_start({}, [query])
+                    handler.on_llm_new_token(cached)
+                    handler.on_llm_end(None)
+                self.add_turn(query, cached, epoch)
+                self.last_stats = {"cached": True, "budget_used": self.used_tokens() / self.token_budget}
+                return cached
+
+        prompt = self.build_prompt(query)
+        tokens = self.llama.tokenize(prompt.encode("utf-8"))
+        while len(tokens) > self.token_budget and self.turns:
+            print("Prompt exceeds the token budget before the summary is ready; dropping the oldest turn")
+            with self.state_lock:
+                self.turns.pop(0)
+                self.turn_tokens.pop(0)
+            prompt = self.build_prompt(query)
+            tokens = self.llama.tokenize(prompt.encode("utf-8"))
+        if self.local:
+            reused = self.llama.longest_token_prefix(self.llama._input_ids.tolist(), tokens)
+
+        for handler in callbacks:
+            handler.on_llm_start({}, [prompt])
+        start_time = time.perf_counter()
+
+        stream = self.llama.create_completion(
+            tokens,
+            max_tokens=self.model.max_tokens,
+            temperature=self.model.temperature,
+            top_p=self.model.top_p,
+            stop=["User Query:"],
+            stream=True,
+        )
+        response = []
+        for chunk in stream:
+            token = chunk["choices"][0]["text"]
+            response.append(token)
+            for handler in callbacks:
+                handler.on_llm_new_token(token)
+
+        for handler in callbacks:
+            handler.on_llm_end(None)
+
+        response = "".join(response).strip()
+        if self.cache is not None:
+            self.cache.put(self.model, self.turns, query, response)
+        self.add_turn(query, response, epoch)
+
+        if not self.local:
+            reused = self.llama.last_stats.get("reused_tokens", 0)
+        self.last_stats = {
+            "prompt_tokens": len(tokens),
+            "reused_tokens": reused,
+            "prefilled_tokens": len(tokens) - reused,
+            "budget_used": self.used_tokens() / self.token_budget,
+            "seconds": time.perf_counter() - start_time,
+        }
+        return response
+
+    def add_turn(self, query, response, epoch=None):
+        ''' Append a finished turn, unless the conversation was reset since epoch '''
+        tokens = self.count_tokens(self.format_turn(query, response))
+        with self.state_lock:
+            if epoch is None or epoch == self.epoch:
+                self.turns.append((query, response))
+                self.turn_tokens.append(tokens)
+
+    def compact_in_background(self):
+        ''' Start summarizing the oldest turns once the prompt passes the high-water mark '''
+        if self.compaction is not None and self.compaction.is_alive():
+            return
+        if self.used_tokens() <= self.token_budget * self.high_water:
+            return
+
+        # Always keep the latest turn verbatim
+        count, used = 0, self.used_tokens()
+        while count < len(self.turns) - 1 and used > self.token_budget * self.low_water:
+            used -= self.turn_tokens[count]
+            count += 1
+        if count == 0:
+            return
+        with self.state_lock:
+            old_turns, summary, epoch = self.turns[:count], self.summary, self.epoch
+        self.compaction = threading.Thread(target=self.compact, args=(old_turns, summary, epoch), daemon=True)
+        self.compaction.start()
+
+    def interrupted(self, epoch):
+        ''' True when a summary started at epoch has to stop: the conversation was reset or a turn waits '''
+        return self.epoch != epoch or self.lock.waiting > 0
+
+    def compact(self, old_turns, summary, epoch):
+        transcript = "".join(self.format_turn(query, response) for query, response in old_turns)
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", transcript=transcript)
+        pieces = []
+        with self.lock:
+            try:
+                tokens = self.llama.tokenize(prompt.encode("utf-8"))
+                # Prefill slice by slice; each call reuses the slices already in the KV cache
+                for end in range(self.prefill_slice, len(tokens), self.prefill_slice):
+                    if self.interrupted(epoch):
+                        return
+                    for _ in self.llama.create_completion(tokens[:end], max_tokens=1, stream=True):
+                        pass
+                if self.interrupted(epoch):
+                    return
+                stream = self.llama.create_completion(
+                    tokens,
+                    max_tokens=self.summary_tokens,
+                    temperature=0.2,
+                    top_p=self.model.top_p,
+                    stop=["User Query:"],
+                    stream=True,
+                )
+                for chunk in stream:
+                    # The next compact_in_background call retries a summary that gave way
+                    if self.interrupted(epoch):
+                        return
+                    pieces.append(chunk["choices"][0]["text"])
+            except Exception as e:
+                print(f"Failed to summarize the conversation: {e}")
+                return
+        summary = "".join(pieces).strip()
+        base_tokens = self.count_tokens(self.prefix(summary))
+        with self.state_lock:
+            # The conversation may have been cleared while the summary was computed
+            if self.epoch != epoch or self.turns[:len(old_turns)] != old_turns:
+                return
+            self.summary = summary
+            del self.turns[:len(old_turns)]
+            del self.turn_tokens[:len(old_turns)]
+            self.base_tokens = base_tokens
+
+    def reset(self):
+        ''' Forget the conversation without waiting for a generation or summary in progress '''
+        # The KV cache is kept: the system prompt prefix still matches the next turn
+        base_tokens = self.count_tokens(self.prefix(""))
+        with self.state_lock:
+            self.epoch += 1
+            self.turns = []
+            self.turn_tokens = []
+            self.summary = ""
+            self.base_tokens = base_tokens
+
+    def save(self, path):
+        state = {
+            "model_path": self.model.model_path,
+            "system_prompt": self.system_prompt,
+            "summary": self.summary,
+            "turns": self.turns,
+            "llama_state": self.llama.save_state() if self.local else None,
+        }
+        with open(path, "wb") as file:
+            pickle.dump(state, file)
+
+    def load(self, path):
+        ''' Restore turns and the evaluated KV state saved by save(); returns False if the file does not match '''
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        if state["model_path"] != self.model.model_path or state["system_prompt"] != self.system_prompt:
+            print("Ignoring session saved for a different model or prompt:", path)
+            return False
+        if self.local and state["llama_state"] is not None:
+            self.llama.load_state(state["llama_state"])
+        self.summary = state.get("summary", "")
+        self.base_tokens = self.count_tokens(self.prefix())
+        self.turns = []
+        self.turn_tokens = []
+        for query, response in state["turns"]:
+            self.add_turn(query, response)
+        return True
+
+
 async def async_main():
-    llm = load_model()
+    parser = argparse.ArgumentParser(description="LLaMA chatbot")
+    parser.add_argument("--session", help="file to resume the conversation from and save it to after every turn")
+    parser.add_argument("--cache", help="file to keep the response cache in between runs")
+    parser.add_argument("--server", metavar="HOST:PORT", help="use a running inference_server.py instead of loading the model")
+    args = parser.parse_args()
+
+    if args.server:
+        from inference_server import connect
+
+        llm = connect(args.server)
+    else:
+        llm = load_model()
     if llm is None:
         print("Failed to initialize the LLaMA model.")
         return
 
-    history = deque(maxlen=4)
+    cache = ResponseCache(args.cache) if args.cache else None
+    session = ChatSession(llm, cache=cache)
+    if args.session and os.path.exists(args.session):
+        session.load(args.session)
 
     print("Welcome to the LLaMA Chatbot! Type 'exit' to quit.")
     while True:
@@ -62,9 +557,18 @@ async def async_main():
         if user_query.lower() == 'exit':
             break
 
-        response = await asyncio.get_event_loop().run_in_executor(None, generate_response, llm, user_query, list(history))
-        print("Response:", response)
-        history.extend([f"User Query: {user_query}", f"Assistant Response: {response}"])
+        response = await asyncio.get_event_loop().run_in_executor(
+            None, session.generate, user_query, [StreamingStdOutCallbackHandler()]
+        )
+        print("\nResponse:", response)
+        if session.last_stats.get("cached"):
+            print(f"(from cache, {cache.stats['hits']} hits / {cache.stats['misses']} misses)")
+        else:
+            print(f"(prefilled {session.last_stats['prefilled_tokens']} of {session.last_stats['prompt_tokens']} prompt tokens)")
+        if args.session:
+            session.save(args.session)
+        if cache is not None:
+            cache.save()
 
 if __name__ == "__main__":
     asyncio.run(async_main())
@@ -0,0 +1,391 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from lexical_index import BM25Index, reciprocal_rank_fusion
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf")
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical", "prefilter")
+# Corpus sizes (in chunks) at which "auto" moves to the next index type
+FLAT_LIMIT = 20000
+HNSW_LIMIT = 200000
+# Document-filtered searches over at most this many chunks are done exactly
+EXACT_FILTER_LIMIT = 50000
+# Hybrid search fuses the top k * FUSION_DEPTH of each ranking
+FUSION_DEPTH = 4
+# BM25 candidates reranked by embedding distance in "prefilter" mode
+PREFILTER_CANDIDATES = 200
+# IVF training wants this many vectors per list; smaller corpora get a flat index instead
+IVF_POINTS_PER_LIST = 39
+IVF_MIN_VECTORS = 1000
+
+
+def choose_index_type(vector_count):
+    if vector_count < FLAT_LIMIT:
+        return "flat"
+    if vector_count < HNSW_LIMIT:
+        return "hnsw"
+    return "ivf"
+
+def document_id(file_path):
+    ''' Stable id per absolute path, so equal file names in different folders do not collide '''
+    return hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16]
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusIndex:
+    ''' One persistent vector index over every uploaded document.
+
+    Chunk text, metadata and vectors live in SQLite next to the FAISS index, so single
+    documents can be added, replaced or deleted without rebuilding the rest, and the
+    FAISS index can be rebuilt as another type without re-embedding. With index_type
+    "auto" the index is flat (exact) for small corpora, HNSW for medium and IVF for
+    large ones. HNSW cannot remove vectors, so deleted chunks stay in it as stale
+    entries that are skipped at search time until a rebuild drops them.
+    '''
+
+    def __init__(self, path, embeddings, index_type="auto"):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type}, expected one of {', '.join(INDEX_TYPES)}")
+        self.path = path
+        self.embeddings = embeddings
+        self.index_type_setting = index_type
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "corpus.sqlite"), check_same_thread=False)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY, path TEXT NOT NULL, digest TEXT, chunks INTEGER NOT NULL, indexed REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL, vector BLOB NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id);"
+            # Chunk ids are never reused, since deleted ids can still be in an HNSW index
+            "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO counters SELECT 'next_chunk_id', COALESCE(MAX(id), 0) + 1 FROM chunks;"
+        )
+        # BM25 postings share the database, so they are committed together with the chunks
+        self.lexical = BM25Index(self.db)
+        self.lexical.backfill()
+        self.index = None
+        self.read_only = False
+        self.manifest = self.read_manifest()
+        if self.manifest is not None:
+            if self.manifest["embedding_model"] != embeddings.model_name:
+                raise ValueError(
+                    f"{path} was built with {self.manifest['embedding_model']} but queries are embedded "
+                    f"with {embeddings.model_name}; re-index the documents"
+                )
+            self.index = self.load_index()
+            if self.maybe_rebuild():
+                self.save()
+
+    # Persistence
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.path, "manifest.json"), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def load_index(self):
+        index_file = os.path.join(self.path, "index.faiss")
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self.read_only = True
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            index = faiss.read_index(index_file)
+            self.read_only = False
+        self.tune(index, self.manifest["index_type"])
+        return index
+
+    def writable(self):
+        ''' Swap a memory-mapped read-only index for an in-memory copy before modifying it '''
+        if self.read_only:
+            self.index = faiss.read_index(os.path.join(self.path, "index.faiss"))
+            self.tune(self.index, self.manifest["index_type"])
+            self.read_only = False
+
+    def save(self):
+        index_file = os.path.join(self.path, "index.faiss")
+        faiss.write_index(self.index, index_file + ".tmp")
+        os.replace(index_file + ".tmp", index_file)
+        with open(os.path.join(self.path, "manifest.json"), "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file)
+
+    # FAISS index construction
+
+    @staticmethod
+    def tune(index, index_type):
+        if index_type == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efSearch = 64
+        elif index_type == "ivf":
+            faiss.extract_index_ivf(index).nprobe = 16
+
+    def new_index(self, index_type, dimension, vector_count):
+        if index_type == "flat":
+            index = faiss.index_factory(dimension, "IDMap2,Flat")
+        elif index_type == "hnsw":
+            index = faiss.index_factory(dimension, "IDMap2,HNSW32")
+        else:
+            # IVF indexes carry their own ids and need training on a sample of the vectors
+            nlist = max(1, min(int(4 * math.sqrt(vector_count)), vector_count // IVF_POINTS_PER_LIST))
+            index = faiss.index_factory(dimension, f"IVF{nlist},Flat")
+            index.train(self.sample_vectors(max(nlist * IVF_POINTS_PER_LIST, 10000)))
+        self.tune(index, index_type)
+        return index
+
+    def sample_vectors(self, count):
+        rows = self.db.execute("SELECT vector FROM chunks ORDER BY RANDOM() LIMIT ?", (count,)).fetchall()
+        return np.vstack([np.frombuffer(vector, dtype=np.float32) for vector, in rows])
+
+    def rebuild(self, index_type):
+        vector_count = self.chunk_count()
+        self.index = self.new_index(index_type, self.manifest["dimension"], vector_count)
+        self.read_only = False
+        cursor = self.db.execute("SELECT id, vector FROM chunks ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            self.index.add_with_ids(np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]), ids)
+        self.manifest.update(index_type=index_type, stale=0)
+
+    def maybe_rebuild(self):
+        wanted = self.index_type_setting
+        if wanted == "auto":
+            wanted = choose_index_type(self.chunk_count())
+        if wanted == "ivf" and self.chunk_count() < IVF_MIN_VECTORS:
+            wanted = "flat"
+        if wanted != self.manifest["index_type"] or self.manifest["stale"] > 0.2 * max(self.index.ntotal, 1):
+            self.rebuild(wanted)
+            return True
+        return False
+
+    def restore(self):
+        ''' Undo a failed change: roll the database back and reload the index as last saved '''
+        self.db.rollback()
+        self.manifest = self.read_manifest()
+        self.index = self.load_index() if self.manifest is not None else None
+
+    # Documents
+
+    def chunk_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def documents(self):
+        return [
+            {"doc_id": doc_id, "path": path, "chunks": chunks, "indexed": indexed}
+            for doc_id, path, chunks, indexed in self.db.execute("SELECT doc_id, path, chunks, indexed FROM documents ORDER BY path")
+        ]
+
+    def add_document(self, file_path, chunks, batch_size=64):
+        ''' Index (text, metadata) chunks of file_path, replacing an earlier version of it.
+
+        Returns the number of chunks; an unchanged file is not re-indexed. If anything
+        fails, including a file without text, the earlier version stays indexed.
+        '''
+        doc_id = document_id(file_path)
+        digest = file_digest(file_path) if os.path.isfile(file_path) else None
+        with self.lock:
+            row = self.db.execute("SELECT digest, chunks FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is not None and digest is not None and row[0] == digest:
+                return row[1]
+            try:
+                self.delete_chunks(doc_id)
+
+                count, batch = 0, []
+                for text, metadata in chunks:
+                    batch.append((text, metadata))
+                    if len(batch) == batch_size:
+                        self.add_batch(doc_id, batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    self.add_batch(doc_id, batch)
+                    count += len(batch)
+                if count == 0:
+                    raise ValueError(f"No text found in {file_path}")
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, os.path.abspath(file_path), digest, count, time.time()),
+                )
+                self.maybe_rebuild()
+                self.db.commit()
+            except Exception:
+                self.restore()
+                raise
+            self.save()
+            return count
+
+    def add_batch(self, doc_id, batch):
+        vectors = np.asarray(self.embeddings.embed_documents([text for text, _ in batch]), dtype=np.float32)
+        if self.index is None:
+            self.manifest = {
+                "embedding_model": self.embeddings.model_name,
+                "dimension": vectors.shape[1],
+                "index_type": "flat" if self.index_type_setting in ("auto", "ivf") else self.index_type_setting,
+                "stale": 0,
+            }
+            self.index = self.new_index(self.manifest["index_type"], vectors.shape[1], len(batch))
+        self.writable()
+        first_id = self.db.execute("SELECT value FROM counters WHERE name = 'next_chunk_id'").fetchone()[0]
+        self.db.execute("UPDATE counters SET value = ? WHERE name = 'next_chunk_id'", (first_id + len(batch),))
+        ids = np.arange(first_id, first_id + len(batch), dtype=np.int64)
+        self.db.executemany(
+            "INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+            [(int(chunk_id), doc_id, text, json.dumps(metadata), vector.tobytes())
+             for chunk_id, (text, metadata), vector in zip(ids, batch, vectors)],
+        )
+        self.index.add_with_ids(vectors, ids)
+        self.lexical.add(ids.tolist(), [text for text, _ in batch])
+
+    def delete_document(self, file_path):
+        doc_id = document_id(file_path)
+        with self.lock:
+            try:
+                removed = self.delete_chunks(doc_id)
+                if removed:
+                    self.maybe_rebuild()
+                self.db.commit()
+            except Exception:
+                self.restore()
+                raise
+            if removed:
+                self.save()
+            return removed
+
+    def delete_chunks(self, doc_id):
+        ids = np.array([row[0] for row in self.db.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))], dtype=np.int64)
+        self.db.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+        self.lexical.delete(ids.tolist())
+        self.db.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+        if len(ids) and self.index is not None:
+            self.writable()
+            if self.manifest["index_type"] == "hnsw":
+                self.manifest["stale"] += len(ids)
+            else:
+                self.index.remove_ids(ids)
+        return len(ids)
+
+    # Search
+
+    def search(self, question, k=4, documents=None, mode="hybrid"):
+        ''' k best chunks as LangChain Documents, optionally only from the given file paths.
+
+        mode "vector" ranks by embedding distance, "lexical" by BM25 alone (no embedding
+        call), "hybrid" fuses both rankings with reciprocal rank fusion and "prefilter"
+        takes the BM25 candidates and reranks them by embedding distance exactly.
+        '''
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode}, expected one of {', '.join(RETRIEVAL_MODES)}")
+        with self.lock:
+            if self.index is None or self.chunk_count() == 0:
+                raise ValueError("No documents have been indexed yet; upload a document first.")
+            doc_ids = None
+            if documents is not None:
+                doc_ids = list({document_id(path) for path in documents})
+                if not doc_ids:
+                    return []
+
+            if mode == "lexical":
+                return self.fetch_chunks(self.lexical.search(question, k, doc_ids))
+
+            query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+            if query.shape[0] != self.manifest["dimension"]:
+                raise ValueError(f"Query embedding has dimension {query.shape[0]}, index expects {self.manifest['dimension']}")
+
+            if mode == "prefilter":
+                candidates = [chunk_id for chunk_id, _ in self.lexical.search(question, PREFILTER_CANDIDATES, doc_ids)]
+                if candidates:
+                    return self.fetch_chunks(self.exact_ranking(query, k, "id", candidates))
+                # No query term occurs in the corpus; fall back to the dense search
+
+            if mode == "hybrid":
+                depth = k * FUSION_DEPTH
+                fused = reciprocal_rank_fusion([
+                    self.dense_ranking(query, depth, doc_ids),
+                    self.lexical.search(question, depth, doc_ids),
+                ])
+                return self.fetch_chunks(fused[:k])
+            return self.fetch_chunks(self.dense_ranking(query, k, doc_ids))
+
+    def dense_ranking(self, query, k, doc_ids):
+        ''' Up to k (chunk id, squared L2 distance), nearest first '''
+        if doc_ids is not None:
+            filtered = self.db.execute(
+                f"SELECT COUNT(*) FROM chunks WHERE doc_id IN ({','.join('?' * len(doc_ids))})", doc_ids
+            ).fetchone()[0]
+            if filtered <= EXACT_FILTER_LIMIT:
+                return self.exact_ranking(query, k, "doc_id", doc_ids)
+
+        # Over-fetch to make up for stale and filtered-out ids
+        fetch = k + self.manifest["stale"]
+        while True:
+            distances, ids = self.index.search(query[None, :], min(fetch, self.index.ntotal))
+            ranked = [(int(chunk_id), float(distance)) for chunk_id, distance in zip(ids[0], distances[0]) if chunk_id >= 0]
+            live = self.live_ids([chunk_id for chunk_id, _ in ranked], doc_ids)
+            ranked = [(chunk_id, distance) for chunk_id, distance in ranked if chunk_id in live]
+            if len(ranked) >= k or fetch >= self.index.ntotal:
+                return ranked[:k]
+            fetch *= 4
+
+    def exact_ranking(self, query, k, column, values):
+        ''' Exact nearest chunks among those whose column is in values '''
+        rows = []
+        for start in range(0, len(values), 500):
+            batch = values[start:start + 500]
+            rows += self.db.execute(
+                f"SELECT id, vector FROM chunks WHERE {column} IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+        if not rows:
+            return []
+        vectors = np.vstack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows])
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return [(rows[i][0], float(distances[i])) for i in order]
+
+    def live_ids(self, ids, doc_ids):
+        ''' The ids still stored (HNSW keeps stale ones), restricted to doc_ids when given '''
+        if not ids:
+            return set()
+        sql = f"SELECT id FROM chunks WHERE id IN ({','.join('?' * len(ids))})"
+        params = list(ids)
+        if doc_ids is not None:
+            sql += f" AND doc_id IN ({','.join('?' * len(doc_ids))})"
+            params += doc_ids
+        return {row[0] for row in self.db.execute(sql, params)}
+
+    def fetch_chunks(self, ranked):
+        ''' LangChain Documents for [(chunk id, score), ...], in the given order '''
+        if not ranked:
+            return []
+        rows = {
+            row[0]: row[1:] for row in self.db.execute(
+                f"SELECT id, doc_id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(ranked))})",
+                [chunk_id for chunk_id, _ in ranked],
+            )
+        }
+        hits = []
+        for chunk_id, score in ranked:
+            if chunk_id not in rows:
+                continue
+            doc_id, text, metadata = rows[chunk_id]
+            metadata = dict(json.loads(metadata), doc_id=doc_id, chunk_id=chunk_id, score=score)
+            hits.append(Document(page_content=text, metadata=metadata))
+        return hits
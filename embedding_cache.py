@@ -0,0 +1,128 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.sqlite")
+
+
+def content_key(text, model_name):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    ''' Persistent embedding store keyed by hash(chunk text, embedding model name).
+
+    Vectors are stored as float32 blobs in SQLite. When the stored vectors exceed
+    max_bytes, the least recently used ones are evicted.
+    '''
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.stored_bytes = self.total_bytes()
+
+    def get_many(self, texts, model_name):
+        ''' Cached vectors for texts, as {position in texts: vector} '''
+        keys = [content_key(text, model_name) for text in texts]
+        found = {}
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self.connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(time.time(), key) for key in found]
+                )
+                self.connection.commit()
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(set(keys)) - len(found)
+        return {i: np.frombuffer(found[key], dtype=np.float32).tolist() for i, key in enumerate(keys) if key in found}
+
+    def put_many(self, texts, vectors, model_name):
+        now = time.time()
+        rows = [
+            (content_key(text, model_name), model_name, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.connection.commit()
+            # Replaced rows make this an overestimate; evict() recounts before deleting
+            self.stored_bytes += sum(len(row[2]) for row in rows)
+            if self.stored_bytes > self.max_bytes:
+                self.evict()
+
+    def total_bytes(self):
+        return self.connection.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def evict(self):
+        total = self.stored_bytes = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        # Drop the oldest entries until 90% of the limit is left, to avoid evicting on every insert
+        excess = total - int(self.max_bytes * 0.9)
+        removed, freed = [], 0
+        for key, size in self.connection.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if freed >= excess:
+                break
+            removed.append((key,))
+            freed += size
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", removed)
+        self.connection.commit()
+        self.stored_bytes -= freed
+        self.stats["evictions"] += len(removed)
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedEmbeddings(Embeddings):
+    ''' Wraps an embedding provider so only texts missing from the cache reach it '''
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts, self.model_name)
+        # Identical chunks inside one batch are embedded once
+        missing = list(dict.fromkeys(text for i, text in enumerate(texts) if i not in vectors))
+        if missing:
+            embedded = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(missing, [embedded[text] for text in missing], self.model_name)
+            for i, text in enumerate(texts):
+                if i not in vectors:
+                    vectors[i] = embedded[text]
+        return [vectors[i] for i in range(len(texts))]
+
+    def embed_query(self, text):
+        # Providers may embed queries differently from documents (e.g. Google's task types)
+        model_name = f"{self.model_name}#query"
+        cached = self.cache.get_many([text], model_name)
+        if cached:
+            return cached[0]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([text], [vector], model_name)
+        return vector
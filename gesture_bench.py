@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import argparse
+import handmodule as hm
+from gesture_engine import GestureEngine, PLUGINS, load_plugin
+
+STAGES = ("decode", "convert", "inference", "gesture")
+
+
+def load_labels(path):
+    ''' Labeled gesture events: a JSON list of {"time": seconds into the recording, "action": "swipe forward"} '''
+    with open(path, "r", encoding="utf-8") as file:
+        return sorted(json.load(file), key=lambda label: label["time"])
+
+def labels_for(path):
+    ''' The labels stored next to a recording as <name>.json, or None '''
+    label_path = os.path.splitext(path)[0] + ".json"
+    return load_labels(label_path) if os.path.exists(label_path) else None
+
+def match_events(events, labels, tolerance):
+    ''' Number of labels matched by a recognized event with the same action within tolerance seconds '''
+    unmatched = sorted((timestamp, action) for timestamp, _, action in events)
+    matched = 0
+    for label in labels:
+        for i, (timestamp, action) in enumerate(unmatched):
+            if action == label["action"] and abs(timestamp - label["time"]) <= tolerance:
+                matched += 1
+                del unmatched[i]
+                break
+    return matched
+
+def run_replay(path, plugins, policy, tolerance):
+    ''' Replay a video file or an NPZ landmark trace headless and measure speed and accuracy '''
+    if path.endswith(".npz"):
+        stream = detector = hm.LandmarkTrace(path)
+    else:
+        stream = hm.VideoSource(path)
+        detector = hm.HandDetector(maxHands=1, detectionCon=0.7, trackCon=0.7, policy=policy)
+    engine = GestureEngine(stream, detector, plugins, show=False, actuate=False, verbose=False)
+    # Keep every latency sample instead of the rolling window of the live overlay
+    engine.stats = hm.PipelineStats(stream, window=None)
+    started = time.perf_counter()
+    try:
+        engine.run()
+    finally:
+        stream.stop()
+    elapsed = time.perf_counter() - started
+
+    frames = engine.frames
+    seconds = dict(engine.stageSeconds, convert=detector.convertSeconds, inference=detector.inferenceSeconds)
+    result = {
+        "input": os.path.basename(path),
+        "frames": frames,
+        "fps": frames / elapsed if elapsed > 0 else None,
+        "stage_ms": {stage: 1000 * seconds[stage] / frames if frames else None for stage in STAGES},
+        "latency_p50_ms": engine.stats.latencyMs(50),
+        "latency_p95_ms": engine.stats.latencyMs(95),
+        "events": [{"time": timestamp, "plugin": name, "action": action} for timestamp, name, action in engine.events],
+        "precision": None,
+        "recall": None,
+    }
+    labels = labels_for(path)
+    if labels is not None:
+        matched = match_events(engine.events, labels, tolerance)
+        result["labels"] = len(labels)
+        result["precision"] = matched / len(engine.events) if engine.events else None
+        result["recall"] = matched / len(labels) if labels else 1.0
+    return result
+
+def print_table(results):
+    columns = ["input", "frames", "FPS"] + [f"{stage} ms" for stage in STAGES]
+    columns += ["p50 ms", "p95 ms", "events", "precision", "recall"]
+
+    def number(value, fmt):
+        return "-" if value is None else format(value, fmt)
+
+    rows = []
+    for result in results:
+        rows.append([result["input"], str(result["frames"]), number(result["fps"], ".0f")]
+                    + [number(result["stage_ms"][stage], ".2f") for stage in STAGES]
+                    + [number(result["latency_p50_ms"], ".1f"), number(result["latency_p95_ms"], ".1f"),
+                       str(len(result["events"])), number(result["precision"], ".2f"), number(result["recall"], ".2f")])
+    widths = [max(len(row[i]) for row in rows + [columns]) for i in range(len(columns))]
+    print("  ".join(name.rjust(width) for name, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+def compare(results, baseline, tolerance, slowdown):
+    ''' Print accuracy drops and slowdowns against an earlier run; returns True if any exceeds its limit '''
+    previous = {result["input"]: result for result in baseline}
+    regressed = False
+    for result in results:
+        before = previous.get(result["input"])
+        if before is None:
+            continue
+        for name in ("precision", "recall"):
+            now, then = result[name], before.get(name)
+            if now is not None and then is not None and then - now > tolerance:
+                regressed = True
+                print(f"REGRESSION {name} {then:.3f} -> {now:.3f} for {result['input']}")
+        if result["fps"] and before.get("fps") and before["fps"] / result["fps"] > slowdown:
+            regressed = True
+            print(f"REGRESSION FPS {before['fps']:.0f} -> {result['fps']:.0f} for {result['input']}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded videos or landmark traces through the gesture engine, headless")
+    parser.add_argument("inputs", nargs="+", metavar="PATH",
+                        help="video files or .npz traces from gesture_engine.py --record; "
+                             "labels are read from <name>.json next to each one")
+    parser.add_argument("--enable", nargs="*", default=["swipe", "fist"], metavar="NAME",
+                        help=f"plugins to run (built in: {', '.join(PLUGINS)})")
+    parser.add_argument("--plugin", action="append", default=[], metavar="MODULE:CLASS",
+                        help="register an extra GesturePlugin subclass")
+    parser.add_argument("--full-frame", action="store_true", help="disable downscaling, crops and idle mode for videos")
+    parser.add_argument("--match-window", type=float, default=0.5,
+                        help="seconds a recognized gesture may be away from its label")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON of an earlier run; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="allowed precision/recall drop against the baseline")
+    parser.add_argument("--slowdown", type=float, default=1.5, help="allowed FPS ratio against the baseline")
+    args = parser.parse_args()
+
+    for spec in args.plugin:
+        load_plugin(spec)
+    policy = None if args.full_frame else hm.InferencePolicy()
+    results = [run_replay(path, args.enable, policy, args.match_window) for path in args.inputs]
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance, args.slowdown):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import sys
+import time
+import argparse
+import importlib
+import threading
+import cv2
+import numpy as np
+import handmodule as hm
+
+# Gesture plugins by name; user plugins are added with register_plugin or --plugin module:Class
+PLUGINS = {}
+
+
+def register_plugin(cls):
+    PLUGINS[cls.name] = cls
+    return cls
+
+def load_plugin(spec):
+    ''' Import and register a plugin class given as "module:Class" '''
+    module_name, _, class_name = spec.partition(":")
+    return register_plugin(getattr(importlib.import_module(module_name), class_name))
+
+
+class GesturePlugin:
+    ''' A gesture consuming the landmarks the engine computes once per frame.
+
+    update() is called for every frame while the plugin is enabled, with the (21, 3)
+    pixel landmarks of the first hand and its HandFeatures, or None for both when no
+    hand is visible. It returns a short description of the gesture it recognized, or
+    None. Plugins only press keys or change settings while actuate is True.
+    '''
+    name = None
+    actuate = True
+
+    def __init__(self):
+        self.enabled = False
+
+    def update(self, hand, features, timestamp):
+        return None
+
+    def draw(self, img, hand):
+        pass
+
+    def close(self):
+        ''' Release threads or devices the plugin holds; called when it is disabled '''
+        pass
+
+
+@register_plugin
+class SwipePlugin(GesturePlugin):
+    ''' Horizontal swipes with all fingers press the left/right arrow keys '''
+    name = "swipe"
+
+    def __init__(self):
+        super().__init__()
+        from handgest import SwipeDetector
+
+        self.detector = SwipeDetector()
+
+    def update(self, hand, features, timestamp):
+        # Swipes are ignored while the hand is a fist, as in handgest
+        self.detector.detect_fist(features)
+        if not self.detector.update_positions(hand, timestamp) or self.detector.fist_closed:
+            return None
+        swipe_type = self.detector.detect_swipe()
+        if swipe_type not in ('forward', 'backward'):
+            return None
+        if self.actuate:
+            import pyautogui
+
+            pyautogui.press('left' if swipe_type == 'forward' else 'right')
+        return f"swipe {swipe_type}"
+
+
+@register_plugin
+class FistPlugin(GesturePlugin):
+    ''' Reports when the hand closes into a fist '''
+    name = "fist"
+
+    def __init__(self):
+        super().__init__()
+        from handgest import SwipeDetector
+
+        # The fist check of handgest, shared with the swipe plugin so their thresholds agree
+        self.detector = SwipeDetector()
+        self.closed = False
+
+    def update(self, hand, features, timestamp):
+        closed = self.detector.detect_fist(features)
+        changed = closed and not self.closed
+        self.closed = closed
+        return "fist" if changed else None
+
+
+@register_plugin
+class PinchVolumePlugin(GesturePlugin):
+    ''' Thumb-index pinch distance sets the master volume through a smoothed, rate-limited VolumeActuator.
+
+    Reports "volume NN%" whenever the pinch moves to another step of the volume scale,
+    also when it does not actuate, so replays and benchmarks see the gesture.
+    '''
+    name = "volume"
+
+    def __init__(self, pinch_range=(20, 250), step=0.1):
+        super().__init__()
+        self.pinch_range = pinch_range
+        self.step = step
+        self.actuator = None
+        self.reported = None
+
+    def update(self, hand, features, timestamp):
+        if features is None:
+            if self.actuator is not None:
+                self.actuator.reset()
+            return None
+        level = float(np.interp(features.pinch, self.pinch_range, (0.0, 1.0)))
+        if self.actuate:
+            if self.actuator is None:
+                from volume_actuator import VolumeActuator, create_backend
+
+                self.actuator = VolumeActuator(create_backend()).start()
+            self.actuator.set_target(level, timestamp)
+        stepped = round(level / self.step) * self.step
+        if self.reported is not None and abs(stepped - self.reported) < self.step / 2:
+            return None
+        self.reported = stepped
+        return f"volume {stepped:.0%}"
+
+    def close(self):
+        if self.actuator is not None:
+            self.actuator.stop()
+            self.actuator = None
+
+    def draw(self, img, hand):
+        if hand is None:
+            return
+        (x1, y1), (x2, y2) = hand[[4, 8], :2].astype(int).tolist()
+        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+        cv2.circle(img, (x1, y1), 15, (255, 0, 255), cv2.FILLED)
+        cv2.circle(img, (x2, y2), 15, (255, 0, 255), cv2.FILLED)
+        cv2.line(img, (x1, y1), (x2, y2), (255, 0, 0), 3)
+        color = (0, 255, 0) if hm.pinchDistance(hand) < self.pinch_range[0] else (255, 0, 255)
+        cv2.circle(img, (cx, cy), 15, color, cv2.FILLED)
+
+
+class GestureEngine:
+    ''' Owns the frame source and one HandDetector and feeds every enabled plugin from a single inference per frame.
+
+    With show=False nothing is drawn or displayed, so it runs without a display; with
+    actuate=False plugins only report gestures, for replays and benchmarks.
+    '''
+
+    def __init__(self, stream, detector=None, plugins=None, show=True, actuate=True, verbose=True):
+        self.stream = stream
+        self.detector = detector or hm.HandDetector(maxHands=1, detectionCon=0.7, trackCon=0.7)
+        self.stats = hm.PipelineStats(stream)
+        self.history = hm.LandmarkHistory()
+        self.show = show
+        self.actuate = actuate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.plugins = {}
+        self.running = False
+        # Recognized gestures as (frame timestamp, plugin, action) and time spent per stage
+        self.events = []
+        self.frames = 0
+        self.stageSeconds = {"decode": 0.0, "gesture": 0.0}
+        self.recorder = None
+        for name in plugins or []:
+            self.enable(name)
+
+    def enable(self, name):
+        with self.lock:
+            if name not in self.plugins:
+                if name not in PLUGINS:
+                    print(f"Unknown gesture plugin: {name}")
+                    return False
+                self.plugins[name] = PLUGINS[name]()
+                self.plugins[name].actuate = self.actuate
+            self.plugins[name].enabled = True
+        return True
+
+    def disable(self, name):
+        with self.lock:
+            plugin = self.plugins.get(name)
+            if plugin is None or not plugin.enabled:
+                return
+            plugin.enabled = False
+        plugin.close()
+
+    def enabled(self):
+        with self.lock:
+            return [plugin for plugin in self.plugins.values() if plugin.enabled]
+
+    def step(self):
+        ''' Process the newest frame; returns it (drawn on when showing), or None when the source ended '''
+        started = time.perf_counter()
+        img, capture_time = self.stream.read()
+        if img is None:
+            return None
+        decoded = time.perf_counter()
+        # Replayed frames carry positions in the file, so latency is counted from the read
+        action_start = capture_time if self.stream.live else started
+        img = self.detector.findHands(img, draw=self.show, timestamp=capture_time)
+        self.stats.inferenceDone()
+        if self.recorder is not None:
+            self.recorder.add(self.detector, capture_time, img.shape)
+        inferred = time.perf_counter()
+
+        hand = self.detector.hand()
+        features = None
+        if hand is not None:
+            self.history.push(hand, capture_time)
+            features = hm.HandFeatures(hand, self.history)
+        else:
+            self.history.clear()
+
+        plugins = self.enabled()
+        for plugin in plugins:
+            try:
+                action = plugin.update(hand, features, capture_time)
+            except Exception as e:
+                print(f"Gesture plugin {plugin.name} failed and was disabled: {e}")
+                self.disable(plugin.name)
+                continue
+            if action:
+                self.events.append((capture_time, plugin.name, action))
+                if self.verbose:
+                    print(f"{plugin.name}: {action}")
+            if self.show:
+                plugin.draw(img, hand)
+        if hand is not None and plugins:
+            self.stats.actionDone(action_start)
+        self.stageSeconds["decode"] += decoded - started
+        self.stageSeconds["gesture"] += time.perf_counter() - inferred
+        self.frames += 1
+        return img
+
+    def run(self):
+        self.running = True
+        while self.running:
+            img = self.step()
+            if img is None:
+                break
+            if self.show:
+                self.stats.draw(img)
+                cv2.imshow("Gesture Control", img)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        self.running = False
+
+    def close(self):
+        ''' Close every plugin, e.g. before the process exits '''
+        with self.lock:
+            plugins = list(self.plugins.values())
+        for plugin in plugins:
+            plugin.close()
+
+    def read_commands(self, stream):
+        ''' Apply "enable NAME", "disable NAME" and "quit" lines, e.g. typed on stdin '''
+        for line in stream:
+            command, _, name = line.strip().partition(" ")
+            if command == "enable":
+                self.enable(name)
+            elif command == "disable":
+                self.disable(name)
+            elif command == "quit":
+                self.running = False
+                return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run gesture plugins on one camera and one hand detector")
+    parser.add_argument("--enable", nargs="*", default=["swipe", "fist"], metavar="NAME",
+                        help=f"plugins to start with (built in: {', '.join(PLUGINS)})")
+    parser.add_argument("--plugin", action="append", default=[], metavar="MODULE:CLASS",
+                        help="register an extra GesturePlugin subclass")
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--width", type=int, help="camera frame width to ask the driver for")
+    parser.add_argument("--height", type=int, help="camera frame height to ask the driver for")
+    parser.add_argument("--video", metavar="PATH", help="read frames from a video file instead of the camera")
+    parser.add_argument("--trace", metavar="PATH", help="replay landmarks recorded with --record instead of detecting")
+    parser.add_argument("--record", metavar="PATH", help="save the detected landmarks to an NPZ trace on exit")
+    parser.add_argument("--headless", action="store_true", help="do not draw or open a window")
+    parser.add_argument("--full-frame", action="store_true",
+                        help="run the detector on every full-size frame (no downscaling, crops or idle mode)")
+    parser.add_argument("--scale", type=float, default=0.5, help="downscale factor for detection")
+    parser.add_argument("--no-roi", action="store_true", help="do not crop around the tracked hand")
+    parser.add_argument("--idle-after", type=int, default=30, help="frames without a hand before idling")
+    parser.add_argument("--idle-interval", type=float, default=0.5, help="seconds between detections while idle")
+    args = parser.parse_args(argv)
+
+    for spec in args.plugin:
+        load_plugin(spec)
+    if args.trace:
+        stream = detector = hm.LandmarkTrace(args.trace)
+    else:
+        stream = hm.VideoSource(args.video) if args.video else hm.CameraStream(args.camera, args.width, args.height).start()
+        policy = None if args.full_frame else hm.InferencePolicy(
+            scale=args.scale, roi=not args.no_roi, idleAfter=args.idle_after, idleInterval=args.idle_interval)
+        detector = hm.HandDetector(maxHands=1, detectionCon=0.7, trackCon=0.7, policy=policy)
+    engine = GestureEngine(stream, detector, plugins=args.enable, show=not args.headless)
+    if args.record:
+        engine.recorder = hm.LandmarkRecorder()
+    threading.Thread(target=engine.read_commands, args=(sys.stdin,), daemon=True).start()
+    try:
+        engine.run()
+    finally:
+        print(engine.stats.report())
+        print(engine.detector.inferenceReport())
+        engine.close()
+        stream.stop()
+        if engine.recorder is not None:
+            engine.recorder.save(args.record)
+        if engine.show:
+            cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import time
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+PREVIEW_WIDTH = 640
+PREVIEW_HEIGHT = 480
+HEADER_BYTES = 64
+STATS_INTERVAL = 1.0
+
+
+class PreviewBuffer:
+    ''' Two BGR frame slots in shared memory: the worker fills one while the GUI paints the other.
+
+    The header holds [sequence, slot, height, width] of the newest complete frame, so
+    the GUI can wrap the frame in a QImage in place instead of receiving a copy, plus
+    the number of the frame being written. The sequence is a seqlock around the header:
+    it is odd while the header changes, and readers retry until it is the same even
+    number before and after reading it. A reader that is slower than two frames can
+    tell from intact() that its slot was reused.
+    '''
+
+    def __init__(self, name=None, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT):
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=HEADER_BYTES + 2 * width * height * 3)
+        self.header = np.ndarray(5, dtype=np.int64, buffer=self.shm.buf)
+        self.slots = np.ndarray((2, height, width, 3), dtype=np.uint8, buffer=self.shm.buf, offset=HEADER_BYTES)
+        if self.owner:
+            self.header[:] = 0
+
+    def write(self, img):
+        import cv2
+
+        h, w = img.shape[:2]
+        scale = min(1.0, self.slots.shape[2] / w, self.slots.shape[1] / h)
+        if scale < 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            h, w = img.shape[:2]
+        number = int(self.header[4]) + 1
+        slot = number % 2
+        # Announced first: the slot still holds frame number - 2, which a slow reader may be painting
+        self.header[4] = number
+        self.slots[slot, :h, :w] = img
+        self.header[0] += 1
+        self.header[1:4] = (slot, h, w)
+        self.header[0] += 1
+
+    def latest(self):
+        ''' (frame number, view of that frame); the view is None before the first frame '''
+        for _ in range(1000):
+            before = int(self.header[0])
+            slot, h, w = self.header[1:4].tolist()
+            if before % 2 == 0 and int(self.header[0]) == before:
+                number = before // 2
+                return number, self.slots[slot, :h, :w] if number else None
+        return 0, None
+
+    def intact(self, number):
+        ''' Whether the view latest() returned for frame number has not been overwritten since '''
+        return int(self.header[4]) < number + 2
+
+    def close(self):
+        # The NumPy views must go before the mapping can be closed
+        self.header = self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_worker(conn, preview_name, camera=0):
+    ''' Body of the worker process: keeps the detector loaded and runs the engine while gestures are enabled.
+
+    Commands arrive on conn as (command, argument): ("enable", names), ("disable", names),
+    ("pause", None), ("resume", None), ("configure", settings) and ("stop", None). The
+    worker answers with ("ready", plugins), ("state", state), ("stats", report),
+    ("gesture", (plugin, action)) and ("error", message). The camera is only open while
+    at least one gesture is enabled and the worker is not paused.
+    '''
+    preview = PreviewBuffer(preview_name)
+    stream = engine = None
+    try:
+        import handmodule as hm
+        from gesture_engine import GestureEngine, PLUGINS
+
+        detector = hm.HandDetector(maxHands=1, detectionCon=0.7, trackCon=0.7, policy=hm.InferencePolicy())
+        engine = GestureEngine(None, detector, show=False, verbose=False)
+        conn.send(("ready", list(PLUGINS)))
+        paused = False
+        enabled = []
+        last_stats = time.perf_counter()
+        running = True
+
+        while running:
+            # Block on the pipe while the camera is off, only poll it between frames
+            while running and conn.poll(0 if stream is not None else None):
+                command, argument = conn.recv()
+                if command == "enable":
+                    for name in argument:
+                        if not engine.enable(name):
+                            conn.send(("error", f"Unknown gesture plugin: {name}"))
+                elif command == "disable":
+                    for name in argument:
+                        engine.disable(name)
+                elif command == "pause":
+                    paused = True
+                elif command == "resume":
+                    paused = False
+                elif command == "configure":
+                    settings = dict(argument)
+                    engine.show = settings.pop("preview", engine.show)
+                    if "camera" in settings:
+                        camera = settings.pop("camera")
+                        if stream is not None:
+                            stream.stop()
+                            stream = None
+                    for key, value in settings.items():
+                        setattr(detector.policy, key, value)
+                elif command == "stop":
+                    running = False
+                    break
+
+                enabled = [plugin.name for plugin in engine.enabled()]
+                if enabled and not paused and stream is None:
+                    stream = hm.CameraStream(camera).start()
+                    if not stream.cap.isOpened():
+                        conn.send(("error", f"Could not open camera {camera}"))
+                        stream.stop()
+                        stream = None
+                    else:
+                        engine.stream = stream
+                        engine.stats = hm.PipelineStats(stream)
+                        engine.history.clear()
+                elif (not enabled or paused) and stream is not None:
+                    stream.stop()
+                    stream = None
+                conn.send(("state", {"enabled": enabled, "paused": paused, "camera": stream is not None}))
+
+            if not running or stream is None:
+                continue
+            img = engine.step()
+            if img is None:
+                conn.send(("error", "The camera stopped delivering frames"))
+                stream.stop()
+                stream = None
+                conn.send(("state", {"enabled": [plugin.name for plugin in engine.enabled()], "paused": paused, "camera": False}))
+                continue
+            # A plugin that raised was disabled by the engine; the GUI has to hear about it
+            if len(engine.enabled()) != len(enabled):
+                enabled = [plugin.name for plugin in engine.enabled()]
+                if not enabled:
+                    stream.stop()
+                    stream = None
+                conn.send(("state", {"enabled": enabled, "paused": paused, "camera": stream is not None}))
+                if stream is None:
+                    continue
+            if engine.show:
+                preview.write(img)
+            for _, name, action in engine.events:
+                conn.send(("gesture", (name, action)))
+            engine.events.clear()
+
+            now = time.perf_counter()
+            if now - last_stats >= STATS_INTERVAL:
+                last_stats = now
+                conn.send(("stats", dict(engine.stats.report(), **detector.inferenceReport())))
+    except (EOFError, BrokenPipeError):
+        pass
+    except Exception as e:
+        conn.send(("error", f"Gesture worker stopped: {type(e).__name__}: {e}"))
+    finally:
+        if engine is not None:
+            engine.close()
+        if stream is not None:
+            stream.stop()
+        preview.close()
+
+
+class GestureWorker:
+    ''' GUI-side handle on the gesture worker process.
+
+    The process imports OpenCV and MediaPipe and builds the hand graph once, then stays
+    warm: enabling and disabling gestures is a message on the control pipe instead of a
+    new process. Preview frames come back through a PreviewBuffer in shared memory.
+    '''
+
+    def __init__(self, camera=0):
+        self.preview = PreviewBuffer()
+        # Spawned rather than forked, so the worker does not inherit the Qt threads of the GUI
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_worker, args=(child_conn, self.preview.shm.name, camera),
+                               name="gesture-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def send(self, command, argument=None):
+        try:
+            self.conn.send((command, argument))
+            return True
+        except (BrokenPipeError, OSError) as e:
+            print(f"Gesture worker is not running: {e}")
+            return False
+
+    def enable(self, names):
+        return self.send("enable", sorted(names))
+
+    def disable(self, names):
+        return self.send("disable", sorted(names))
+
+    def pause(self):
+        return self.send("pause")
+
+    def resume(self):
+        return self.send("resume")
+
+    def configure(self, **settings):
+        ''' preview=bool, camera=index, or InferencePolicy fields such as scale or idleAfter '''
+        return self.send("configure", settings)
+
+    def messages(self):
+        ''' Messages the worker sent since the last call, without blocking '''
+        received = []
+        try:
+            while self.conn.poll():
+                received.append(self.conn.recv())
+        except (EOFError, OSError):
+            pass
+        return received
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self, timeout=2.0):
+        self.send("stop")
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+        self.preview.close()
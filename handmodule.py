@@ -1,10 +1,39 @@
 import cv2
 import mediapipe as mp
+import numpy as np
 import time
+import threading
+from collections import deque
+
+WRIST = 0
+FINGERTIPS = np.array([4, 8, 12, 16, 20])
+# (base, middle, tip) joints per finger, thumb to pinky, for the bend angle at the middle joint
+FINGER_JOINTS = np.array([[2, 3, 4], [5, 6, 8], [9, 10, 12], [13, 14, 16], [17, 18, 20]])
+
+
+class InferencePolicy:
+    ''' Adaptive inference settings for HandDetector.
+
+    Full frames are downscaled by scale before detection. While all maxHands hands are
+    tracked only a crop around their last bounding box (grown by roiMargin of its size
+    on each side) is processed, with a full frame every redetectEvery frames to pick up
+    other hands. Crops go to a separate static-image detector, so the video-mode tracker
+    only ever sees whole frames and its coordinates stay consistent.
+    After idleAfter frames without a hand, detection only runs every idleInterval
+    seconds until a hand shows up again.
+    '''
+
+    def __init__(self, scale=0.5, roi=True, roiMargin=0.5, redetectEvery=15, idleAfter=30, idleInterval=0.5):
+        self.scale = scale
+        self.roi = roi
+        self.roiMargin = roiMargin
+        self.redetectEvery = redetectEvery
+        self.idleAfter = idleAfter
+        self.idleInterval = idleInterval
 
 
 class HandDetector:
-    def __init__(self, mode=False, maxHands=2, detectionCon=0.5, trackCon=0.5):
+    def __init__(self, mode=False, maxHands=2, detectionCon=0.5, trackCon=0.5, policy=None):
         self.mode = mode
         self.maxHands = maxHands
         self.detectionCon = detectionCon
@@ -17,64 +46,494 @@ class HandDetector:
             min_detection_confidence=self.detectionCon,
             min_tracking_confidence=self.trackCon
         )
+        self.cropHands = None
         self.mpDraw = mp.solutions.drawing_utils
 
-    def findHands(self, img, draw=True):
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(imgRGB)
+        # Landmarks of the last processed frame, preallocated once: (hand, landmark, x/y/z).
+        # Only the first handCount hands are valid; handedness is 0 for left, 1 for right.
+        self.landmarks = np.zeros((maxHands, 21, 3), dtype=np.float32)
+        self.pixelLandmarks = np.zeros((maxHands, 21, 3), dtype=np.float32)
+        self.worldLandmarks = np.zeros((maxHands, 21, 3), dtype=np.float32)
+        self.handedness = np.full(maxHands, -1, dtype=np.int8)
+        self.handCount = 0
+        self.scale = np.ones(3, dtype=np.float32)
+
+        # Adaptive inference (None processes every full frame) and what it saved
+        self.policy = policy
+        self.roi = None
+        self.framesWithoutHand = 0
+        self.framesSinceFull = 0
+        self.lastInference = 0.0
+        self.inferenceCounts = {"full": 0, "roi": 0, "skipped": 0}
+        self.convertSeconds = 0.0
+        self.inferenceSeconds = 0.0
+        self.wallStart = time.perf_counter()
+        self.cpuStart = time.process_time()
+
+    def findHands(self, img, draw=True, timestamp=None):
+        ''' Detect hands in img; timestamp (default now) is the frame time the idle mode counts in '''
+        now = time.perf_counter() if timestamp is None else timestamp
+        if self.idle(now):
+            self.inferenceCounts["skipped"] += 1
+            self.handCount = 0
+            return img
+        started = time.perf_counter()
+        region, roi = self.inputRegion(img)
+        imgRGB = cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
+        converted = time.perf_counter()
+        self.results = (self.hands if roi is None else self.croppedHands()).process(imgRGB)
+        if roi is not None:
+            self.mapToFrame(roi, img.shape)
+        self.updateLandmarks(img.shape)
+        self.convertSeconds += converted - started
+        self.inferenceSeconds += time.perf_counter() - converted
+        self.inferenceCounts["full" if roi is None else "roi"] += 1
+        self.framesSinceFull = 0 if roi is None else self.framesSinceFull + 1
+        self.lastInference = now
+        self.updatePolicy(img.shape)
         if self.results.multi_hand_landmarks:
             for handLms in self.results.multi_hand_landmarks:
                 if draw:
                     self.mpDraw.draw_landmarks(img, handLms, self.mpHands.HAND_CONNECTIONS)
         return img
 
+    def croppedHands(self):
+        ''' Detector for crops; tracking would carry landmarks between differently placed crops '''
+        if self.cropHands is None:
+            self.cropHands = self.mpHands.Hands(
+                static_image_mode=True,
+                max_num_hands=self.maxHands,
+                min_detection_confidence=self.detectionCon,
+            )
+        return self.cropHands
+
+    def idle(self, now=None):
+        policy = self.policy
+        now = time.perf_counter() if now is None else now
+        return (policy is not None and self.framesWithoutHand >= policy.idleAfter
+                and now - self.lastInference < policy.idleInterval)
+
+    def inputRegion(self, img):
+        ''' The (possibly cropped and downscaled) image to run detection on, and the crop used '''
+        if self.policy is None:
+            return img, None
+        roi = self.roi if self.framesSinceFull < self.policy.redetectEvery else None
+        region = img
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            region = img[y0:y1, x0:x1]
+        # Crops are only shrunk to the size a downscaled full frame would have
+        width = int(img.shape[1] * self.policy.scale)
+        if region.shape[1] > width:
+            factor = width / region.shape[1]
+            region = cv2.resize(region, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        return region, roi
+
+    def mapToFrame(self, roi, shape):
+        ''' Convert landmarks detected in a crop to coordinates normalized to the whole frame '''
+        x0, y0, x1, y1 = roi
+        h, w = shape[:2]
+        for handLms in self.results.multi_hand_landmarks or []:
+            for lm in handLms.landmark:
+                lm.x = (lm.x * (x1 - x0) + x0) / w
+                lm.y = (lm.y * (y1 - y0) + y0) / h
+                lm.z = lm.z * (x1 - x0) / w
+
+    def updatePolicy(self, shape):
+        if self.policy is None:
+            return
+        if self.handCount == 0:
+            self.framesWithoutHand += 1
+            self.roi = None
+            return
+        self.framesWithoutHand = 0
+        # A crop around the hands found so far would hide one that is still missing
+        if not self.policy.roi or self.handCount < self.maxHands:
+            self.roi = None
+            return
+        h, w = shape[:2]
+        points = self.pixelLandmarks[:self.handCount, :, :2].reshape(-1, 2)
+        low, high = points.min(axis=0), points.max(axis=0)
+        size = max(float((high - low).max()) * (1 + 2 * self.policy.roiMargin), min(w, h) / 3)
+        cx, cy = (low + high) / 2
+        x0, y0 = int(max(0, cx - size / 2)), int(max(0, cy - size / 2))
+        x1, y1 = int(min(w, cx + size / 2)), int(min(h, cy + size / 2))
+        self.roi = (x0, y0, x1, y1) if x1 - x0 < w or y1 - y0 < h else None
+
+    def inferenceReport(self):
+        ''' Frames processed in full, as a crop or skipped while idle, and the time and CPU they cost '''
+        processed = self.inferenceCounts["full"] + self.inferenceCounts["roi"]
+        wall = time.perf_counter() - self.wallStart
+        return {
+            "full_frames": self.inferenceCounts["full"],
+            "roi_frames": self.inferenceCounts["roi"],
+            "skipped_frames": self.inferenceCounts["skipped"],
+            "convert_ms": 1000 * self.convertSeconds / processed if processed else None,
+            "inference_ms": 1000 * self.inferenceSeconds / processed if processed else None,
+            "cpu_percent": 100 * (time.process_time() - self.cpuStart) / wall if wall > 0 else None,
+            "idle": self.policy is not None and self.framesWithoutHand >= self.policy.idleAfter,
+        }
+
+    def updateLandmarks(self, shape):
+        hands = self.results.multi_hand_landmarks or []
+        self.handCount = min(len(hands), self.maxHands)
+        if self.handCount == 0:
+            return
+        h, w = shape[:2]
+        # MediaPipe scales z roughly like x
+        self.scale[:] = (w, h, w)
+        worldHands = self.results.multi_hand_world_landmarks or []
+        labels = self.results.multi_handedness or []
+        for i in range(self.handCount):
+            self.landmarks[i] = [(lm.x, lm.y, lm.z) for lm in hands[i].landmark]
+            if i < len(worldHands):
+                self.worldLandmarks[i] = [(lm.x, lm.y, lm.z) for lm in worldHands[i].landmark]
+            if i < len(labels):
+                self.handedness[i] = labels[i].classification[0].label == "Right"
+        np.multiply(self.landmarks[:self.handCount], self.scale, out=self.pixelLandmarks[:self.handCount])
+        self.handedness[self.handCount:] = -1
+
+    def hand(self, handNo=0):
+        ''' Pixel landmarks of one hand as a (21, 3) view, or None if it was not detected '''
+        if handNo >= self.handCount:
+            return None
+        return self.pixelLandmarks[handNo]
+
     def findPosition(self, img, handNo=0, draw = True):
         lmList = []
-        if self.results.multi_hand_landmarks:
-            myHand = self.results.multi_hand_landmarks[handNo]
-            for id, lm in enumerate(myHand.landmark):
-                # print(id, lm)
-
-                # h- height w-width c-channels
-                h, w, c = img.shape
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                #print(id, cx, cy)
+        if handNo < self.handCount:
+            for id, (cx, cy) in enumerate(self.pixelLandmarks[handNo, :, :2].astype(int).tolist()):
                 lmList.append([id, cx, cy])
-                #if draw:
-                #    cv2.circle(img, (cx, cy), 15, (255, 0, 255), cv2.FILLED)
-
         return lmList
 
 
+class LandmarkHistory:
+    ''' Fixed-size ring buffer of one hand's landmarks over the last frames '''
 
-def main():
-    pTime = 0
-    cTime = 0
+    def __init__(self, length=10):
+        self.length = length
+        self.frames = np.zeros((length, 21, 3), dtype=np.float32)
+        self.times = np.zeros(length, dtype=np.float64)
+        self.count = 0
+        self.next = 0
+
+    def push(self, hand, timestamp):
+        self.frames[self.next] = hand
+        self.times[self.next] = timestamp
+        self.next = (self.next + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+    def full(self):
+        return self.count == self.length
+
+    def clear(self):
+        self.count = 0
+        self.next = 0
+
+    def oldest(self):
+        return (self.next - self.count) % self.length
+
+    def newest(self):
+        return (self.next - 1) % self.length
+
+    def displacement(self, points=FINGERTIPS):
+        ''' Movement of the given landmarks from the oldest to the newest frame, (len(points), 3) '''
+        return self.frames[self.newest(), points] - self.frames[self.oldest(), points]
+
+    def velocity(self, points=FINGERTIPS):
+        ''' Average velocity of the given landmarks over the buffer, in units per second '''
+        elapsed = self.times[self.newest()] - self.times[self.oldest()]
+        if self.count < 2 or elapsed <= 0:
+            return np.zeros((len(points), 3), dtype=np.float32)
+        return self.displacement(points) / elapsed
+
+
+class HandFeatures:
+    ''' Features of one hand in one frame, computed once and shared by all gesture detectors '''
+
+    def __init__(self, hand, history=None):
+        self.hand = hand
+        self.tipDistances = fingertipDistances(hand)
+        self.pinch = pinchDistance(hand)
+        self.angles = fingerAngles(hand)
+        self.velocity = history.velocity() if history is not None else None
+
+
+def fingertipDistances(hand):
+    ''' 2D distance of each fingertip (thumb to pinky) to the wrist '''
+    return np.linalg.norm(hand[FINGERTIPS, :2] - hand[WRIST, :2], axis=1)
+
+def pinchDistance(hand):
+    ''' 2D distance between the thumb tip and the index fingertip '''
+    return float(np.linalg.norm(hand[4, :2] - hand[8, :2]))
+
+def fingerAngles(hand):
+    ''' Bend of each finger at its middle joint in degrees; 180 is straight '''
+    base, middle, tip = hand[FINGER_JOINTS[:, 0]], hand[FINGER_JOINTS[:, 1]], hand[FINGER_JOINTS[:, 2]]
+    a, b = base - middle, tip - middle
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-6)
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+
+class CameraStream:
+    ''' Reads camera frames on a dedicated thread into a small ring buffer.
+
+    read() always returns the newest frame and skips the ones the detector was too slow
+    for, so gestures act on what the camera sees now instead of on frames queued in the
+    driver. Every frame carries the time it was captured, for end-to-end latency.
+    '''
+    live = True
+
+    def __init__(self, src=0, width=None, height=None, bufferSize=2):
+        self.cap = cv2.VideoCapture(src)
+        if width is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # Ask the driver to keep as few frames as possible; not every backend honours it
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.frames = deque(maxlen=bufferSize)
+        self.condition = threading.Condition()
+        self.running = False
+        self.frameId = 0
+        self.lastRead = 0
+        self.dropped = 0
+        self.captureTimes = deque(maxlen=60)
+        self.thread = threading.Thread(target=self.update, name="camera-capture", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def update(self):
+        while self.running:
+            success, img = self.cap.read()
+            timestamp = time.perf_counter()
+            with self.condition:
+                if not success:
+                    self.running = False
+                    self.condition.notify_all()
+                    break
+                self.frameId += 1
+                self.frames.append((self.frameId, timestamp, img))
+                self.captureTimes.append(timestamp)
+                self.condition.notify_all()
+
+    def read(self, timeout=None):
+        ''' Newest frame not returned before, as (img, capture timestamp); (None, None) once the camera stops or on timeout '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: not self.running or (self.frames and self.frames[-1][0] > self.lastRead), timeout):
+                return None, None
+            if not self.frames or self.frames[-1][0] <= self.lastRead:
+                return None, None
+            frameId, timestamp, img = self.frames[-1]
+            self.dropped += frameId - self.lastRead - 1 if self.lastRead else 0
+            self.lastRead = frameId
+            return img, timestamp
+
+    def captureFps(self):
+        with self.condition:
+            if len(self.captureTimes) < 2:
+                return 0.0
+            return (len(self.captureTimes) - 1) / (self.captureTimes[-1] - self.captureTimes[0])
 
-    cap = cv2.VideoCapture(0)
+    def stop(self):
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+        self.cap.release()
+
+
+class VideoSource:
+    ''' Every frame of a video file in order, with the same interface as CameraStream.
+
+    Timestamps are positions in the video in seconds rather than wall-clock capture
+    times, so replays give the same gestures however fast they run.
+    '''
+    live = False
+
+    def __init__(self, path):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            print(f"Could not open video {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frameId = 0
+        self.dropped = 0
+
+    def start(self):
+        return self
+
+    def read(self, timeout=None):
+        success, img = self.cap.read()
+        if not success:
+            return None, None
+        self.frameId += 1
+        return img, (self.frameId - 1) / self.fps
+
+    def captureFps(self):
+        return self.fps
+
+    def stop(self):
+        self.cap.release()
+
+
+class LandmarkRecorder:
+    ''' Collects the detector's landmarks frame by frame for replay with LandmarkTrace '''
+
+    def __init__(self):
+        self.times = []
+        self.counts = []
+        self.frames = []
+        self.handedness = []
+        self.shape = None
+
+    def add(self, detector, timestamp, shape):
+        self.shape = shape
+        self.times.append(timestamp)
+        self.counts.append(detector.handCount)
+        self.frames.append(detector.pixelLandmarks.copy())
+        self.handedness.append(detector.handedness.copy())
+
+    def save(self, path):
+        ''' Write the trace as a compressed NPZ file; timestamps start at 0 '''
+        times = np.array(self.times, dtype=np.float64)
+        np.savez_compressed(path, times=times - times[0] if len(times) else times,
+                            counts=np.array(self.counts, dtype=np.int8),
+                            landmarks=np.array(self.frames, dtype=np.float32),
+                            handedness=np.array(self.handedness, dtype=np.int8),
+                            shape=np.array(self.shape or (480, 640, 3)))
+        print(f"Saved {len(times)} frames of landmarks to {path}")
+
+
+class LandmarkTrace:
+    ''' Replays a LandmarkRecorder file as both the frame source and the hand detector.
+
+    Frames are blank images of the recorded size, so gesture logic can be replayed and
+    tuned without a camera, a video decoder or MediaPipe inference.
+    '''
+    live = False
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.times = data["times"]
+            self.counts = data["counts"]
+            self.frames = data["landmarks"]
+            self.handednessFrames = data["handedness"]
+            self.img = np.zeros(tuple(data["shape"]), dtype=np.uint8)
+        self.maxHands = self.frames.shape[1] if len(self.frames) else 1
+        self.index = -1
+        self.dropped = 0
+        self.handCount = 0
+        self.pixelLandmarks = np.zeros((self.maxHands, 21, 3), dtype=np.float32)
+        self.handedness = np.full(self.maxHands, -1, dtype=np.int8)
+        self.convertSeconds = 0.0
+        self.inferenceSeconds = 0.0
+
+    def start(self):
+        return self
+
+    def read(self, timeout=None):
+        self.index += 1
+        if self.index >= len(self.times):
+            return None, None
+        return self.img, float(self.times[self.index])
+
+    def captureFps(self):
+        if len(self.times) < 2 or self.times[-1] <= self.times[0]:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def stop(self):
+        pass
+
+    def findHands(self, img, draw=True, timestamp=None):
+        started = time.perf_counter()
+        self.handCount = int(self.counts[self.index])
+        self.pixelLandmarks = self.frames[self.index]
+        self.handedness = self.handednessFrames[self.index]
+        self.inferenceSeconds += time.perf_counter() - started
+        return img
+
+    def hand(self, handNo=0):
+        if handNo >= self.handCount:
+            return None
+        return self.pixelLandmarks[handNo]
+
+    def inferenceReport(self):
+        frames = self.index + 1
+        return {"replayed_frames": frames, "inference_ms": 1000 * self.inferenceSeconds / frames if frames else None}
+
+
+class PipelineStats:
+    ''' Capture FPS, inference FPS and glass-to-action latency of the gesture loop '''
+
+    def __init__(self, stream, window=60):
+        self.stream = stream
+        self.inferenceTimes = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def inferenceDone(self):
+        self.inferenceTimes.append(time.perf_counter())
+
+    def actionDone(self, captureTime):
+        ''' Call right after acting on a frame, with the capture timestamp of that frame '''
+        self.latencies.append(time.perf_counter() - captureTime)
+
+    def inferenceFps(self):
+        if len(self.inferenceTimes) < 2:
+            return 0.0
+        return (len(self.inferenceTimes) - 1) / (self.inferenceTimes[-1] - self.inferenceTimes[0])
+
+    def latencyMs(self, percentile=50):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def report(self):
+        return {
+            "capture_fps": self.stream.captureFps(),
+            "inference_fps": self.inferenceFps(),
+            "latency_p50_ms": self.latencyMs(50),
+            "latency_p95_ms": self.latencyMs(95),
+            "dropped_frames": self.stream.dropped,
+        }
+
+    def draw(self, img):
+        report = self.report()
+        lines = [f"Capture: {report['capture_fps']:.0f} FPS", f"Inference: {report['inference_fps']:.0f} FPS"]
+        if report["latency_p50_ms"] is not None:
+            lines.append(f"Latency: {report['latency_p50_ms']:.0f} ms (p95 {report['latency_p95_ms']:.0f})")
+        for i, line in enumerate(lines):
+            cv2.putText(img, line, (10, 30 + 30 * i), cv2.FONT_HERSHEY_PLAIN, 2, (255, 0, 255), 2)
+
+
+def main():
+    stream = CameraStream(0).start()
+    stats = PipelineStats(stream)
     detector = HandDetector()
 
     while True:
-        success, img = cap.read()
-        if not success:
+        img, captureTime = stream.read()
+        if img is None:
             break
 
         img = detector.findHands(img)
         lmList = detector.findPosition(img)
+        stats.inferenceDone()
         if len(lmList) !=0:
             print(lmList[4])
+            stats.actionDone(captureTime)
 
-        cTime = time.time()
-        fps = 1 / (cTime - pTime)
-        pTime = cTime
-
-        cv2.putText(img, str(int(fps)), (10, 70), cv2.FONT_HERSHEY_PLAIN, 3, (255, 0, 255), 3)
+        stats.draw(img)
 
         cv2.imshow('Image', img)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
-    cap.release()
+    stream.stop()
     cv2.destroyAllWindows()
 
 
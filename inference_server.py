@@ -0,0 +1,352 @@
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# A client with this many unread tokens that reads nothing for STALL_TIMEOUT seconds is dropped
+TOKEN_BUFFER = 64
+STALL_TIMEOUT = 30.0
+
+
+class ServerBusy(Exception):
+    """Raised by the client when the server's request queue is full."""
+
+
+def check_params(params):
+    ''' Raise ValueError for completion parameters the engine cannot run '''
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    prompt = params.get("prompt")
+    if not (isinstance(prompt, str) or isinstance(prompt, list) and prompt and all(type(token) is int for token in prompt)):
+        raise ValueError("prompt must be a string or a non-empty list of token ids")
+    if "max_tokens" in params and not (type(params["max_tokens"]) is int and params["max_tokens"] > 0):
+        raise ValueError("max_tokens must be a positive integer")
+    for name in ("temperature", "top_p"):
+        if name in params and not (type(params[name]) in (int, float) and params[name] >= 0):
+            raise ValueError(f"{name} must be a number of at least 0")
+    stop = params.get("stop")
+    if not (stop is None or isinstance(stop, str) or isinstance(stop, list) and all(isinstance(s, str) for s in stop)):
+        raise ValueError("stop must be a string or a list of strings")
+
+
+class InferenceRequest:
+    ''' One completion request queued on the engine, with its own token stream.
+
+    send() never blocks the engine thread, so a slow client cannot hold up the others;
+    it is dropped once TOKEN_BUFFER tokens wait unread and it has read nothing for
+    STALL_TIMEOUT seconds.
+    '''
+
+    def __init__(self, params):
+        self.params = params
+        self.key = json.dumps(params, sort_keys=True)
+        self.stream = queue.Queue()
+        self.cancelled = False
+        self.enqueued = time.perf_counter()
+        self.last_read = self.enqueued
+
+    def send(self, message):
+        if self.cancelled:
+            return
+        if self.stream.qsize() >= TOKEN_BUFFER and time.perf_counter() - self.last_read > STALL_TIMEOUT:
+            self.cancelled = True
+            message = {"error": f"dropped after reading nothing for {STALL_TIMEOUT:.0f} s"}
+        self.stream.put(message)
+
+    def receive(self):
+        message = self.stream.get()
+        self.last_read = time.perf_counter()
+        return message
+
+
+class InferenceEngine:
+    ''' Owns the Llama model and serves queued completion requests from a single thread.
+
+    llama-cpp-python decodes one sequence at a time, so batching works on the queue:
+    requests that arrive within batch_window are drained together, identical requests
+    share a single generation, and the rest run in the order that best reuses the KV
+    cache left by the previous generation.
+    '''
+
+    def __init__(self, model, max_queue=32, max_batch=8, batch_window=0.005):
+        self.model = model
+        self.llama = model.client
+        self.requests = queue.Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.stats = {"requests": 0, "generations": 0, "coalesced": 0, "rejected": 0}
+        self.thread = threading.Thread(target=self.run, name="inference-engine", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.requests.put(None)
+
+    def submit(self, request):
+        try:
+            self.requests.put_nowait(request)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise ServerBusy("inference queue is full")
+        self.stats["requests"] += 1
+
+    def run(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+
+            groups = OrderedDict()
+            for request in batch:
+                groups.setdefault(request.key, []).append(request)
+            self.stats["coalesced"] += len(batch) - len(groups)
+
+            # A request that fails only fails its own group, never the engine thread
+            pending = []
+            for group in groups.values():
+                try:
+                    pending.append((self.tokenize(group[0].params["prompt"]), group))
+                except Exception as e:
+                    self.fail(group, e)
+            while pending:
+                # Prefer the prompt sharing the longest prefix with the current KV cache
+                cached = self.llama._input_ids.tolist()
+                best = max(range(len(pending)),
+                           key=lambda i: self.llama.longest_token_prefix(cached, pending[i][0]))
+                tokens, group = pending.pop(best)
+                try:
+                    self.generate(tokens, group)
+                except Exception as e:
+                    self.fail(group, e)
+
+    @staticmethod
+    def fail(group, error):
+        for request in group:
+            request.send({"error": f"{type(error).__name__}: {error}"})
+
+    def tokenize(self, prompt):
+        if isinstance(prompt, str):
+            return self.llama.tokenize(prompt.encode("utf-8"))
+        return list(prompt)
+
+    def generate(self, tokens, group):
+        params = group[0].params
+        reused = self.llama.longest_token_prefix(self.llama._input_ids.tolist(), tokens)
+        start_time = time.perf_counter()
+        generated = 0
+        try:
+            stream = self.llama.create_completion(
+                tokens,
+                max_tokens=params.get("max_tokens", self.model.max_tokens),
+                temperature=params.get("temperature", self.model.temperature),
+                top_p=params.get("top_p", self.model.top_p),
+                stop=params.get("stop"),
+                stream=True,
+            )
+            for chunk in stream:
+                live = [request for request in group if not request.cancelled]
+                if not live:
+                    break
+                generated += 1
+                for request in live:
+                    request.send({"token": chunk["choices"][0]["text"]})
+        except Exception as e:
+            for request in group:
+                request.send({"error": str(e)})
+            return
+        finally:
+            self.stats["generations"] += 1
+
+        seconds = time.perf_counter() - start_time
+        for request in group:
+            request.send({"done": True, "stats": {
+                "prompt_tokens": len(tokens),
+                "reused_tokens": reused,
+                "prefilled_tokens": len(tokens) - reused,
+                "generated_tokens": generated,
+                "queue_seconds": start_time - request.enqueued,
+                "seconds": seconds,
+                "shared_with": len(group) - 1,
+            }})
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    ''' JSON-lines protocol: one request object per line, replies streamed as lines '''
+
+    def handle(self):
+        engine = self.server.engine
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                op = message.get("op")
+                if op == "info":
+                    self.reply({
+                        "model_path": engine.model.model_path,
+                        "n_ctx": engine.llama.n_ctx(),
+                        "max_tokens": engine.model.max_tokens,
+                        "temperature": engine.model.temperature,
+                        "top_p": engine.model.top_p,
+                        "stats": engine.stats,
+                    })
+                elif op == "tokenize":
+                    self.reply({"tokens": engine.llama.tokenize(message["text"].encode("utf-8"))})
+                elif op == "complete":
+                    self.complete(engine, message["params"])
+                else:
+                    self.reply({"error": f"unknown op: {op}"})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.reply({"error": str(e)})
+
+    def complete(self, engine, params):
+        check_params(params)
+        request = InferenceRequest(params)
+        try:
+            engine.submit(request)
+        except ServerBusy as e:
+            self.reply({"error": str(e), "busy": True})
+            return
+        try:
+            while True:
+                message = request.receive()
+                self.reply(message)
+                if "done" in message or "error" in message:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            request.cancelled = True
+            raise
+
+    def reply(self, message):
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class InferenceServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, engine, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__((host, port), RequestHandler)
+        self.engine = engine
+
+
+class InferenceClient:
+    ''' Connection to a shared InferenceServer exposing the llama_cpp.Llama calls ChatSession uses '''
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.last_stats = {}
+
+    def request(self, message):
+        connection = socket.create_connection(self.address, timeout=self.timeout)
+        with connection, connection.makefile("rwb") as stream:
+            stream.write(json.dumps(message).encode("utf-8") + b"\n")
+            stream.flush()
+            for line in stream:
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise (ServerBusy if reply.get("busy") else RuntimeError)(reply["error"])
+                yield reply
+                if message["op"] != "complete" or "done" in reply:
+                    return
+
+    def info(self):
+        return next(self.request({"op": "info"}))
+
+    def tokenize(self, text):
+        return next(self.request({"op": "tokenize", "text": text.decode("utf-8")}))["tokens"]
+
+    def create_completion(self, prompt, max_tokens=None, temperature=None, top_p=None, stop=None, stream=True):
+        ''' Streamed completion; chunks have the same shape as llama_cpp's ({"choices": [{"text": ...}]}) '''
+        params = {"prompt": prompt, "stop": stop}
+        for name, value in (("max_tokens", max_tokens), ("temperature", temperature), ("top_p", top_p)):
+            if value is not None:
+                params[name] = value
+        for reply in self.request({"op": "complete", "params": params}):
+            if "done" in reply:
+                self.last_stats = reply["stats"]
+            else:
+                yield {"choices": [{"text": reply["token"]}]}
+
+
+class RemoteModel:
+    ''' Stand-in for the LangChain LlamaCpp model when the shared server owns the weights '''
+
+    def __init__(self, client):
+        info = client.info()
+        self.client = client
+        self.model_path = info["model_path"]
+        self.n_ctx = info["n_ctx"]
+        self.max_tokens = info["max_tokens"]
+        self.temperature = info["temperature"]
+        self.top_p = info["top_p"]
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+def connect(address):
+    ''' RemoteModel for "host:port", or None if no server is reachable there '''
+    host, port = parse_address(address)
+    try:
+        return RemoteModel(InferenceClient(host, port))
+    except OSError as e:
+        print(f"Could not reach the inference server at {host}:{port}: {e}")
+        return None
+
+
+def main():
+    from chatbot import load_model
+
+    parser = argparse.ArgumentParser(description="Shared local inference server for the Llama model")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-queue", type=int, default=32, help="queued requests before clients get 'busy'")
+    parser.add_argument("--max-batch", type=int, default=8, help="requests drained from the queue together")
+    args = parser.parse_args()
+
+    model = load_model()
+    if model is None:
+        print("Failed to initialize the LLaMA model.")
+        return
+
+    engine = InferenceEngine(model, max_queue=args.max_queue, max_batch=args.max_batch)
+    engine.start()
+    with InferenceServer(engine, args.host, args.port) as server:
+        print(f"Serving {model.model_path} on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.stop()
+
+
+if __name__ == "__main__":
+    main()
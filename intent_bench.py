@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from sysaction import CommandGrammar, GRAMMAR
+from router import Router
+
+PARSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data", "intent_parses.json")
+# Apps the expected parses treat as installed, so the table gives the same result on every machine
+BENCH_APPS = {"firefox", "visual studio code"}
+
+
+def check_parses(grammar, cases):
+    ''' Print every expected parse (and chat route, where given) next to the actual one; returns the number of mismatches '''
+    router = Router(commands=grammar)
+    failures = 0
+    width = max(len(case["text"]) for case in cases)
+    for case in cases:
+        intent = grammar.parse(case["text"])
+        actual = None if intent is None else {
+            "action": intent.action, "amount": intent.amount, "unit": intent.unit, "argument": intent.argument}
+        expected = None if case["action"] is None else {
+            "action": case["action"], "amount": case.get("amount"), "unit": case.get("unit"), "argument": case.get("argument")}
+        route = router.route(case["text"]).kind if "route" in case else None
+        ok = actual == expected and route == case.get("route")
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {case['text'].ljust(width)}  {intent}"
+              + (f" -> {route}" if route else "")
+              + ("" if ok else f"  expected {expected}" + (f" -> {case['route']}" if route else "")))
+    return failures
+
+def time_parses(grammar, texts, repeat):
+    ''' Per-parse latency in microseconds over repeat passes of all texts '''
+    latencies = []
+    for _ in range(repeat):
+        for text in texts:
+            started = time.perf_counter()
+            grammar.parse(text)
+            latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the system command grammar")
+    parser.add_argument("--parses", default=PARSES,
+                        help="JSON list of {text, action, amount, unit, argument} and optionally the chat route")
+    parser.add_argument("--repeat", type=int, default=2000, help="timing passes over all texts")
+    args = parser.parse_args()
+
+    with open(args.parses, "r", encoding="utf-8") as file:
+        cases = json.load(file)
+    started = time.perf_counter()
+    grammar = CommandGrammar(GRAMMAR, find_app=lambda name: name if name in BENCH_APPS else None)
+    compile_us = (time.perf_counter() - started) * 1e6
+
+    failures = check_parses(grammar, cases)
+    latencies = time_parses(grammar, [case["text"] for case in cases], args.repeat)
+    print(f"{len(cases)} commands, {failures} mismatches; compile {compile_us:.0f} us, "
+          f"parse p50 {np.percentile(latencies, 50):.1f} us, p95 {np.percentile(latencies, 95):.1f} us")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
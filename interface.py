@@ -1,6 +1,7 @@
+from startup import profiler
 import sys
 import os
-import subprocess
+import argparse
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -15,29 +16,177 @@ from PyQt5.QtWidgets import (
     QSizePolicy,
     QLineEdit,
 )
-from PyQt5.QtGui import QFont, QPalette, QColor
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from chatbot import load_model, generate_response
-from rag_model import (
-    read_pdf,
-    read_word,
-    read_text,
-    read_csv_excel,
-    get_text_chunks,
-    get_vector_store,
-    user_input,
-)
-from sysaction import SystemController
+from PyQt5 import sip
+from PyQt5.QtGui import QFont, QPalette, QColor, QTextCursor, QImage, QPainter
+from PyQt5.QtCore import Qt, QThread, QTimer, QRect, pyqtSignal
 
 
-class ChatWindow(QWidget):
-    def __init__(self, model, is_rag=False):
+class ModelLoader(QThread):
+    ''' Imports the LLM stack and loads the GGUF model while the window is already on screen.
+
+    model_loaded always fires, with the model or with None and the reason it failed.
+    '''
+    model_loaded = pyqtSignal(object, str)
+
+    def __init__(self, server=None):
         super().__init__()
+        self.server = server
+
+    def run(self):
+        try:
+            model = self.load()
+        except Exception as e:
+            print(f"Failed to load the language model: {e}")
+            self.model_loaded.emit(None, f"{type(e).__name__}: {e}")
+            return
+        if model is None:
+            where = f"the inference server at {self.server}" if self.server else "the model file"
+            self.model_loaded.emit(None, f"could not load {where}, see the console for details")
+        else:
+            self.model_loaded.emit(model, "")
+
+    def load(self):
+        if self.server:
+            inference_server = profiler.import_module("inference_server")
+            with profiler.measure("connect to inference server"):
+                return inference_server.connect(self.server)
+
+        for module in ("langchain_core.callbacks", "llama_cpp", "langchain_community.llms", "chatbot"):
+            profiler.import_module(module)
+        chatbot = sys.modules["chatbot"]
+        with profiler.measure("load_model"):
+            return chatbot.load_model()
+
+
+class LLMWorker(QThread):
+    ''' Runs one generation off the GUI thread and streams tokens back through Qt signals '''
+    token_received = pyqtSignal(str)
+    response_ready = pyqtSignal(str, dict)
+    generation_failed = pyqtSignal(str)
+
+    def __init__(self, session, query):
+        super().__init__()
+        from chatbot import StreamHandler
+
+        self.session = session
+        self.query = query
+        # Set when the chat is cleared, so replies still queued for the GUI are dropped
+        self.discarded = False
+        # Signal emission is thread-safe; Qt queues the slot call onto the GUI thread
+        self.handler = StreamHandler(on_token=self.token_received.emit)
+
+    def generate(self):
+        return self.session.generate(self.query, callbacks=[self.handler])
+
+    def run(self):
+        from chatbot import GenerationCancelled
+
+        try:
+            response = self.generate()
+            stats = dict(self.handler.stats(), cancelled=False)
+        except GenerationCancelled:
+            response = self.handler.text().strip()
+            stats = dict(self.handler.stats(), cancelled=True)
+        except Exception as e:
+            self.generation_failed.emit(str(e))
+            return
+        self.response_ready.emit(response, stats)
+
+    def cancel(self):
+        self.handler.cancel()
+
+
+class RAGWorker(LLMWorker):
+    ''' Answers a question from the indexed documents, streaming the local model's answer '''
+
+    def __init__(self, model, query):
+        super().__init__(None, query)
         self.model = model
+        self.context = ""
+
+    def generate(self):
+        rag_model = profiler.import_module("rag_model")
+        try:
+            response = rag_model.user_input(self.query, model=self.model, callbacks=[self.handler])
+        except ValueError as e:
+            self.token_received.emit(str(e))
+            return str(e)
+        if response["backend"] == "local":
+            self.context = (f"context {response['context_tokens']} tokens, "
+                            f"{response['context_sentences']} sentences from {response['retrieved_chunks']} chunks")
+        else:
+            self.context = f"answered by {response['backend']}"
+        return response["output_text"]
+
+
+class CommandWorker(QThread):
+    ''' Runs a system command off the GUI thread, since it may call audio APIs and subprocesses '''
+    done = pyqtSignal(object)
+
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.discarded = False
+
+    def run(self):
+        self.done.emit(self.function(*self.args))
+
+
+class IngestWorker(QThread):
+    ''' Parses and indexes documents in a process pool, reporting each file as it finishes '''
+    file_indexed = pyqtSignal(dict)
+
+    def __init__(self, paths):
+        super().__init__()
+        self.paths = paths
+
+    def run(self):
+        rag_model = profiler.import_module("rag_model")
+        rag_model.index_documents(self.paths, on_result=self.file_indexed.emit)
+
+
+class ChatWindow(QWidget):
+    session_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_session.pkl")
+    cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.json")
+    router_log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "router_log.jsonl")
+
+    def __init__(self, model=None, is_rag=False):
+        super().__init__()
+        self.model = None
         self.is_rag = is_rag
-        self.history = []
+        self.session = None
+        self.model_loading = False
+        self.worker = None
+        self.router = None
+        self.command_worker = None
 
         self.initUI()
+        if model is not None:
+            self.set_model(model)
+
+    def set_model(self, model, error=""):
+        self.model = model
+        self.model_loading = False
+        if model is None:
+            message = f"The language model failed to load: {error or 'unknown error'}."
+            if self.is_rag:
+                message += " Answers come from Gemini instead."
+            self.status_label.setText(message)
+            return
+        if self.is_rag:
+            return
+
+        from chatbot import ChatSession, ResponseCache
+
+        self.session = ChatSession(model, cache=ResponseCache(self.cache_path))
+        self.status_label.setText("")
+        self.restore_session()
+
+    def set_warming_up(self):
+        self.model_loading = True
+        if not self.is_rag:
+            self.status_label.setText("Warming up the language model...")
 
     def initUI(self):
         self.setWindowTitle("AI ChatBot" if not self.is_rag else "RAG")
@@ -51,6 +200,11 @@ class ChatWindow(QWidget):
         self.chat_history.setFont(QFont("Arial", 14))
         layout.addWidget(self.chat_history)
 
+        # Generation stats (time to first token, tokens/sec)
+        self.status_label = QLabel("")
+        self.status_label.setFont(QFont("Arial", 10))
+        layout.addWidget(self.status_label)
+
         # Input Box and Buttons
         input_layout = QHBoxLayout()
         layout.addLayout(input_layout)
@@ -62,6 +216,12 @@ class ChatWindow(QWidget):
             upload_button.setMaximumSize(100, 80)
             input_layout.addWidget(upload_button)
 
+            folder_button = QPushButton("🗃️")
+            folder_button.clicked.connect(self.upload_folder)
+            folder_button.setMinimumSize(80, 80)
+            folder_button.setMaximumSize(100, 80)
+            input_layout.addWidget(folder_button)
+
         self.input_box = QTextEdit()
         self.input_box.setFont(QFont("Arial", 14))
         self.input_box.setMaximumSize(700, 100)
@@ -73,6 +233,13 @@ class ChatWindow(QWidget):
         enter_button.setMaximumSize(100, 80)
         input_layout.addWidget(enter_button)
 
+        self.stop_button = QPushButton("⏹")
+        self.stop_button.clicked.connect(self.stop_generation)
+        self.stop_button.setMinimumSize(80, 80)
+        self.stop_button.setMaximumSize(100, 80)
+        self.stop_button.setEnabled(False)
+        input_layout.addWidget(self.stop_button)
+
         clear_button = QPushButton("🧹")
         clear_button.clicked.connect(self.clear_chat)
         clear_button.setMinimumSize(80, 80)
@@ -107,6 +274,9 @@ class ChatWindow(QWidget):
         )
 
     def send_message(self):
+        if self.worker is not None or self.command_worker is not None:
+            return
+
         user_query = self.input_box.toPlainText().strip()
         self.input_box.clear()
 
@@ -115,71 +285,201 @@ class ChatWindow(QWidget):
 
         self.display_message("You: " + user_query, "user")
 
-        if self.is_rag:
-            response = self.get_rag_response(user_query)
-        else:
-            response = self.get_llm_response(user_query)
+        # System commands and small talk are answered right away, even while the model is loading.
+        # Routing may look up installed apps, so it runs off the GUI thread together with the command
+        if self.router is None:
+            from router import Router
+
+            self.router = Router(log_path=self.router_log_path)
+        self.command_worker = CommandWorker(self.router.handle, user_query)
+        self.command_worker.done.connect(lambda route: self.finish_command(user_query, route))
+        self.command_worker.finished.connect(self.command_worker.deleteLater)
+        self.command_worker.start()
+
+    def finish_command(self, user_query, route):
+        worker, self.command_worker = self.command_worker, None
+        if worker.discarded:
+            return
+        if route.kind == "model":
+            if self.is_rag:
+                self.start_rag_response(user_query)
+            else:
+                self.start_llm_response(user_query)
+            return
+        self.display_message("BarsAI: " + route.answer, "ai")
+        self.status_label.setText(f"Answered without the model in {route.seconds * 1000:.1f} ms")
 
-        self.display_message("BarsAI: " + response, "ai")
+    def start_llm_response(self, user_query):
+        if self.model_loading:
+            self.display_message("BarsAI: Still warming up, please try again in a moment.", "ai")
+            return
+        if self.session is None:
+            self.display_message("BarsAI: The language model is not loaded.", "ai")
+            return
 
-    def get_llm_response(self, user_query):
-        response = generate_response(self.model, user_query, self.history)
-        self.history.extend([f"User Query: {user_query}", f"Assistant Response: {response}"])
-        return response
+        self.display_message("BarsAI: ", "ai")
+        self.status_label.setText("Generating...")
+        self.stop_button.setEnabled(True)
+
+        self.start_worker(LLMWorker(self.session, user_query))
+
+    def start_rag_response(self, user_query):
+        # Without the local model (still loading or failed) the answer comes from Gemini
+        self.display_message("BarsAI: ", "ai")
+        self.status_label.setText("Searching documents...")
+        self.stop_button.setEnabled(True)
+        self.start_worker(RAGWorker(None if self.model_loading else self.model, user_query))
+
+    def start_worker(self, worker):
+        self.worker = worker
+        self.worker.token_received.connect(self.append_token)
+        self.worker.response_ready.connect(self.finish_llm_response)
+        self.worker.generation_failed.connect(self.fail_llm_response)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.start()
+
+    def append_token(self, token):
+        if self.worker is not None and self.worker.discarded:
+            return
+        cursor = self.chat_history.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(token)
+        self.chat_history.setTextCursor(cursor)
+
+    def finish_llm_response(self, response, stats):
+        worker, self.worker = self.worker, None
+        self.stop_button.setEnabled(False)
+        if worker.discarded:
+            self.status_label.setText("")
+            return
+
+        if stats["cancelled"]:
+            self.append_token(" [stopped]")
 
-    def get_rag_response(self, user_query):
-        if hasattr(self, 'file_path'):
-            response = user_input(user_query, self.file_path)
-            return response['output_text']
+        if self.is_rag:
+            context = worker.context
         else:
-            return "Please upload a document first."
+            context = f"context {self.session.last_stats.get('budget_used', 0):.0%} of budget"
+        if not self.is_rag and self.session.last_stats.get("cached"):
+            self.status_label.setText("Answered from cache")
+        elif stats["time_to_first_token"] is None:
+            self.status_label.setText("")
+        else:
+            tokens_per_sec = stats["tokens_per_sec"] or 0.0
+            self.status_label.setText(
+                f"First token: {stats['time_to_first_token']:.2f} s | "
+                f"{stats['tokens']} tokens at {tokens_per_sec:.1f} tokens/s | {context}"
+            )
+
+    def fail_llm_response(self, error):
+        worker, self.worker = self.worker, None
+        self.stop_button.setEnabled(False)
+        self.status_label.setText("")
+        if worker.discarded:
+            return
+        self.append_token(f"[error: {error}]")
+
+    def stop_generation(self):
+        if isinstance(self.worker, LLMWorker):
+            self.worker.cancel()
 
     def display_message(self, message, message_type):
         self.chat_history.append(f'<p style="color: {"blue" if message_type == "user" else "green"};">{message}</p>')
 
     def clear_chat(self):
+        # Qt may already have queued a reply from the running worker; it must not land in the cleared chat
+        for worker in (self.worker, self.command_worker):
+            if worker is not None:
+                worker.discarded = True
+        self.stop_generation()
         self.chat_history.clear()
-        self.history = []
+        if self.session is not None:
+            self.session.reset()
+
+    def save_session(self):
+        if self.session is None or self.worker is not None:
+            return
+        self.session.cache.save()
+        if self.session.turns:
+            self.session.save(self.session_path)
+        elif os.path.exists(self.session_path):
+            os.remove(self.session_path)
+
+    def restore_session(self):
+        ''' Resume the last conversation together with its evaluated KV state '''
+        if self.session is None or not os.path.exists(self.session_path):
+            return
+        if self.session.load(self.session_path):
+            for query, response in self.session.turns:
+                self.display_message("You: " + query, "user")
+                self.display_message("BarsAI: " + response, "ai")
 
     def upload_document(self):
         options = QFileDialog.Options()
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Upload Document", "",
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Upload Documents", "",
             "All Files (*);;PDF Files (*.pdf);;Word Files (*.docx);;Text Files (*.txt);;CSV Files (*.csv);;Excel Files (*.xlsx)",
             options=options
         )
-        if file_path:
-            self.file_path = file_path
-            self.process_document(file_path)
-
-    def process_document(self, file_path):
-        file_extension = os.path.splitext(file_path)[1].lower()
-        if file_extension == '.pdf':
-            text = read_pdf(file_path)
-        elif file_extension == '.docx':
-            text = read_word(file_path)
-        elif file_extension in ('.txt', '.csv', '.xlsx'):
-            text = read_csv_excel(file_path) if file_extension in ('.csv', '.xlsx') else read_text(file_path)
-        else:
-            self.chat_history.append("<p>Unsupported file format.</p>")
+        if file_paths:
+            self.process_documents(file_paths)
+
+    def upload_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Upload Folder")
+        if folder:
+            self.process_documents([folder])
+
+    def process_documents(self, paths):
+        if self.worker is not None:
+            self.chat_history.append("<p>Please wait until the current answer or indexing has finished.</p>")
             return
 
-        chunks = get_text_chunks(text)
-        get_vector_store(chunks, file_path)
-        self.chat_history.append("<p>Document processed and indexed successfully!</p>")
+        self.status_label.setText("Indexing documents...")
+        self.worker = IngestWorker(paths)
+        self.worker.file_indexed.connect(self.on_document_indexed)
+        self.worker.finished.connect(self.on_ingest_finished)
+        self.worker.start()
+
+    def on_document_indexed(self, report):
+        name = os.path.basename(report["path"])
+        if report["error"] is not None:
+            self.chat_history.append(f"<p>Failed to index {name}: {report['error']}</p>")
+            return
+        rate = report["segments"] / report["parse_seconds"] if report["parse_seconds"] > 0 else 0.0
+        self.chat_history.append(
+            f"<p>{name} processed and indexed successfully ({report['chunks']} chunks, "
+            f"{report['embedded']} newly embedded, parsed at {rate:.1f} segments/s)!</p>"
+        )
+
+    def on_ingest_finished(self):
+        self.worker.deleteLater()
+        self.worker = None
+        self.status_label.setText("")
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, server=None):
         super().__init__()
 
         self.setWindowTitle("AI Assistant")
         self.setGeometry(100, 100, 1000, 650)
 
-        self.llm_model = load_model()
+        self.llm_model = None
 
         self.initUI()
 
+        # The window is shown right away; the model is loaded in the background
+        self.chatbot_window.set_warming_up()
+        self.model_loader = ModelLoader(server)
+        self.model_loader.model_loaded.connect(self.on_model_loaded)
+        self.model_loader.start()
+
+    def on_model_loaded(self, model, error):
+        self.llm_model = model
+        self.chatbot_window.set_model(model, error)
+        self.rag_window.set_model(model, error)
+        profiler.report()
+
     def initUI(self):
         central_widget = QWidget(self)
         self.setCentralWidget(central_widget)
@@ -208,8 +508,8 @@ class MainWindow(QMainWindow):
         self.content_area = QStackedWidget()
         layout.addWidget(self.content_area)
 
-        self.chatbot_window = ChatWindow(self.llm_model)
-        self.rag_window = ChatWindow(self.llm_model, is_rag=True)
+        self.chatbot_window = ChatWindow()
+        self.rag_window = ChatWindow(is_rag=True)
         self.gc_window = GCWindow()
 
         self.content_area.addWidget(self.chatbot_window)
@@ -234,6 +534,11 @@ class MainWindow(QMainWindow):
         """
         )
 
+    def closeEvent(self, event):
+        self.chatbot_window.save_session()
+        self.gc_window.shutdown()
+        super().closeEvent(event)
+
     def open_chatbot(self):
         self.content_area.setCurrentIndex(0)  # Index 0 for AI Chatbot
 
@@ -244,20 +549,59 @@ class MainWindow(QMainWindow):
         self.content_area.setCurrentIndex(2)  # Index 2 for GC (gesture control)
 
 
+class FramePreview(QWidget):
+    ''' Paints the newest gesture worker frame straight out of its shared memory buffer '''
+
+    def __init__(self):
+        super().__init__()
+        self.preview = None
+        self.sequence = 0
+        self.setMinimumSize(320, 240)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+    def refresh(self):
+        if self.preview is not None and self.preview.latest()[0] != self.sequence:
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.black)
+        if self.preview is not None:
+            self.sequence, frame = self.preview.latest()
+            if frame is not None:
+                h, w = frame.shape[:2]
+                # The QImage wraps the shared memory in place and only lives for this paint
+                image = QImage(sip.voidptr(frame.ctypes.data), w, h, frame.strides[0], QImage.Format_BGR888)
+                size = image.size().scaled(self.size(), Qt.KeepAspectRatio)
+                target = QRect((self.width() - size.width()) // 2, (self.height() - size.height()) // 2,
+                               size.width(), size.height())
+                painter.drawImage(target, image)
+                if not self.preview.intact(self.sequence):
+                    # The worker reused the slot while it was painted; paint again on the next refresh
+                    self.sequence = -1
+        painter.end()
+
+
 class GCWindow(QWidget):
     def __init__(self):
         super().__init__()
 
         self.initUI()
 
+        # Forwards worker messages and new preview frames to the GUI thread
+        self.poll_timer = QTimer(self)
+        self.poll_timer.timeout.connect(self.poll_worker)
+
     def initUI(self):
         self.setWindowTitle("Gesture Control")
 
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.handgest_process = None
-        self.volumecontrol_process = None
+        # One warm gesture worker process serves every enabled gesture from a single camera
+        self.worker = None
+        self.enabled_gestures = set()
+        self.command_worker = None
 
         # Hand Gesture Control Buttons
         handgest_layout = QHBoxLayout()
@@ -271,6 +615,13 @@ class GCWindow(QWidget):
         self.volumecontrol_button.clicked.connect(self.toggle_volumecontrol)
         handgest_layout.addWidget(self.volumecontrol_button)
 
+        self.preview = FramePreview()
+        layout.addWidget(self.preview)
+
+        self.gesture_status = QLabel("")
+        self.gesture_status.setFont(QFont("Arial", 10))
+        layout.addWidget(self.gesture_status)
+
         # System Action Input
         self.action_input = QLineEdit()
         self.action_input.setPlaceholderText("Enter system action command...")
@@ -305,33 +656,133 @@ class GCWindow(QWidget):
         )
 
     def toggle_handgest(self):
-        if self.handgest_process is None:
-            self.handgest_process = subprocess.Popen(["python", "handgest.py"])
-            self.handgest_button.setText("Disable Hand Gesture Control")
-        else:
-            self.handgest_process.terminate()
-            self.handgest_process = None
-            self.handgest_button.setText("Enable Hand Gesture Control")
+        self.toggle_gestures({"swipe", "fist"})
+        self.update_buttons()
 
     def toggle_volumecontrol(self):
-        if self.volumecontrol_process is None:
-            self.volumecontrol_process = subprocess.Popen(["python", "volumecontrol.py"])
-            self.volumecontrol_button.setText("Disable Volume Control")
+        self.toggle_gestures({"volume"})
+        self.update_buttons()
+
+    def update_buttons(self):
+        handgest = {"swipe", "fist"} <= self.enabled_gestures
+        self.handgest_button.setText(("Disable" if handgest else "Enable") + " Hand Gesture Control")
+        volume = "volume" in self.enabled_gestures
+        self.volumecontrol_button.setText(("Disable" if volume else "Enable") + " Volume Control")
+
+    def toggle_gestures(self, names):
+        ''' Enable or disable gesture plugins in the worker; returns True if they are now enabled '''
+        enable = not names <= self.enabled_gestures
+        if enable:
+            self.enabled_gestures |= names
         else:
-            self.volumecontrol_process.terminate()
-            self.volumecontrol_process = None
-            self.volumecontrol_button.setText("Enable Volume Control")
+            self.enabled_gestures -= names
+
+        self.ensure_worker()
+        if enable:
+            # The full set, so a restarted worker gets the gestures enabled before it died
+            self.worker.enable(self.enabled_gestures)
+        else:
+            self.worker.disable(names)
+        return enable
+
+    def ensure_worker(self):
+        ''' Start the gesture worker if it is not running; it loads MediaPipe once and stays warm '''
+        if self.worker is not None and self.worker.alive():
+            return
+        self.stop_worker()
+        from gesture_worker import GestureWorker
+
+        self.worker = GestureWorker()
+        self.worker.configure(preview=self.isVisible())
+        self.preview.preview = self.worker.preview
+        self.gesture_status.setText("Starting gesture control...")
+        self.poll_timer.start(30)
+
+    def stop_worker(self):
+        if self.worker is None:
+            return
+        self.poll_timer.stop()
+        self.preview.preview = None
+        self.worker.stop()
+        self.worker = None
+
+    def poll_worker(self):
+        for kind, payload in self.worker.messages():
+            if kind == "ready":
+                self.gesture_status.setText("Gesture control ready")
+            elif kind == "state":
+                # The worker disables plugins that fail, so its state wins over the buttons
+                self.enabled_gestures = set(payload["enabled"])
+                self.update_buttons()
+                if not payload["enabled"]:
+                    self.gesture_status.setText("Gesture control ready")
+            elif kind == "stats":
+                latency = payload["latency_p50_ms"]
+                self.gesture_status.setText(
+                    f"Camera {payload['capture_fps']:.0f} FPS, detection {payload['inference_fps']:.0f} FPS"
+                    + (f", latency {latency:.0f} ms" if latency is not None else "")
+                    + f", CPU {payload['cpu_percent']:.0f}%")
+            elif kind == "gesture":
+                print(f"{payload[0]}: {payload[1]}")
+            elif kind == "error":
+                self.gesture_status.setText(payload)
+        if not self.worker.alive():
+            self.gesture_status.setText("Gesture control stopped unexpectedly; toggle a gesture to restart it.")
+            self.stop_worker()
+            return
+        self.preview.refresh()
+
+    def showEvent(self, event):
+        # Start the worker in the background as soon as the tab is opened, and only send previews while it is visible
+        self.ensure_worker()
+        self.worker.configure(preview=True)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        if self.worker is not None:
+            self.worker.configure(preview=False)
+        super().hideEvent(event)
+
+    def shutdown(self):
+        self.stop_worker()
 
     def execute_command(self):
         command = self.action_input.text().strip()
         if command:
-            controller = SystemController()
-            controller.process_command(command)
+            if self.command_worker is not None:
+                return
+            from sysaction import get_controller
+
+            self.command_worker = CommandWorker(get_controller().process_command, command)
+            self.command_worker.done.connect(lambda result: self.finish_command(command, *result))
+            self.command_worker.finished.connect(self.command_worker.deleteLater)
+            self.command_worker.start()
             self.action_input.clear()
 
+    def finish_command(self, command, intent, ok):
+        self.command_worker = None
+        if intent is None:
+            self.gesture_status.setText(f"Unknown command: {command}")
+        else:
+            self.gesture_status.setText(f"{'Ran' if ok else 'Could not run'} {intent.action}")
+
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+def main():
+    parser = argparse.ArgumentParser(description="BarsAI desktop assistant")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print import and init time per module once the model has loaded")
+    parser.add_argument("--server", metavar="HOST:PORT",
+                        help="share the model of a running inference_server.py instead of loading a copy")
+    args, qt_args = parser.parse_known_args()
+    profiler.enabled = args.profile_startup
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    with profiler.measure("MainWindow init"):
+        window = MainWindow(args.server)
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    QTimer.singleShot(0, lambda: profiler.mark("window shown"))
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
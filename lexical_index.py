@@ -0,0 +1,122 @@
+import re
+import math
+from collections import Counter
+
+# Identifiers such as "E-1042", "v2.3.1" or "part_77b" are kept whole and also split into parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def reciprocal_rank_fusion(rankings, k=60):
+    ''' Fuse several [(id, score), ...] rankings (best first) by sum of 1 / (k + rank) '''
+    fused = Counter()
+    for ranking in rankings:
+        for rank, (item, _) in enumerate(ranking, start=1):
+            fused[item] += 1.0 / (k + rank)
+    return fused.most_common()
+
+
+class BM25Index:
+    ''' BM25 inverted index stored in SQLite tables next to the chunks it indexes.
+
+    Terms are interned to integer ids and postings are (term id, chunk id, term frequency)
+    rows, so lookups are index range scans and only the query terms are read from disk.
+    '''
+
+    def __init__(self, db, k1=1.2, b=0.75):
+        self.db = db
+        self.k1 = k1
+        self.b = b
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS lexical_terms (term_id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS lexical_postings ("
+            " term_id INTEGER NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term_id, chunk_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS lexical_postings_chunk ON lexical_postings (chunk_id);"
+            "CREATE TABLE IF NOT EXISTS lexical_lengths (chunk_id INTEGER PRIMARY KEY, length INTEGER NOT NULL);"
+        )
+
+    def add(self, chunk_ids, texts):
+        counts = [Counter(tokenize(text)) for text in texts]
+        terms = {term for count in counts for term in count}
+        self.db.executemany("INSERT OR IGNORE INTO lexical_terms (term) VALUES (?)", [(term,) for term in terms])
+        term_ids = self.term_ids(terms)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO lexical_postings VALUES (?, ?, ?)",
+            [(term_ids[term], chunk_id, tf) for chunk_id, count in zip(chunk_ids, counts) for term, tf in count.items()],
+        )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO lexical_lengths VALUES (?, ?)",
+            [(chunk_id, sum(count.values())) for chunk_id, count in zip(chunk_ids, counts)],
+        )
+
+    def delete(self, chunk_ids):
+        rows = [(chunk_id,) for chunk_id in chunk_ids]
+        self.db.executemany("DELETE FROM lexical_postings WHERE chunk_id = ?", rows)
+        self.db.executemany("DELETE FROM lexical_lengths WHERE chunk_id = ?", rows)
+
+    def backfill(self):
+        ''' Index chunks stored before the lexical index existed; returns how many were added '''
+        indexed, stored = self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM lexical_lengths), (SELECT COUNT(*) FROM chunks)"
+        ).fetchone()
+        if indexed == stored:
+            return 0
+        rows = self.db.execute(
+            "SELECT id, text FROM chunks WHERE id NOT IN (SELECT chunk_id FROM lexical_lengths)"
+        ).fetchall()
+        for start in range(0, len(rows), 1000):
+            batch = rows[start:start + 1000]
+            self.add([chunk_id for chunk_id, _ in batch], [text for _, text in batch])
+        if rows:
+            self.db.commit()
+        return len(rows)
+
+    def term_ids(self, terms):
+        term_ids, terms = {}, list(terms)
+        for start in range(0, len(terms), 500):
+            batch = terms[start:start + 500]
+            term_ids.update(
+                (term, term_id) for term_id, term in self.db.execute(
+                    f"SELECT term_id, term FROM lexical_terms WHERE term IN ({','.join('?' * len(batch))})", batch
+                )
+            )
+        return term_ids
+
+    def search(self, query, k, doc_ids=None):
+        ''' Top k (chunk id, BM25 score), optionally only chunks of the given documents '''
+        chunk_count, average_length = self.db.execute(
+            "SELECT COUNT(*), COALESCE(AVG(length), 0) FROM lexical_lengths"
+        ).fetchone()
+        if chunk_count == 0:
+            return []
+
+        document_filter, params = "", []
+        if doc_ids is not None:
+            document_filter = f" AND p.chunk_id IN (SELECT id FROM chunks WHERE doc_id IN ({','.join('?' * len(doc_ids))}))"
+            params = list(doc_ids)
+
+        scores = Counter()
+        for term, term_id in self.term_ids(set(tokenize(query))).items():
+            document_frequency = self.db.execute(
+                "SELECT COUNT(*) FROM lexical_postings WHERE term_id = ?", (term_id,)
+            ).fetchone()[0]
+            idf = math.log(1 + (chunk_count - document_frequency + 0.5) / (document_frequency + 0.5))
+            postings = self.db.execute(
+                "SELECT p.chunk_id, p.tf, l.length FROM lexical_postings p"
+                " JOIN lexical_lengths l ON l.chunk_id = p.chunk_id"
+                f" WHERE p.term_id = ?{document_filter}",
+                [term_id] + params,
+            )
+            for chunk_id, tf, length in postings:
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from corpus_index import CorpusIndex, INDEX_TYPES, RETRIEVAL_MODES
+from lexical_index import tokenize
+import rag_model
+
+BENCH_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data")
+
+
+class HashingEmbeddings(Embeddings):
+    ''' Deterministic offline embeddings: signed feature hashing of words and word pairs.
+
+    Not a semantic model, but stable across runs and machines, so index size, ingestion
+    and latency numbers are comparable and retrieval quality changes come from the
+    chunking and retrieval settings alone.
+    '''
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+        self.model_name = f"hashing:{dimension}"
+
+    def embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        tokens = tokenize(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed(text)
+
+
+class CountingEmbeddings(Embeddings):
+    ''' Counts the calls and texts that reach the embedding provider '''
+
+    def __init__(self, embeddings, model_name):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def normalize(text):
+    return " ".join(text.split()).lower()
+
+def answer_rank(docs, question):
+    ''' 1-based rank of the first retrieved chunk containing the answer span, or None '''
+    answer = normalize(question["answer"])
+    for rank, doc in enumerate(docs, start=1):
+        if os.path.basename(doc.metadata["source"]) == question["source"] and answer in normalize(doc.page_content):
+            return rank
+    return None
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def run_config(files, questions, embeddings, model_name, chunk_size, chunk_overlap, index_type, modes, ks):
+    ''' Ingest files with one chunking/index setting, then query once per retrieval mode '''
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    counting = CountingEmbeddings(embeddings, model_name)
+    corpus = CorpusIndex(workdir, counting, index_type)
+    try:
+        started = time.perf_counter()
+        source_chars = chunk_chars = chunks = 0
+        for file_path in files:
+            segments = list(rag_model.iter_document(file_path))
+            source_chars += sum(len(text) for text, _ in segments)
+            document_chunks = list(rag_model.iter_chunks(segments, chunk_size, chunk_overlap))
+            chunk_chars += sum(len(text) for text, _ in document_chunks)
+            chunks += corpus.add_document(file_path, document_chunks)
+        ingest_seconds = time.perf_counter() - started
+        ingest = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "index_type": corpus.manifest["index_type"],
+            "chunks": chunks,
+            "duplication": max(0.0, chunk_chars / source_chars - 1) if source_chars else 0.0,
+            "embedding_calls": counting.calls,
+            "embedded_texts": counting.texts,
+            "index_bytes": directory_bytes(workdir),
+            "ingest_seconds": ingest_seconds,
+            "ingest_chunks_per_sec": chunks / ingest_seconds if ingest_seconds > 0 else None,
+            "ingest_kb_per_sec": source_chars / 1024 / ingest_seconds if ingest_seconds > 0 else None,
+        }
+
+        results = []
+        for mode in modes:
+            ranks, latencies = [], []
+            for question in questions:
+                started = time.perf_counter()
+                docs = corpus.search(question["question"], k=max(ks), mode=mode)
+                latencies.append((time.perf_counter() - started) * 1000)
+                ranks.append(answer_rank(docs, question))
+            results.append(dict(
+                ingest,
+                embeddings=model_name,
+                mode=mode,
+                recall={str(k): sum(rank is not None and rank <= k for rank in ranks) / len(ranks) for k in ks},
+                mrr=sum(1 / rank for rank in ranks if rank is not None) / len(ranks),
+                p50_ms=float(np.percentile(latencies, 50)),
+                p95_ms=float(np.percentile(latencies, 95)),
+            ))
+        return results
+    finally:
+        corpus.db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def print_table(results, ks):
+    columns = ["chunk", "overlap", "index", "mode", "chunks", "dup", "embeds", "index KB", "chunks/s"]
+    columns += [f"R@{k}" for k in ks] + ["MRR", "p50 ms", "p95 ms"]
+    rows = []
+    for result in results:
+        rows.append([
+            str(result["chunk_size"]), str(result["chunk_overlap"]), result["index_type"], result["mode"],
+            str(result["chunks"]), f"{result['duplication']:.0%}", str(result["embedded_texts"]),
+            f"{result['index_bytes'] / 1024:.0f}", f"{result['ingest_chunks_per_sec'] or 0:.0f}",
+        ] + [f"{result['recall'][str(k)]:.2f}" for k in ks] + [
+            f"{result['mrr']:.3f}", f"{result['p50_ms']:.2f}", f"{result['p95_ms']:.2f}",
+        ])
+    widths = [max(len(row[i]) for row in rows + [columns]) for i in range(len(columns))]
+    print("  ".join(name.rjust(width) for name, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+def config_key(result):
+    return (result["chunk_size"], result["chunk_overlap"], result["index_type"], result["mode"], result["embeddings"])
+
+def compare(results, baseline, tolerance):
+    ''' Print quality drops against an earlier run; returns True if any exceeds tolerance '''
+    previous = {config_key(result): result for result in baseline}
+    regressed = False
+    for result in results:
+        before = previous.get(config_key(result))
+        if before is None:
+            continue
+        metrics = [(f"R@{k}", result["recall"][k], before["recall"].get(k)) for k in result["recall"]]
+        metrics.append(("MRR", result["mrr"], before["mrr"]))
+        for name, now, then in metrics:
+            if then is not None and then - now > tolerance:
+                regressed = True
+                print(f"REGRESSION {name} {then:.3f} -> {now:.3f} for chunk {result['chunk_size']}, "
+                      f"overlap {result['chunk_overlap']}, {result['index_type']}, {result['mode']}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunking and retrieval settings of the RAG module")
+    parser.add_argument("--corpus", default=os.path.join(BENCH_DATA, "corpus"), help="folder of documents to index")
+    parser.add_argument("--questions", default=os.path.join(BENCH_DATA, "questions.json"),
+                        help="JSON list of {question, answer, source}; answer is a span of the source document")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[500, 1000, 3000])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 200, 1000])
+    parser.add_argument("--index-types", nargs="+", choices=INDEX_TYPES, default=["flat", "hnsw"])
+    parser.add_argument("--modes", nargs="+", choices=RETRIEVAL_MODES, default=["vector", "lexical", "hybrid"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="cut-offs for recall@k")
+    parser.add_argument("--embeddings", choices=("hashing", "google", "local"), default="hashing",
+                        help="hashing is deterministic and offline; google/local measure the real providers")
+    parser.add_argument("--dimension", type=int, default=256, help="vector size of the hashing embeddings")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON of an earlier run; exit 1 if recall or MRR dropped")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed drop against the baseline")
+    args = parser.parse_args()
+
+    if args.embeddings == "hashing":
+        embeddings = HashingEmbeddings(args.dimension)
+        model_name = embeddings.model_name
+    else:
+        embeddings, model_name = rag_model.get_embedding_provider(args.embeddings)
+    files = rag_model.find_documents([args.corpus])
+    with open(args.questions, "r", encoding="utf-8") as file:
+        questions = json.load(file)
+    ks = sorted(set(args.k))
+
+    results = []
+    for chunk_size in args.chunk_sizes:
+        for chunk_overlap in args.overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            for index_type in args.index_types:
+                try:
+                    results += run_config(files, questions, embeddings, model_name,
+                                          chunk_size, chunk_overlap, index_type, args.modes, ks)
+                except Exception as e:
+                    print(f"FAILED chunk {chunk_size}, overlap {chunk_overlap}, {index_type}: {type(e).__name__}: {e}")
+
+    print(f"{len(files)} documents, {len(questions)} questions, {model_name} embeddings")
+    print_table(results, ks)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
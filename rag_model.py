@@ -1,26 +1,143 @@
 import os
+import re
+import math
+import time
+import queue
+import argparse
+import multiprocessing
 import pandas as pd
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PyPDF2 import PdfReader
 from docx import Document
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
+from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores.faiss import FAISS
 import google.generativeai as genai
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from corpus_index import CorpusIndex, INDEX_TYPES, RETRIEVAL_MODES, document_id, file_digest
+from table_store import TableStore
+from lexical_index import tokenize
 
-load_dotenv()
+DOCUMENT_EMBEDDING_MODEL = "models/text-embedding-004"
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_index")
+# Columnar copies of CSV/Excel documents, for answering aggregate questions locally
+TABLE_PATH = os.path.join(CORPUS_PATH, "tables")
+TABLE_EXTENSIONS = ('.csv', '.xlsx')
 
-# Configure API
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+_api_configured = False
+_embedding_cache = None
+_embedding_providers = {}
+_retrieval_session = None
+
+def configure_api():
+    ''' Load .env and configure the Gemini API on first use instead of at import '''
+    global _api_configured
+    if not _api_configured:
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        _api_configured = True
+
+
+class LocalEmbeddings(Embeddings):
+    ''' Offline CPU embeddings from a GGUF embedding model run by llama.cpp.
+
+    Inputs are split into batches that run on a thread pool; each worker owns its own
+    llama.cpp context and the machine's cores are divided between the workers. n_ctx
+    fits a full 3000-character chunk; longer inputs are truncated and counted in stats.
+    The model name includes a hash of the file, so different models never share vectors.
+    '''
+
+    def __init__(self, model_path, workers=None, batch_size=32, n_ctx=2048):
+        from llama_cpp import Llama
+
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or max(1, min(4, cpu_count // 4))
+        self.batch_size = batch_size
+        self.n_ctx = n_ctx
+        self.model_name = f"local:{os.path.basename(model_path)}:{file_digest(model_path)[:12]}"
+        self.contexts = queue.Queue()
+        for _ in range(self.workers):
+            self.contexts.put(Llama(
+                model_path=model_path,
+                embedding=True,
+                n_ctx=n_ctx,
+                n_batch=n_ctx,
+                n_threads=max(1, cpu_count // self.workers),
+                verbose=False,
+            ))
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding")
+        self.stats = {"texts": 0, "truncated": 0, "batches": 0, "seconds": 0.0}
+
+    def embed_batch(self, texts):
+        ''' (vectors, number of texts longer than n_ctx tokens) '''
+        llama = self.contexts.get()
+        try:
+            truncated = sum(len(llama.tokenize(text.encode("utf-8"))) > self.n_ctx for text in texts)
+            return llama.embed(texts, normalize=True, truncate=True), truncated
+        finally:
+            self.contexts.put(llama)
+
+    def embed_documents(self, texts):
+        started = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors, truncated = [], 0
+        for batch_vectors, batch_truncated in self.pool.map(self.embed_batch, batches):
+            vectors.extend(batch_vectors)
+            truncated += batch_truncated
+        if truncated and not self.stats["truncated"]:
+            print(f"Some texts are longer than {self.n_ctx} tokens; only their start is embedded")
+        self.stats["truncated"] += truncated
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += len(batches)
+        self.stats["seconds"] += time.perf_counter() - started
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def throughput(self):
+        ''' Texts embedded per second so far '''
+        return self.stats["texts"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+
+def get_embedding_provider(name=None):
+    ''' Embedding provider named by EMBEDDING_PROVIDER in .env: "google" (default) or "local".
+
+    The local provider reads the GGUF embedding model path from LOCAL_EMBEDDING_MODEL.
+    Providers are created once per process and shared. Returns (provider, model name).
+    '''
+    load_dotenv()
+    name = name or os.getenv("EMBEDDING_PROVIDER", "google")
+    if name not in _embedding_providers:
+        if name == "google":
+            configure_api()
+            provider = GoogleGenerativeAIEmbeddings(model=DOCUMENT_EMBEDDING_MODEL), DOCUMENT_EMBEDDING_MODEL
+        elif name == "local":
+            model_path = os.getenv("LOCAL_EMBEDDING_MODEL")
+            if not model_path or not os.path.exists(model_path):
+                raise ValueError(f"LOCAL_EMBEDDING_MODEL does not point to a GGUF embedding model: {model_path}")
+            local = LocalEmbeddings(model_path)
+            provider = local, local.model_name
+        else:
+            raise ValueError(f"Unknown embedding provider: {name}")
+        _embedding_providers[name] = provider
+    return _embedding_providers[name]
+
+def get_embeddings(provider_name=None):
+    ''' Document embedder that only calls the provider for chunks not embedded before '''
+    global _embedding_cache
+    provider, model_name = get_embedding_provider(provider_name)
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return CachedEmbeddings(provider, model_name, _embedding_cache)
 
 def read_pdf(file_path):
-    text = ""
     pdf = PdfReader(file_path)
-    for page in pdf.pages:
-        text += page.extract_text()
-    return text
+    return "".join(page.extract_text() for page in pdf.pages)
 
 def read_word(file_path):
     doc = Document(file_path)
@@ -31,21 +148,291 @@ def read_text(file_path):
         return file.read()
 
 def read_csv_excel(file_path):
-    if file_path.endswith('.csv'):
-        df = pd.read_csv(file_path)
-    else:
-        df = pd.read_excel(file_path)
-    return df.to_string()
+    return "\n".join(text for text, _ in iter_table_rows(file_path))
 
 def get_text_chunks(text):
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=1000)
     return text_splitter.split_text(text)
 
+# Streaming ingestion: every reader yields (text, metadata) segments, where metadata
+# records the source file and the page/paragraph/line/row range the text came from.
+
+def iter_pdf_pages(file_path):
+    pdf = PdfReader(file_path)
+    for number, page in enumerate(pdf.pages, start=1):
+        yield page.extract_text() or "", {"source": file_path, "unit": "page", "start": number, "end": number}
+
+def iter_word_paragraphs(file_path):
+    doc = Document(file_path)
+    for number, para in enumerate(doc.paragraphs, start=1):
+        if para.text:
+            yield para.text, {"source": file_path, "unit": "paragraph", "start": number, "end": number}
+
+def iter_text_lines(file_path, lines_per_segment=200):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        lines, start = [], 1
+        for number, line in enumerate(file, start=1):
+            lines.append(line)
+            if len(lines) == lines_per_segment or not line.strip():
+                yield "".join(lines), {"source": file_path, "unit": "line", "start": start, "end": number}
+                lines, start = [], number + 1
+        if lines:
+            yield "".join(lines), {"source": file_path, "unit": "line", "start": start, "end": start + len(lines) - 1}
+
+def iter_table_rows(file_path, rows_per_read=10000):
+    ''' Row groups of a CSV/Excel sheet with its header and column types, read in chunks.
+
+    A columnar copy of the table is written to the table store on the way, so aggregate
+    questions can be answered by a local query instead of the LLM.
+    '''
+    if file_path.endswith('.csv'):
+        frames = pd.read_csv(file_path, chunksize=rows_per_read)
+    else:
+        frames = _iter_excel_frames(file_path, rows_per_read)
+    return TableStore(TABLE_PATH).ingest(document_id(file_path), file_path, frames)
+
+def _iter_excel_frames(file_path, rows_per_read):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == rows_per_read:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+SEGMENT_READERS = {
+    '.pdf': iter_pdf_pages,
+    '.docx': iter_word_paragraphs,
+    '.txt': iter_text_lines,
+    '.csv': iter_table_rows,
+    '.xlsx': iter_table_rows,
+}
+
+def iter_document(file_path):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension not in SEGMENT_READERS:
+        raise ValueError(f"Unsupported file format: {file_extension}")
+    return SEGMENT_READERS[file_extension](file_path)
+
+def iter_chunks(segments, chunk_size=3000, chunk_overlap=1000):
+    ''' Split a stream of segments into (chunk, metadata) with overlap carried across segment boundaries.
+
+    Segments are buffered until the buffer holds a few chunks, the buffer is split, and
+    everything but the last chunk is emitted; the last chunk stays in the buffer so the
+    next split continues from it. Memory stays bounded by the buffer, not the document.
+    '''
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    buffer = ""
+    markers = []  # (offset in buffer, metadata) for every segment in the buffer
+    for text, metadata in segments:
+        if buffer:
+            buffer += "\n"
+        markers.append((len(buffer), metadata))
+        buffer += text
+        if len(buffer) >= 4 * chunk_size:
+            buffer, markers = yield from _split_buffer(splitter, buffer, markers, final=False)
+    if buffer.strip():
+        yield from _split_buffer(splitter, buffer, markers, final=True)
+
+def _split_buffer(splitter, buffer, markers, final):
+    chunks = splitter.split_text(buffer)
+    positions, cursor = [], 0
+    for chunk in chunks:
+        position = buffer.find(chunk, cursor)
+        position = cursor if position < 0 else position
+        positions.append(position)
+        cursor = position + 1
+
+    keep = len(chunks) if final else len(chunks) - 1
+    for chunk, position in zip(chunks[:keep], positions[:keep]):
+        yield chunk, _chunk_metadata(markers, position, position + len(chunk))
+    if final or not chunks:
+        return "", []
+
+    # Carry the unfinished tail (the last chunk onwards) into the next buffer
+    cut = positions[-1]
+    carried = [(max(offset - cut, 0), metadata) for offset, metadata in markers if offset >= cut]
+    covering = [metadata for offset, metadata in markers if offset <= cut][-1:]
+    if covering and (not carried or carried[0][0] > 0):
+        carried.insert(0, (0, covering[0]))
+    return buffer[cut:], carried
+
+def _chunk_metadata(markers, start, end):
+    covered = [metadata for offset, metadata in markers if offset < end]
+    first = [metadata for offset, metadata in markers if offset <= start][-1:] or covered[:1]
+    first, last = first[0], covered[-1]
+    return {"source": first["source"], "unit": first["unit"], "start": first["start"], "end": last["end"]}
+
+def index_document(file_path, batch_size=64, chunk_size=3000, chunk_overlap=1000):
+    ''' Stream a document into the corpus index, embedding fixed-size batches of chunks.
+
+    Returns the number of chunks indexed; chunk provenance is kept as document metadata.
+    '''
+    return index_segments(iter_document(file_path), file_path, batch_size, chunk_size, chunk_overlap)
+
+def index_segments(segments, file_path, batch_size=64, chunk_size=3000, chunk_overlap=1000):
+    corpus = get_retrieval_session().get_corpus()
+    if os.path.splitext(file_path)[1].lower() in TABLE_EXTENSIONS:
+        # Row groups already fit in a chunk and repeat the header; splitting would separate them
+        chunks = segments
+    else:
+        chunks = iter_chunks(segments, chunk_size, chunk_overlap)
+    return corpus.add_document(file_path, chunks, batch_size)
+
+# Bulk ingestion: PDF page ranges and whole other files are parsed in a process pool,
+# results come back in document order and each file is indexed as soon as it is complete.
+
+def parse_task(file_path, start, end):
+    ''' Pool task: segments of PDF pages start..end (1-based, inclusive) '''
+    started = time.perf_counter()
+    pdf = PdfReader(file_path)
+    segments = [
+        (pdf.pages[number - 1].extract_text() or "", {"source": file_path, "unit": "page", "start": number, "end": number})
+        for number in range(start, end + 1)
+    ]
+    return segments, time.perf_counter() - started
+
+def parse_file_task(file_path):
+    ''' Pool task: every segment of a document that is not split by pages '''
+    started = time.perf_counter()
+    segments = list(iter_document(file_path))
+    return segments, time.perf_counter() - started
+
+def plan_tasks(file_path, pages_per_task=16):
+    ''' Pool tasks parsing file_path, as (function, arguments): page ranges of a PDF, otherwise the whole file '''
+    if os.path.splitext(file_path)[1].lower() != '.pdf':
+        return [(parse_file_task, (file_path,))]
+    page_count = len(PdfReader(file_path).pages)
+    return [(parse_task, (file_path, start, min(start + pages_per_task - 1, page_count)))
+            for start in range(1, page_count + 1, pages_per_task)]
+
+def find_documents(paths):
+    ''' Expand folders into the supported files they contain, in a stable order '''
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                documents.extend(os.path.join(root, name) for name in sorted(names)
+                                 if os.path.splitext(name)[1].lower() in SEGMENT_READERS)
+        else:
+            documents.append(path)
+    return documents
+
+def iter_parsed_documents(paths, workers=None, pages_per_task=16, max_pending=None):
+    ''' Parse files and yield one result dict per file, in the order given.
+
+    Files are parsed in a process pool, PDFs split into page ranges and other files
+    as one task each. At most max_pending tasks (by default two per worker) are
+    submitted at a time, so memory holds the segments of the file being collected
+    plus the results of those tasks, not the whole batch. A failing file yields a
+    result with "error" set instead of aborting the batch.
+    '''
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    # spawn rather than fork: the GUI calls this from a thread of a multi-threaded process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        files = iter(paths)
+        planned = deque()  # files whose tasks are being submitted or collected, oldest first
+        in_flight = 0
+        while True:
+            # Tasks are submitted in file order, so the oldest file is always the furthest along
+            while in_flight < max_pending:
+                record = next((record for record in planned if record["tasks"]), None)
+                if record is not None:
+                    function, arguments = record["tasks"].pop(0)
+                    record["futures"].append(pool.submit(function, *arguments))
+                    in_flight += 1
+                    continue
+                file_path = next(files, None)
+                if file_path is None:
+                    break
+                record = {"path": file_path, "tasks": [], "futures": deque(), "segments": [],
+                          "parse_seconds": 0.0, "error": None}
+                try:
+                    record["tasks"] = plan_tasks(file_path, pages_per_task)
+                except Exception as e:
+                    record["error"] = e
+                planned.append(record)
+            if not planned:
+                return
+
+            record = planned[0]
+            if record["futures"]:
+                future = record["futures"].popleft()
+                in_flight -= 1
+                try:
+                    task_segments, seconds = future.result()
+                except Exception as e:
+                    record["error"] = record["error"] or e
+                    record["tasks"] = []
+                    continue
+                record["segments"].extend(task_segments)
+                record["parse_seconds"] += seconds
+                continue
+
+            planned.popleft()
+            error = record["error"]
+            yield {
+                "path": record["path"],
+                "segments": record["segments"] if error is None else [],
+                "error": None if error is None else f"{type(error).__name__}: {error}",
+                "parse_seconds": record["parse_seconds"],
+            }
+
+def index_documents(paths, workers=None, pages_per_task=16, on_result=None):
+    ''' Parse paths in a process pool and index each file; returns one report dict per file '''
+    reports = []
+    for parsed in iter_parsed_documents(find_documents(paths), workers, pages_per_task):
+        report = {
+            "path": parsed["path"],
+            "segments": len(parsed["segments"]),
+            "chunks": 0,
+            "parse_seconds": parsed["parse_seconds"],
+            "index_seconds": 0.0,
+            "error": parsed["error"],
+        }
+        if report["error"] is None:
+            started = time.perf_counter()
+            misses = _embedding_cache.stats["misses"] if _embedding_cache is not None else 0
+            try:
+                report["chunks"] = index_segments(parsed["segments"], parsed["path"])
+            except Exception as e:
+                report["error"] = f"{type(e).__name__}: {e}"
+            report["index_seconds"] = time.perf_counter() - started
+            report["embedded"] = _embedding_cache.stats["misses"] - misses if _embedding_cache is not None else 0
+        reports.append(report)
+        if on_result is not None:
+            on_result(report)
+    return reports
+
+def print_report(report):
+    if report["error"] is not None:
+        print(f"FAILED  {report['path']}: {report['error']}")
+        return
+    rate = report["segments"] / report["parse_seconds"] if report["parse_seconds"] > 0 else float("inf")
+    print(f"ok      {report['path']}: {report['segments']} segments parsed at {rate:.1f}/s, "
+          f"{report['chunks']} chunks indexed in {report['index_seconds']:.1f} s "
+          f"({report['embedded']} newly embedded)")
+
 def get_vector_store(text_chunks, file_path):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    index_file = f"faiss_index_{os.path.basename(file_path)}"
-    vector_store.save_local(index_file)
+    corpus = get_retrieval_session().get_corpus()
+    metadata = {"source": file_path, "unit": "chunk"}
+    corpus.add_document(file_path, ((chunk, dict(metadata, start=i, end=i)) for i, chunk in enumerate(text_chunks, start=1)))
+
+def delete_document(file_path):
+    TableStore(TABLE_PATH).delete(document_id(file_path))
+    return get_retrieval_session().get_corpus().delete_document(file_path)
 
 def get_conversational_chain():
     prompt_template = """
@@ -60,12 +447,257 @@ def get_conversational_chain():
     prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
     return load_qa_chain(model, chain_type="stuff", prompt=prompt)
 
-def user_input(user_question, file_path):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    index_file = f"faiss_index_{os.path.basename(file_path)}"
-    new_db = FAISS.load_local(index_file, embeddings, allow_dangerous_deserialization=True)
+# Local answering: the retrieved chunks are compressed to the sentences relevant to the
+# question so they fit the Llama context, and the answer is streamed token by token.
+
+LOCAL_ANSWER_PROMPT = """Answer the question as detailed as possible from the provided context. If the answer is not in the provided context just say 'answer is not in the provided context', don't provide the wrong answer.
+
+Context:
+{context}
+
+Question: {question}
+Answer:"""
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+# Chat conversations shorter than this are prefilled again instead of saving the KV state around a RAG answer
+KEEP_CHAT_STATE_TOKENS = 512
+
+def compress_context(question, docs, token_budget, chars_per_token=4):
+    ''' Sentences of the retrieved chunks that share terms with the question, best first.
+
+    Overlapping chunks repeat sentences, so each sentence is kept once. Sentences are
+    scored by the query terms they contain (rarer terms weigh more, earlier chunks break
+    ties), their direct neighbours get half that score, and they are added best first
+    until token_budget, estimated at chars_per_token, is used up.
+    '''
+    query_terms = set(tokenize(question))
+    seen, sentences = set(), []
+    for rank, doc in enumerate(docs):
+        for sentence in SENTENCE_BOUNDARY.split(doc.page_content):
+            sentence = sentence.strip()
+            key = " ".join(sentence.lower().split())
+            if len(key) < 3 or key in seen:
+                continue
+            seen.add(key)
+            sentences.append((rank, sentence, set(tokenize(sentence)) & query_terms))
+
+    frequency = Counter(term for _, _, matched in sentences for term in matched)
+    scores = [sum(math.log(1 + len(sentences) / frequency[term]) for term in matched) / (1 + 0.1 * rank)
+              for rank, _, matched in sentences]
+    scored = []
+    for position, (rank, sentence, _) in enumerate(sentences):
+        # Neighbours of a matching sentence in the same chunk often carry the answer
+        neighbours = [scores[i] for i in (position - 1, position + 1)
+                      if 0 <= i < len(sentences) and sentences[i][0] == rank]
+        scored.append((max([scores[position]] + [0.5 * score for score in neighbours]), position, sentence))
+    # Without any matching sentence the chunks are kept in retrieval order
+    if any(score > 0 for score, _, _ in scored):
+        scored = [entry for entry in scored if entry[0] > 0]
+    scored.sort(key=lambda entry: (-entry[0], entry[1]))
+
+    kept, used = [], 0
+    for _, _, sentence in scored:
+        cost = len(sentence) // chars_per_token + 1
+        if used + cost <= token_budget:
+            kept.append(sentence)
+            used += cost
+    return kept
+
+def chat_state_worth_keeping(llama):
+    ''' True when the local model's KV cache holds a chat conversation of at least KEEP_CHAT_STATE_TOKENS tokens '''
+    from chatbot import ChatSession
+
+    if not hasattr(llama, "save_state"):
+        return False
+    cached = llama._input_ids.tolist()
+    if len(cached) < KEEP_CHAT_STATE_TOKENS:
+        return False
+    # The last token of the system prompt may merge with what follows it in the chat prompt
+    system = llama.tokenize(ChatSession.system_prompt.encode("utf-8"))[:-1]
+    return cached[:len(system)] == system
+
+def answer_locally(model, question, docs, callbacks=None):
+    ''' Stream an answer from the local Llama model (or the shared inference server).
+
+    save_state() copies the whole KV state, hundreds of MB for a 7B model with a long
+    context, so it is only done when the cache holds a chat conversation long enough
+    that prefilling it again would cost more (see KEEP_CHAT_STATE_TOKENS); the state is
+    then restored after the answer. Otherwise the chat's next turn prefills its prompt
+    again, and consecutive RAG answers never pay for a copy.
+    '''
+    from chatbot import model_lock
+
+    callbacks = callbacks or []
+    llama = model.client
+    n_ctx = model.n_ctx
+    limit = n_ctx - model.max_tokens
+    overhead = len(llama.tokenize(LOCAL_ANSWER_PROMPT.format(context="", question=question).encode("utf-8")))
+    sentences = compress_context(question, docs, limit - overhead - 32)
+    while True:
+        prompt = LOCAL_ANSWER_PROMPT.format(context="\n".join(sentences), question=question)
+        tokens = llama.tokenize(prompt.encode("utf-8"))
+        # The character estimate can undershoot; drop the weakest sentences until it fits
+        if len(tokens) <= limit or not sentences:
+            break
+        sentences = sentences[:-1]
+
+    with model_lock(model):
+        saved = llama.save_state() if chat_state_worth_keeping(llama) else None
+        try:
+            for handler in callbacks:
+                handler.on_llm_start({}, [prompt])
+            stream = llama.create_completion(
+                tokens,
+                max_tokens=model.max_tokens,
+                temperature=model.temperature,
+                top_p=model.top_p,
+                stop=["Question:"],
+                stream=True,
+            )
+            answer = []
+            for chunk in stream:
+                token = chunk["choices"][0]["text"]
+                answer.append(token)
+                for handler in callbacks:
+                    handler.on_llm_new_token(token)
+            for handler in callbacks:
+                handler.on_llm_end(None)
+        finally:
+            if saved is not None:
+                llama.load_state(saved)
+    return {
+        "output_text": "".join(answer).strip(),
+        "backend": "local",
+        "retrieved_chunks": len(docs),
+        "context_sentences": len(sentences),
+        "context_tokens": len(tokens) - overhead,
+    }
+
+
+class RetrievalSession:
+    ''' Keeps corpus indexes and the QA chain loaded between questions.
+
+    Up to max_indexes corpora stay open (least recently used is closed first), keyed by
+    their directory. A corpus refuses to open if it was built with a different embedding
+    model than the one used for queries.
+    '''
+
+    def __init__(self, embeddings=None, max_indexes=4):
+        self.embeddings = embeddings or get_embeddings()
+        self.max_indexes = max_indexes
+        self.indexes = OrderedDict()
+        self.chain = None
+
+    def get_corpus(self, corpus_path=CORPUS_PATH):
+        corpus_path = os.path.abspath(corpus_path)
+        if corpus_path in self.indexes:
+            self.indexes.move_to_end(corpus_path)
+            return self.indexes[corpus_path]
+
+        corpus = CorpusIndex(corpus_path, self.embeddings, os.getenv("CORPUS_INDEX_TYPE", "auto"))
+        self.indexes[corpus_path] = corpus
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return corpus
+
+    def search(self, question, documents=None, k=4, corpus_path=CORPUS_PATH, mode=None):
+        mode = mode or os.getenv("RETRIEVAL_MODE", "hybrid")
+        return self.get_corpus(corpus_path).search(question, k=k, documents=documents, mode=mode)
+
+    def answer_from_tables(self, question, documents=None, corpus_path=CORPUS_PATH):
+        ''' Aggregate/filter questions over ingested tables are answered by a local pandas query '''
+        doc_ids = None if documents is None else [document_id(path) for path in documents]
+        try:
+            return TableStore(os.path.join(corpus_path, "tables")).answer(question, doc_ids)
+        except Exception as e:
+            print(f"Table query failed, falling back to retrieval: {e}")
+            return None
+
+    def ask(self, question, documents=None, corpus_path=CORPUS_PATH, model=None, callbacks=None):
+        ''' Answer with the local model when one is given (RAG_ANSWER_BACKEND can force "gemini") '''
+        callbacks = callbacks or []
+        answer = self.answer_from_tables(question, documents, corpus_path)
+        if answer is not None:
+            return emit_answer({"output_text": answer, "backend": "table"}, callbacks)
+        docs = self.search(question, documents, corpus_path=corpus_path)
+
+        backend = os.getenv("RAG_ANSWER_BACKEND", "local" if model is not None else "gemini")
+        if backend == "local":
+            if model is None:
+                raise ValueError("The local language model is not loaded yet.")
+            return answer_locally(model, question, docs, callbacks)
+        if self.chain is None:
+            self.chain = get_conversational_chain()
+        response = self.chain({"input_documents": docs, "question": question}, return_only_outputs=True)
+        return emit_answer(dict(response, backend="gemini", retrieved_chunks=len(docs)), callbacks)
+
+
+def emit_answer(response, callbacks):
+    ''' Hand a complete answer to streaming callbacks as a single token '''
+    for handler in callbacks:
+        handler.on_llm_start({}, [])
+        handler.on_llm_new_token(response["output_text"])
+        handler.on_llm_end(None)
+    return response
+
+
+def get_retrieval_session():
+    global _retrieval_session
+    if _retrieval_session is None:
+        _retrieval_session = RetrievalSession()
+    return _retrieval_session
+
+def user_input(user_question, file_path=None, model=None, callbacks=None):
+    ''' Answer from the whole corpus, or only from file_path when given.
+
+    With the local Llama model the answer is streamed to the callbacks while it is generated.
+    '''
+    documents = [file_path] if file_path is not None else None
+    return get_retrieval_session().ask(user_question, documents, model=model, callbacks=callbacks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Index documents for the RAG module")
+    parser.add_argument("paths", nargs="*", help="files or folders to ingest")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: one per CPU)")
+    parser.add_argument("--pages-per-task", type=int, default=16, help="PDF pages parsed per pool task")
+    parser.add_argument("--embeddings", choices=("google", "local"), help="embedding provider (default: EMBEDDING_PROVIDER or google)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, help="FAISS index type (default: CORPUS_INDEX_TYPE or auto)")
+    parser.add_argument("--delete", nargs="+", default=[], metavar="PATH", help="remove documents from the corpus")
+    parser.add_argument("--list", action="store_true", help="list the documents in the corpus")
+    parser.add_argument("--search", metavar="QUERY", help="print the chunks retrieved for QUERY")
+    parser.add_argument("--mode", choices=RETRIEVAL_MODES, help="retrieval mode for --search (default: RETRIEVAL_MODE or hybrid)")
+    args = parser.parse_args()
+    if args.embeddings:
+        os.environ["EMBEDDING_PROVIDER"] = args.embeddings
+    if args.index_type:
+        os.environ["CORPUS_INDEX_TYPE"] = args.index_type
+
+    for path in args.delete:
+        print(f"removed {delete_document(path)} chunks of {path}")
+
+    if args.paths:
+        started = time.perf_counter()
+        reports = index_documents(args.paths, args.workers, args.pages_per_task, on_result=print_report)
+        failed = sum(report["error"] is not None for report in reports)
+        print(f"{len(reports) - failed} indexed, {failed} failed in {time.perf_counter() - started:.1f} s")
+        if _embedding_cache is not None:
+            print(f"embedding cache hit rate {_embedding_cache.hit_rate():.0%}")
+        for provider, _ in _embedding_providers.values():
+            if isinstance(provider, LocalEmbeddings):
+                print(f"local embeddings: {provider.stats['texts']} texts at {provider.throughput():.1f} texts/s, "
+                      f"{provider.stats['truncated']} truncated")
+
+    if args.list:
+        corpus = get_retrieval_session().get_corpus()
+        for document in corpus.documents():
+            print(f"{document['chunks']:>8} chunks  {document['path']}")
+        print(f"{corpus.chunk_count()} chunks in a {corpus.manifest['index_type'] if corpus.manifest else 'empty'} index")
+
+    if args.search:
+        started = time.perf_counter()
+        docs = get_retrieval_session().search(args.search, mode=args.mode)
+        print(f"{len(docs)} chunks in {(time.perf_counter() - started) * 1000:.1f} ms")
+        for doc in docs:
+            print(f"{doc.metadata['score']:>10.4f}  {os.path.basename(doc.metadata['source'])}  {doc.page_content[:80]!r}")
 
-    docs = new_db.similarity_search(user_question)
-    chain = get_conversational_chain()
-    response = chain({"input_documents": docs, "question": user_question}, return_only_outputs=True)
-    return response
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+import time
+from datetime import datetime
+from sysaction import COMMANDS, CommandGrammar, get_controller
+
+# Short messages answered without the model; matched like commands
+CANNED = CommandGrammar([
+    ("greeting", ["hi", "hello", "hey", "good morning", "good afternoon", "good evening"], None),
+    ("thanks", ["thanks", "thank you", "thx", "cheers"], None),
+    ("time", ["time", "what time", "what time is it", "what is time", "what s time", "current time"], None),
+    ("date", ["date", "what date", "what is date", "what s date", "today date", "what day is it",
+              "what day is today", "what is today", "what is date today", "what s date today",
+              "what day is it today"], None),
+])
+
+
+def canned_answer(action):
+    now = datetime.now()
+    if action == "greeting":
+        return "Hello! How can I help you?"
+    if action == "thanks":
+        return "You're welcome!"
+    if action == "time":
+        return f"It is {now:%H:%M}."
+    return f"Today is {now:%A, %d %B %Y}."
+
+def describe(intent):
+    ''' Short description of a command for chat replies, e.g. "volume up 20%" '''
+    text = intent.action.replace("_", " ")
+    if intent.argument:
+        text += f" {intent.argument}"
+    if intent.amount is not None:
+        text += f" {intent.amount}{'%' if intent.unit in (None, 'percent') else ' ' + intent.unit}"
+    return text
+
+
+class Route:
+    ''' Where a message went: "command", "canned" or "model"; answer is None when the model has to answer '''
+
+    def __init__(self, kind, intent=None, answer=None):
+        self.kind = kind
+        self.intent = intent
+        self.answer = answer
+        self.seconds = 0.0
+
+
+class Router:
+    ''' Sends system commands and small talk to fast handlers and everything else to the model.
+
+    A message only takes the fast path when the compiled grammar explains at least
+    min_coverage of its tokens, so questions that merely mention a command word, like
+    "how do I increase volume in python", still reach the model. Canned answers also
+    need every content word explained, so "what time is it in London" is not answered
+    with the local time. An optional
+    classifier(text) returning "model" can veto the fast path as well. Every decision
+    is appended to log_path as a JSON line with its latency (message text is not logged).
+    '''
+
+    def __init__(self, controller=None, commands=COMMANDS, canned=CANNED, min_coverage=0.8,
+                 classifier=None, log_path=None):
+        self.controller = controller
+        self.commands = commands
+        self.canned = canned
+        self.min_coverage = min_coverage
+        self.classifier = classifier
+        self.log_path = log_path
+        self.counts = {"command": 0, "canned": 0, "model": 0}
+
+    def route(self, text):
+        ''' Classify a message without acting on it '''
+        for kind, grammar in (("command", self.commands), ("canned", self.canned)):
+            intent = grammar.parse(text)
+            if kind == "canned" and intent is not None and (intent.unexplained or intent.amount is not None):
+                continue
+            if intent is not None and intent.coverage >= self.min_coverage:
+                if self.classifier is not None and self.classifier(text) == "model":
+                    break
+                return Route(kind, intent)
+        return Route("model")
+
+    def handle(self, text):
+        ''' Route a message and run its fast path; route.answer is the reply, or None for the model.
+
+        Routing may scan the installed apps and commands may call subprocesses and audio APIs,
+        so GUIs call this once per message off their event thread.
+        '''
+        started = time.perf_counter()
+        route = self.route(text)
+        if route.kind == "command":
+            if self.controller is None:
+                self.controller = get_controller()
+            if self.controller.execute(route.intent):
+                route.answer = f"Done: {describe(route.intent)}."
+            else:
+                route.answer = f"Sorry, I could not run \"{describe(route.intent)}\" on this computer."
+        elif route.kind == "canned":
+            route.answer = canned_answer(route.intent.action)
+        route.seconds = time.perf_counter() - started
+        self.record(route, len(text))
+        return route
+
+    def record(self, route, length):
+        ''' Count and log a decision; handle() does this itself '''
+        self.counts[route.kind] += 1
+        if self.log_path is None:
+            return
+        record = {
+            "time": round(time.time(), 3),
+            "route": route.kind,
+            "action": route.intent.action if route.intent else None,
+            "coverage": round(route.intent.coverage, 2) if route.intent else None,
+            "chars": length,
+            "ms": round(route.seconds * 1000, 3),
+        }
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Could not write the routing log: {e}")
@@ -0,0 +1,51 @@
+import sys
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    ''' Records how long imports and init steps take while the application starts '''
+
+    def __init__(self):
+        self.enabled = False
+        self.start_time = time.perf_counter()
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.records.append((name, threading.current_thread().name, start - self.start_time, end - start))
+
+    def mark(self, name):
+        ''' Record a point in time, e.g. when the window is first painted '''
+        with self.lock:
+            self.records.append((name, threading.current_thread().name, time.perf_counter() - self.start_time, 0.0))
+
+    def import_module(self, name):
+        ''' Import a module on first use, timing the import if it was not loaded yet '''
+        if name in sys.modules:
+            return sys.modules[name]
+        with self.measure(f"import {name}"):
+            return importlib.import_module(name)
+
+    def report(self, file=None):
+        if not self.enabled:
+            return
+        file = file or sys.stderr
+        with self.lock:
+            records = sorted(self.records, key=lambda record: record[2])
+        print(f"{'step':<40} {'thread':<14} {'start (s)':>10} {'took (s)':>10}", file=file)
+        for name, thread, start, took in records:
+            print(f"{name:<40} {thread:<14} {start:>10.3f} {took:>10.3f}", file=file)
+        print(f"{'total since process start':<40} {'':<14} {'':>10} {time.perf_counter() - self.start_time:>10.3f}", file=file)
+
+
+profiler = StartupProfiler()
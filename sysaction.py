@@ -1,70 +1,363 @@
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-from ctypes import cast, POINTER
-from comtypes import CLSCTX_ALL
+import os
 import re
+import sys
+import shlex
+import shutil
+import subprocess
+import configparser
 
-nltk.download('punkt')
-nltk.download('stopwords')
+TOKEN = re.compile(r"-?\d+(?:\.\d+)?|%|[a-z]+")
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?$")
+UNITS = {"%": "percent", "percent": "percent", "points": "percent",
+         "seconds": "seconds", "second": "seconds", "secs": "seconds", "minutes": "minutes", "minute": "minutes"}
+# Words a command may contain anywhere without changing its meaning
+FILLER = {"a", "an", "the", "to", "by", "of", "my", "me", "it", "please", "can", "could", "would", "you",
+          "will", "now", "for", "i", "want", "some", "bit", "little", "level", "app", "application", "program"}
+END = None
+# Common app names and what they are called on each platform; others must be installed under their own name
+KNOWN_APPS = {
+    "calculator": {"win32": "calc", "linux": "gnome-calculator", "darwin": "Calculator"},
+    "notepad": {"win32": "notepad", "linux": "gedit", "darwin": "TextEdit"},
+    "text editor": {"win32": "notepad", "linux": "gedit", "darwin": "TextEdit"},
+    "terminal": {"win32": "cmd", "linux": "x-terminal-emulator", "darwin": "Terminal"},
+    "file explorer": {"win32": "explorer", "linux": "nautilus", "darwin": "Finder"},
+}
+
+
+def app_folders():
+    ''' Folders holding the entries a desktop shows in its application menu '''
+    if sys.platform == "darwin":
+        return ["/Applications", "/System/Applications", os.path.expanduser("~/Applications")]
+    if sys.platform == "win32":
+        return [os.path.join(os.environ.get(variable, ""), "Microsoft", "Windows", "Start Menu", "Programs")
+                for variable in ("APPDATA", "PROGRAMDATA")]
+    data_dirs = [os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")]
+    data_dirs += (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(":")
+    return [os.path.join(folder, "applications") for folder in data_dirs if folder]
+
+
+def read_desktop_entry(path):
+    ''' (names, command) of a .desktop file the menu shows, or None for hidden or non-application entries '''
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(path, encoding="utf-8")
+        entry = parser["Desktop Entry"]
+    except (configparser.Error, UnicodeDecodeError, KeyError):
+        return None
+    if entry.get("Type") != "Application" or "Exec" not in entry:
+        return None
+    if entry.get("NoDisplay", "").lower() == "true" or entry.get("Hidden", "").lower() == "true":
+        return None
+    try:
+        # Field codes like %f and %U stand for files the menu would pass; there are none here
+        command = [token for token in shlex.split(entry["Exec"]) if not re.fullmatch(r"%[a-zA-Z]", token)]
+    except ValueError:
+        return None
+    if entry.get("Terminal", "").lower() == "true":
+        command = ["x-terminal-emulator", "-e"] + command
+    stem = os.path.basename(path)[:-len(".desktop")].lower()
+    return {stem, stem.rsplit(".", 1)[-1], entry.get("Name", "").lower()}, command
+
+
+_apps = None
+
+def application_entries():
+    ''' {lowercase name: entry} of the installed applications: .desktop commands, .app bundles or Start-menu shortcuts.
+
+    The folders are only scanned again when one of them changes.
+    '''
+    global _apps
+    folders = [folder for folder in app_folders() if os.path.isdir(folder)]
+    stamp = [(folder, os.stat(folder).st_mtime_ns) for folder in folders]
+    if _apps is not None and _apps[0] == stamp:
+        return _apps[1]
+    entries = {}
+    for folder in folders:
+        if sys.platform == "darwin":
+            for entry in os.listdir(folder):
+                if entry.lower().endswith(".app"):
+                    entries.setdefault(entry[:-len(".app")].lower(), os.path.join(folder, entry))
+            continue
+        for root, _, files in os.walk(folder):
+            for file in files:
+                path = os.path.join(root, file)
+                if sys.platform == "win32" and file.lower().endswith(".lnk"):
+                    entries.setdefault(file[:-len(".lnk")].lower(), path)
+                elif sys.platform != "win32" and file.endswith(".desktop"):
+                    desktop = read_desktop_entry(path)
+                    if desktop is not None:
+                        for name in desktop[0]:
+                            entries.setdefault(name, desktop[1])
+    _apps = (stamp, entries)
+    return entries
+
+
+def find_app(name):
+    ''' How to launch the installed application called name, or None.
+
+    Only KNOWN_APPS and applications with a menu entry (.desktop file, .app bundle or
+    Start-menu shortcut) are found; any other program on PATH, like "shutdown" or "rm",
+    can never be started from a chat message.
+    '''
+    name = name.lower()
+    known = KNOWN_APPS.get(name, {}).get(sys.platform)
+    if known is not None and sys.platform != "darwin":
+        executable = shutil.which(known)
+        if executable is not None:
+            return executable
+    entries = application_entries()
+    for candidate in (known or name, name, name.replace(" ", "-"), name.replace(" ", "")):
+        if candidate.lower() in entries:
+            return entries[candidate.lower()]
+    return None
+
+# (action, phrases, what the action takes): "amount" needs a number, "app" the name of an installed app after the phrase
+GRAMMAR = [
+    ("volume_up", ["increase volume", "raise volume", "volume up", "turn up volume", "turn volume up", "louder"], None),
+    ("volume_down", ["decrease volume", "lower volume", "reduce volume", "volume down", "turn down volume",
+                     "turn volume down", "quieter"], None),
+    ("set_volume", ["set volume", "volume", "change volume"], "amount"),
+    ("mute", ["mute", "mute volume", "mute sound", "mute audio", "silence"], None),
+    ("unmute", ["unmute", "unmute volume", "unmute sound", "unmute audio"], None),
+    ("brightness_up", ["increase brightness", "raise brightness", "brightness up", "turn up brightness",
+                       "turn brightness up", "brighter"], None),
+    ("brightness_down", ["decrease brightness", "lower brightness", "reduce brightness", "brightness down",
+                         "turn down brightness", "turn brightness down", "dim screen", "dimmer"], None),
+    ("set_brightness", ["set brightness", "brightness", "change brightness"], "amount"),
+    ("play_pause", ["play", "pause", "play music", "pause music", "resume music", "play pause"], None),
+    ("next_track", ["next track", "next song", "skip track", "skip song"], None),
+    ("previous_track", ["previous track", "previous song", "last track", "last song"], None),
+    ("open_app", ["open", "launch", "start"], "app"),
+]
+
+
+class Intent:
+    ''' A parsed command: the action, its number and unit or argument, how much of the text it explains
+    and how many content words it leaves unexplained '''
+
+    def __init__(self, action, amount=None, unit=None, argument=None, coverage=1.0, unexplained=0):
+        self.action = action
+        self.amount = amount
+        self.unit = unit
+        self.argument = argument
+        self.coverage = coverage
+        self.unexplained = unexplained
+
+    def __repr__(self):
+        details = [f"{name}={value!r}" for name, value in
+                   (("amount", self.amount), ("unit", self.unit), ("argument", self.argument)) if value is not None]
+        return f"Intent({self.action}{''.join(', ' + detail for detail in details)}, coverage={self.coverage:.2f})"
+
+
+class CommandGrammar:
+    ''' Command phrases compiled into one trie over normalized tokens.
+
+    parse() tokenizes once, takes numbers and units out, and walks the trie from every
+    word, skipping filler words inside a phrase. The longest phrase wins, so "unmute"
+    and "mute" or "volume up" and "volume" never shadow each other, and the result does
+    not depend on the order of the rules. App commands only match when the words after
+    the phrase name an app that find_app resolves, so "open the manual" is not a command.
+
+    Coverage only counts filler inside the matched phrase or directly around it, so the
+    "of the" in "what is the date of the release" does not make it a date question.
+    '''
+
+    def __init__(self, rules=GRAMMAR, find_app=find_app):
+        self.root = {}
+        self.takes = {}
+        self.find_app = find_app
+        for action, phrases, takes in rules:
+            self.add(action, phrases, takes)
+
+    def add(self, action, phrases, takes=None):
+        ''' Register phrases for an action; phrases registered earlier keep their action '''
+        self.takes[action] = takes
+        for phrase in phrases:
+            node = self.root
+            for token in phrase.split():
+                node = node.setdefault(token, {})
+            node.setdefault(END, action)
+
+    def parse(self, text):
+        ''' The Intent of text, or None when no phrase matches '''
+        tokens = TOKEN.findall(text.lower())
+        amount = unit = None
+        words = []
+        # Index in tokens of every word, to take app names with their numbers
+        positions = []
+        for index, token in enumerate(tokens):
+            if NUMBER.match(token):
+                if amount is None:
+                    amount = float(token) if "." in token else int(token)
+            elif token in UNITS and amount is not None and unit is None:
+                unit = UNITS[token]
+            else:
+                words.append(token)
+                positions.append(index)
+
+        # Every phrase match as (keywords matched, -start, end, action, filler words skipped inside it)
+        matches = []
+        for start in range(len(words)):
+            node = self.root
+            keywords = skipped = 0
+            for position in range(start, len(words)):
+                word = words[position]
+                if word in node:
+                    node = node[word]
+                    keywords += 1
+                    if END in node:
+                        matches.append((keywords, -start, position + 1, node[END], skipped))
+                elif word not in FILLER or node is self.root:
+                    break
+                else:
+                    skipped += 1
+        for keywords, start, end, action, skipped in sorted(matches, reverse=True):
+            start = -start
+            takes = self.takes[action]
+            argument = None
+            if takes == "amount" and amount is None:
+                continue
+            # Filler right before the phrase, like "can you please" in "can you please mute"
+            before = start
+            while before > 0 and words[before - 1] in FILLER:
+                before -= 1
+            if takes == "app":
+                rest = tokens[positions[end - 1] + 1:]
+                argument = " ".join(token for token in rest if token not in FILLER)
+                if not argument or self.find_app(argument) is None:
+                    continue
+                explained = keywords + skipped + start - before + len(rest)
+                unexplained = sum(word not in FILLER for word in words[:before])
+                return Intent(action, argument=argument, coverage=min(1.0, explained / len(tokens)),
+                              unexplained=unexplained)
+            after = end
+            while after < len(words) and words[after] in FILLER:
+                after += 1
+            # Share of the tokens the command explains; low values are questions that mention a command word
+            explained = keywords + skipped + start - before + after - end + len(tokens) - len(words)
+            unexplained = sum(word not in FILLER for word in words[:before] + words[after:])
+            return Intent(action, amount, unit, argument, min(1.0, explained / len(tokens)), unexplained)
+        return None
+
+
+COMMANDS = CommandGrammar()
 
 
 class SystemController:
-    def __init__(self):
-        self.volume = self.get_volume_control()
-        self.commands = {
-            "increase volume": self.increase_volume,
-            "decrease volume": self.decrease_volume,
-            "mute": self.mute_volume,
-            "unmute": self.unmute_volume,
+    ''' Runs parsed commands; the audio backend and optional modules are loaded on first use '''
+
+    def __init__(self, grammar=COMMANDS):
+        self.grammar = grammar
+        self.volume = None
+        self.actions = {
+            "volume_up": lambda intent: self.change_volume(self.step(intent)),
+            "volume_down": lambda intent: self.change_volume(-self.step(intent)),
+            "set_volume": lambda intent: self.set_volume(self.percent(intent)),
+            "mute": lambda intent: self.get_volume_control().set_mute(True),
+            "unmute": lambda intent: self.get_volume_control().set_mute(False),
+            "brightness_up": lambda intent: self.change_brightness(self.step(intent)),
+            "brightness_down": lambda intent: self.change_brightness(-self.step(intent)),
+            "set_brightness": lambda intent: self.set_brightness(self.percent(intent)),
+            "play_pause": lambda intent: self.press_key("playpause"),
+            "next_track": lambda intent: self.press_key("nexttrack"),
+            "previous_track": lambda intent: self.press_key("prevtrack"),
+            "open_app": lambda intent: self.open_app(intent.argument),
         }
-        self.stop_words = set(stopwords.words('english'))
+
+    def register(self, action, phrases, handler, takes=None):
+        ''' Add a command: handler(intent) runs when one of the phrases matches '''
+        self.grammar.add(action, phrases, takes)
+        self.actions[action] = handler
+
+    @staticmethod
+    def percent(intent):
+        ''' The amount of a volume or brightness command; raises ValueError for units like minutes '''
+        if intent.unit not in (None, "percent"):
+            raise ValueError(f"{intent.unit} is not a volume or brightness unit")
+        return intent.amount
+
+    @staticmethod
+    def step(intent):
+        ''' Size of an up or down change, 10% by default; a negative one would reverse the direction '''
+        amount = SystemController.percent(intent)
+        if amount is None:
+            return 10
+        if amount < 0:
+            raise ValueError(f"the step cannot be negative ({amount})")
+        return amount
 
     def get_volume_control(self):
-        devices = AudioUtilities.GetSpeakers()
-        interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume = cast(interface, POINTER(IAudioEndpointVolume))
-        return volume
+        if self.volume is None:
+            from volume_actuator import create_backend
 
-    def increase_volume(self, amount=10):
-        current_volume = self.volume.GetMasterVolumeLevelScalar()
-        new_volume = min(current_volume + amount / 100.0, 1.0)
-        self.volume.SetMasterVolumeLevelScalar(new_volume, None)
+            self.volume = create_backend()
+        return self.volume
 
-    def decrease_volume(self, amount=10):
-        current_volume = self.volume.GetMasterVolumeLevelScalar()
-        new_volume = max(current_volume - amount / 100.0, 0.0)
-        self.volume.SetMasterVolumeLevelScalar(new_volume, None)
+    def change_volume(self, amount):
+        volume = self.get_volume_control()
+        volume.set_level(min(1.0, max(0.0, volume.get_level() + amount / 100.0)))
 
-    def mute_volume(self):
-        self.volume.SetMute(1, None)
+    def set_volume(self, amount):
+        self.get_volume_control().set_level(min(1.0, max(0.0, amount / 100.0)))
 
-    def unmute_volume(self):
-        self.volume.SetMute(0, None)
+    def change_brightness(self, amount):
+        import screen_brightness_control as sbc
+
+        sbc.set_brightness(min(100, max(0, sbc.get_brightness()[0] + amount)))
+
+    def set_brightness(self, amount):
+        import screen_brightness_control as sbc
+
+        sbc.set_brightness(min(100, max(0, amount)))
+
+    def press_key(self, key):
+        import pyautogui
+
+        pyautogui.press(key)
+
+    def open_app(self, name):
+        app = self.grammar.find_app(name)
+        if app is None:
+            raise ValueError(f"No application called {name}")
+        if isinstance(app, list):
+            # The command of a .desktop entry
+            subprocess.Popen(app, start_new_session=True)
+        elif sys.platform == "darwin":
+            subprocess.Popen(["open", "-a", app])
+        elif sys.platform == "win32":
+            os.startfile(app)
+        else:
+            subprocess.Popen([app], start_new_session=True)
+
+    def execute(self, intent):
+        try:
+            self.actions[intent.action](intent)
+            return True
+        except Exception as e:
+            print(f"Could not run {intent.action}: {e}")
+            return False
 
     def process_command(self, command):
-        command = command.lower()
-        tokens = word_tokenize(command)
-        filtered_tokens = [word for word in tokens if word.isalnum() and word not in self.stop_words]
-        filtered_command = ' '.join(filtered_tokens)
-
-        for key in self.commands:
-            if re.search(key, filtered_command):
-                amount = self.extract_amount(filtered_command)
-                if amount:
-                    self.commands[key](amount)
-                else:
-                    self.commands[key]()
-                break
+        ''' Parse and run one command; returns (Intent or None if not understood, whether it ran) '''
+        intent = self.grammar.parse(command)
+        if intent is None:
+            print(f"Unknown command: {command}")
+            return None, False
+        return intent, self.execute(intent)
+
+
+_controller = None
 
-    def extract_amount(self, command):
-        match = re.search(r'\d+', command)
-        return int(match.group()) if match else None
+def get_controller():
+    ''' The SystemController shared by every window of the app '''
+    global _controller
+    if _controller is None:
+        _controller = SystemController()
+    return _controller
 
 
 if __name__ == "__main__":
-    controller = SystemController()
+    controller = get_controller()
     while True:
         user_command = input("Enter command: ")
-        controller.process_command(user_command)
\ No newline at end of file
+        print(controller.process_command(user_command))
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import pandas as pd
+
+# Row groups are cut before they grow past this many characters, so one fits in a chunk
+ROW_GROUP_CHARS = 2500
+# Text columns with at most this many distinct values are remembered for question filters
+MAX_DISTINCT_VALUES = 1000
+DATE_PATTERN = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}|^\d{1,2}[/.]\d{1,2}[/.]\d{2,4}$")
+MONTHS = ("january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december")
+
+AGGREGATES = {
+    "sum": ("total", "sum", "overall"),
+    "mean": ("average", "mean", "avg"),
+    "count": ("how many", "count", "number of"),
+    "max": ("maximum", "max", "highest", "largest", "biggest"),
+    "min": ("minimum", "min", "lowest", "smallest"),
+}
+COMPARISONS = {
+    ">": ("over", "above", "greater than", "more than"),
+    ">=": ("at least",),
+    "<": ("under", "below", "less than"),
+    "<=": ("at most",),
+}
+
+
+def column_types(frame):
+    ''' "number", "date" or "text" per column, inferred from the first row group '''
+    types = {}
+    for name in frame.columns:
+        column = frame[name]
+        if pd.api.types.is_bool_dtype(column):
+            types[name] = "text"
+        elif pd.api.types.is_numeric_dtype(column):
+            types[name] = "number"
+        elif pd.api.types.is_datetime64_any_dtype(column):
+            types[name] = "date"
+        else:
+            values = column.dropna().astype(str)
+            dates = values.str.match(DATE_PATTERN).mean() if len(values) else 0
+            types[name] = "date" if dates >= 0.9 else "text"
+    return types
+
+def normalize_frame(frame, types):
+    ''' Coerce a row group to the table's column types so every group has the same schema '''
+    frame = frame.copy()
+    for name, kind in types.items():
+        column = frame[name]
+        if kind == "number":
+            frame[name] = pd.to_numeric(column, errors="coerce").astype("float64")
+        elif kind == "date":
+            column = pd.to_datetime(column, errors="coerce")
+            frame[name] = column.dt.tz_localize(None) if column.dt.tz is not None else column
+        else:
+            frame[name] = column.where(column.isna(), column.astype(str)).astype(object)
+    return frame
+
+def format_value(value, kind):
+    if pd.isna(value):
+        return ""
+    if kind == "number":
+        return f"{value:.15g}"
+    if kind == "date":
+        return value.strftime("%Y-%m-%d") if value == value.normalize() else value.isoformat()
+    return str(value)
+
+def format_rows(frame, types, start):
+    ''' One compact "column=value" line per row, numbered from start '''
+    names = list(types)
+    lines = []
+    for number, row in enumerate(frame.itertuples(index=False, name=None), start=start):
+        fields = (f"{name}={format_value(value, types[name])}" for name, value in zip(names, row))
+        lines.append(f"row {number}: " + "; ".join(field for field in fields if not field.endswith("=")))
+    return lines
+
+def column_words(name):
+    return re.sub(r"[_\-.]+", " ", str(name)).strip().lower()
+
+
+class TableStore:
+    ''' Columnar (Parquet) copies of ingested CSV/Excel tables, one per document id.
+
+    Each table has a JSON schema next to it with the column types, the row count and
+    the distinct values of low-cardinality text columns, so questions can be matched
+    to a table and its columns without reading the data.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def files(self, doc_id):
+        return os.path.join(self.path, f"{doc_id}.parquet"), os.path.join(self.path, f"{doc_id}.json")
+
+    def ingest(self, doc_id, source, frames):
+        ''' Write frames to the store while yielding (row group text, metadata) segments '''
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.path, exist_ok=True)
+        data_file, schema_file = self.files(doc_id)
+        writer, types, distinct, start = None, None, {}, 1
+        try:
+            for frame in frames:
+                frame.columns = [str(name) if name is not None else f"column {i}" for i, name in enumerate(frame.columns, start=1)]
+                if types is None:
+                    types = column_types(frame)
+                    distinct = {name: set() for name, kind in types.items() if kind == "text"}
+                    arrow_types = {"number": pa.float64(), "date": pa.timestamp("ns"), "text": pa.string()}
+                    schema = pa.schema([(name, arrow_types[kind]) for name, kind in types.items()])
+                    writer = pq.ParquetWriter(data_file + ".tmp", schema)
+                frame = normalize_frame(frame, types)
+                writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+                for name in list(distinct):
+                    distinct[name].update(frame[name].dropna())
+                    if len(distinct[name]) > MAX_DISTINCT_VALUES:
+                        del distinct[name]
+                yield from self.row_groups(frame, types, source, start)
+                start += len(frame)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                os.remove(data_file + ".tmp")
+            raise
+        if writer is None:
+            return
+        writer.close()
+        os.replace(data_file + ".tmp", data_file)
+        with open(schema_file, "w", encoding="utf-8") as file:
+            json.dump({
+                "source": source,
+                "rows": start - 1,
+                "columns": types,
+                "values": {name: sorted(values) for name, values in distinct.items()},
+            }, file)
+
+    @staticmethod
+    def row_groups(frame, types, source, start):
+        header = "Columns: " + ", ".join(f"{name} ({kind})" for name, kind in types.items())
+        group, first = [], start
+        for number, line in enumerate(format_rows(frame, types, start), start=start):
+            if group and len(header) + sum(len(row) + 1 for row in group) + len(line) > ROW_GROUP_CHARS:
+                yield "\n".join([header] + group), {"source": source, "unit": "row", "start": first, "end": number - 1}
+                group, first = [], number
+            group.append(line)
+        if group:
+            yield "\n".join([header] + group), {"source": source, "unit": "row", "start": first, "end": start + len(frame) - 1}
+
+    def schema(self, doc_id):
+        try:
+            with open(self.files(doc_id)[1], "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def doc_ids(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.path) if name.endswith(".json"))
+
+    def load(self, doc_id, columns):
+        ''' Only the requested columns are read from the Parquet file '''
+        return pd.read_parquet(self.files(doc_id)[0], columns=list(columns))
+
+    def delete(self, doc_id):
+        for file_path in self.files(doc_id):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def answer(self, question, doc_ids=None):
+        ''' Answer an aggregate/filter question with a local pandas query, or None if it is not one.
+
+        Without doc_ids a table is only used when the question names its file, so questions
+        about other documents that happen to mention a column name are left to retrieval.
+        '''
+        best = None
+        for doc_id in (self.doc_ids() if doc_ids is None else doc_ids):
+            schema = self.schema(doc_id)
+            if schema is None:
+                continue
+            query = parse_table_question(question, schema)
+            if query is None or (doc_ids is None and not query["named"]):
+                continue
+            if best is None or query["score"] > best[1]["score"]:
+                best = (doc_id, query, schema)
+        if best is None:
+            return None
+        doc_id, query, schema = best
+        columns = query_columns(query)
+        # A plain row count needs no column data
+        frame = self.load(doc_id, columns) if columns else pd.DataFrame(index=range(schema["rows"]))
+        return run_table_query(query, frame, schema)
+
+
+def find_phrase(text, phrases):
+    ''' Position of the first phrase found as whole words in text, or -1 '''
+    positions = [match.start() for phrase in phrases
+                 for match in [re.search(rf"\b{re.escape(phrase)}\b", text)] if match]
+    return min(positions) if positions else -1
+
+def mentions(text, name):
+    words = column_words(name)
+    return find_phrase(text, {words, words + "s", words.rstrip("s")} - {""})
+
+def parse_table_question(question, schema):
+    ''' {"aggregate", "column", "filters", "group_by", "named", "score"} for questions a table can answer;
+    named is whether the question mentions the file name of the table '''
+    text = question.lower()
+    found = [(find_phrase(text, phrases), name) for name, phrases in AGGREGATES.items()]
+    found = [(position, name) for position, name in found if position >= 0]
+    if not found:
+        return None
+    aggregate = min(found)[1]
+    types = schema["columns"]
+    score = 0
+
+    numbers = sorted((mentions(text, name), name) for name, kind in types.items() if kind == "number")
+    numbers = [name for position, name in numbers if position >= 0]
+    column = numbers[0] if numbers else None
+    if column is not None:
+        score += 2
+    elif aggregate != "count":
+        return None
+
+    filters = []
+    dates = [name for name, kind in types.items() if kind == "date"]
+    if dates:
+        date_column = next((name for name in dates if mentions(text, name) >= 0), dates[0])
+        month = next((number for number, name in enumerate(MONTHS, start=1) if find_phrase(text, [name]) >= 0), None)
+        year = re.search(r"\b(19|20)\d{2}\b", text)
+        if month is not None:
+            filters.append((date_column, "month", month))
+        if year is not None:
+            filters.append((date_column, "year", int(year.group())))
+    for name, values in schema["values"].items():
+        matched = [value for value in values if len(value) > 1 and find_phrase(text, [value.lower()]) >= 0]
+        if matched:
+            filters.append((name, "in", matched))
+            score += 1
+    for name in numbers:
+        for operator, phrases in COMPARISONS.items():
+            words = column_words(name)
+            pattern = rf"\b{re.escape(words)}s?\s+(?:{'|'.join(map(re.escape, phrases))})\s+\$?(-?[\d,]*\.?\d+)"
+            match = re.search(pattern, text)
+            if match:
+                filters.append((name, operator, float(match.group(1).replace(",", ""))))
+
+    group_by = None
+    group = re.search(r"\b(?:by|per|for each)\s+([a-z0-9 _\-]+)", text)
+    if group:
+        words = group.group(1)
+        if words.startswith("month") and dates:
+            group_by = (filters[0][0] if filters and filters[0][1] in ("month", "year") else dates[0], "month")
+        else:
+            for name in types:
+                if name != column and mentions(words, name) == 0:
+                    group_by = (name, "value")
+                    break
+
+    source = os.path.splitext(os.path.basename(schema["source"]))[0]
+    named = mentions(text, source) >= 0
+    if named:
+        score += 1
+    if score == 0:
+        return None
+    return {"aggregate": aggregate, "column": column, "filters": filters, "group_by": group_by,
+            "named": named, "score": score}
+
+def query_columns(query):
+    columns = {name for name, _, _ in query["filters"]}
+    if query["column"] is not None:
+        columns.add(query["column"])
+    if query["group_by"] is not None:
+        columns.add(query["group_by"][0])
+    return sorted(columns)
+
+def run_table_query(query, frame, schema):
+    mask = pd.Series(True, index=frame.index)
+    described = []
+    for name, operator, value in query["filters"]:
+        column = frame[name]
+        if operator == "month":
+            mask &= column.dt.month == value
+            described.append(f"{name} in {MONTHS[value - 1].title()}")
+        elif operator == "year":
+            mask &= column.dt.year == value
+            described.append(f"{name} in {value}")
+        elif operator == "in":
+            mask &= column.isin(value)
+            described.append(f"{name} is {' or '.join(value)}")
+        else:
+            mask &= COMPARE[operator](column, value)
+            described.append(f"{name} {operator} {value:g}")
+    rows = frame[mask]
+
+    aggregate, column = query["aggregate"], query["column"]
+    label = f"{aggregate} of {column}" if column is not None else "number of rows"
+    where = f" where {' and '.join(described)}" if described else ""
+    lines = [f"{label.capitalize()} in {os.path.basename(schema['source'])}{where}, computed over {len(rows)} of {schema['rows']} rows:"]
+    if query["group_by"] is None:
+        result = len(rows) if column is None else rows[column].agg(aggregate if aggregate != "count" else "count")
+        lines.append(format_result(result))
+    else:
+        name, how = query["group_by"]
+        keys = rows[name].dt.to_period("M").astype(str) if how == "month" else rows[name]
+        grouped = rows.groupby(keys).size() if column is None else rows[column].groupby(keys).agg(aggregate)
+        for key, result in grouped.head(50).items():
+            lines.append(f"{key}: {format_result(result)}")
+        if len(grouped) > 50:
+            lines.append(f"... {len(grouped) - 50} more groups")
+    return "\n".join(lines)
+
+COMPARE = {
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+}
+
+def format_result(result):
+    if pd.isna(result):
+        return "no matching values"
+    if isinstance(result, float) and not result.is_integer():
+        return f"{result:,.2f}"
+    return f"{result:,.0f}"
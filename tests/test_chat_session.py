@@ -0,0 +1,76 @@
+import time
+import unittest
+
+try:
+    from chatbot import ChatSession
+except ImportError:
+    # chatbot.py needs LangChain; the test only uses ChatSession with a fake model
+    ChatSession = None
+
+
+class FakeLlama:
+    ''' Stand-in for llama_cpp.Llama that takes a fixed time per prefilled and per generated token '''
+
+    def __init__(self, prefill_seconds=0.0005, token_seconds=0.01):
+        self.prefill_seconds = prefill_seconds
+        self.token_seconds = token_seconds
+        self.last_stats = {}
+
+    def tokenize(self, text):
+        return list(range(len(text.split())))
+
+    def create_completion(self, tokens, max_tokens=16, stream=True, **settings):
+        time.sleep(len(tokens) * self.prefill_seconds)
+        for i in range(max_tokens):
+            time.sleep(self.token_seconds)
+            yield {"choices": [{"text": f" word{i}"}]}
+
+
+class FakeModel:
+    n_ctx = 4096
+    max_tokens = 5
+    temperature = 0.0
+    top_p = 1.0
+    model_path = "fake"
+
+    def __init__(self):
+        self.client = FakeLlama()
+
+
+@unittest.skipIf(ChatSession is None, "chatbot.py needs langchain_community")
+class CompactionTest(unittest.TestCase):
+    def session(self, summary_tokens=300):
+        session = ChatSession(FakeModel(), token_budget=400, summary_tokens=summary_tokens)
+        for i in range(12):
+            session.add_turn(f"question {i} " * 10, "answer " * 10)
+        return session
+
+    def test_turn_during_compaction_is_not_delayed(self):
+        session = self.session()
+        alone = time.perf_counter()
+        session.generate_locked("how long does a turn take", [])
+        alone = time.perf_counter() - alone
+
+        session.compact_in_background()
+        self.assertTrue(session.compaction.is_alive())
+        time.sleep(0.1)
+        started = time.perf_counter()
+        session.generate("and now a new question")
+        waited = time.perf_counter() - started
+        # A 300-token summary takes about 3 s; the turn only waits for one slice or token
+        self.assertLess(waited, alone + 0.2)
+        # The turn starts a new summary; reset() abandons it
+        session.reset()
+        session.compaction.join()
+
+    def test_summary_completes_when_idle(self):
+        session = self.session(summary_tokens=20)
+        turns = len(session.turns)
+        session.compact_in_background()
+        session.compaction.join()
+        self.assertTrue(session.summary)
+        self.assertLess(len(session.turns), turns)
+
+
+if __name__ == "__main__":
+    unittest.main()
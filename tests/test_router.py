@@ -0,0 +1,24 @@
+import unittest
+from router import Router
+
+
+class RouterTest(unittest.TestCase):
+    def test_small_talk_is_canned(self):
+        router = Router()
+        for text in ("hello", "what time is it", "what is the date today", "thanks!"):
+            self.assertEqual(router.route(text).kind, "canned", text)
+
+    def test_questions_about_other_dates_and_times_reach_the_model(self):
+        router = Router()
+        for text in ("What is the date of the release?", "what is the date of the 2.3 release",
+                     "what's the date of the recall", "what time is it in London"):
+            self.assertEqual(router.route(text).kind, "model", text)
+
+    def test_polite_commands_are_commands(self):
+        router = Router()
+        for text in ("can you please mute", "could you turn the volume up please", "mute it"):
+            self.assertEqual(router.route(text).kind, "command", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
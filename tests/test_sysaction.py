@@ -0,0 +1,64 @@
+import os
+import sys
+import stat
+import tempfile
+import unittest
+from unittest import mock
+import sysaction
+from router import Router
+from sysaction import COMMANDS, SystemController
+from volume_actuator import FakeBackend
+
+
+class OpenAppTest(unittest.TestCase):
+    def test_programs_on_path_are_not_commands(self):
+        router = Router()
+        for text in ("open shutdown", "launch rm", "start reboot", "open sh", "start python3"):
+            self.assertNotEqual(router.route(text).kind, "command", text)
+
+    @unittest.skipIf(sys.platform in ("win32", "darwin"), "reads .desktop files")
+    def test_only_menu_entries_are_found(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        folder = temporary.name
+        os.makedirs(os.path.join(folder, "applications"))
+        with open(os.path.join(folder, "applications", "org.example.Sketch.desktop"), "w") as file:
+            file.write("[Desktop Entry]\nType=Application\nName=Sketch Pad\nExec=sketch --new %U\n")
+        with open(os.path.join(folder, "applications", "helper.desktop"), "w") as file:
+            file.write("[Desktop Entry]\nType=Application\nName=Helper\nExec=helper\nNoDisplay=true\n")
+        # A program that is on PATH but has no menu entry
+        tool = os.path.join(folder, "sketchtool")
+        with open(tool, "w") as file:
+            file.write("#!/bin/sh\n")
+        os.chmod(tool, os.stat(tool).st_mode | stat.S_IEXEC)
+
+        environ = {"XDG_DATA_HOME": folder, "XDG_DATA_DIRS": folder, "PATH": folder}
+        with mock.patch.dict(os.environ, environ), mock.patch.object(sysaction, "_apps", None):
+            self.assertEqual(sysaction.find_app("sketch pad"), ["sketch", "--new"])
+            self.assertEqual(sysaction.find_app("sketch"), ["sketch", "--new"])
+            self.assertIsNone(sysaction.find_app("helper"))
+            self.assertIsNone(sysaction.find_app("sketchtool"))
+
+
+class VolumeCommandTest(unittest.TestCase):
+    def controller(self):
+        controller = SystemController()
+        controller.volume = FakeBackend(level=0.5)
+        return controller
+
+    def test_steps_change_the_level(self):
+        controller = self.controller()
+        self.assertTrue(controller.execute(COMMANDS.parse("volume up 20")))
+        self.assertAlmostEqual(controller.volume.level, 0.7)
+        self.assertTrue(controller.execute(COMMANDS.parse("turn the volume down")))
+        self.assertAlmostEqual(controller.volume.level, 0.6)
+
+    def test_negative_steps_and_other_units_are_rejected(self):
+        controller = self.controller()
+        for text in ("volume up -20", "volume down -20", "turn volume up 5 minutes", "set volume to 30 seconds"):
+            self.assertFalse(controller.execute(COMMANDS.parse(text)), text)
+        self.assertEqual(controller.volume.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
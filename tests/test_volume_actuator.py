@@ -0,0 +1,98 @@
+import time
+import unittest
+from volume_actuator import FakeBackend, VolumeActuator
+
+
+class NoSmoothing:
+    ''' Passes levels through, so the tests see exactly the levels they set '''
+
+    def filter(self, value, timestamp):
+        return value
+
+    def reset(self):
+        pass
+
+
+class TimedBackend(FakeBackend):
+    ''' FakeBackend that also records when each level was sent '''
+
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def set_level(self, level):
+        self.times.append(time.perf_counter())
+        super().set_level(level)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class VolumeActuatorTest(unittest.TestCase):
+    def actuator(self, backend, **settings):
+        actuator = VolumeActuator(backend, smoothing=NoSmoothing(), **settings).start()
+        self.addCleanup(actuator.stop)
+        return actuator
+
+    def test_dead_band_drops_small_changes(self):
+        backend = FakeBackend()
+        actuator = self.actuator(backend, dead_band=0.05, max_rate=1000.0)
+        self.assertTrue(actuator.set_target(0.5))
+        self.assertTrue(wait_until(lambda: backend.calls))
+        self.assertFalse(actuator.set_target(0.52))
+        self.assertFalse(actuator.set_target(0.47))
+        self.assertTrue(actuator.set_target(0.6))
+        self.assertTrue(wait_until(lambda: len(backend.calls) == 2))
+        self.assertEqual(backend.calls, [("set_level", 0.5), ("set_level", 0.6)])
+        self.assertEqual(actuator.received, 4)
+
+    def test_levels_are_clamped(self):
+        backend = FakeBackend()
+        actuator = self.actuator(backend, max_rate=1000.0)
+        actuator.set_target(1.4)
+        self.assertTrue(wait_until(lambda: backend.calls))
+        self.assertEqual(backend.level, 1.0)
+
+    def test_rate_limit_spaces_backend_calls(self):
+        backend = TimedBackend()
+        actuator = self.actuator(backend, dead_band=0.0, max_rate=10.0)
+        started = time.perf_counter()
+        for i in range(25):
+            actuator.set_target(i / 25)
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - started
+        # idle() can turn true before the backend recorded the last level, so wait for the level itself
+        self.assertTrue(wait_until(lambda: backend.level == 24 / 25))
+        gaps = [later - earlier for earlier, later in zip(backend.times, backend.times[1:])]
+        self.assertTrue(all(gap >= 0.09 for gap in gaps), gaps)
+        self.assertLessEqual(len(backend.calls), elapsed * 10 + 2)
+
+    def test_pending_levels_coalesce_to_the_newest(self):
+        backend = FakeBackend()
+        actuator = self.actuator(backend, dead_band=0.0, max_rate=5.0)
+        actuator.set_target(0.1)
+        self.assertTrue(wait_until(lambda: backend.calls))
+        for level in (0.3, 0.5, 0.7):
+            actuator.set_target(level)
+        self.assertTrue(wait_until(lambda: backend.level == 0.7))
+        self.assertEqual(backend.calls, [("set_level", 0.1), ("set_level", 0.7)])
+
+    def test_stop_sends_the_pending_level(self):
+        backend = FakeBackend()
+        actuator = self.actuator(backend, dead_band=0.0, max_rate=0.5)
+        actuator.set_target(0.2)
+        self.assertTrue(wait_until(lambda: backend.calls))
+        actuator.set_target(0.9)
+        started = time.perf_counter()
+        actuator.stop()
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(backend.calls[-1], ("set_level", 0.9))
+        self.assertFalse(actuator.thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
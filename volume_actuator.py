@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import math
+import time
+import shutil
+import threading
+import subprocess
+
+
+class PycawBackend:
+    ''' Windows master volume through the Core Audio endpoint API '''
+    name = "pycaw"
+
+    def __init__(self):
+        from ctypes import cast, POINTER
+        from comtypes import CLSCTX_ALL
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+
+        interface = AudioUtilities.GetSpeakers().Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        self.volume = cast(interface, POINTER(IAudioEndpointVolume))
+
+    def get_level(self):
+        return float(self.volume.GetMasterVolumeLevelScalar())
+
+    def set_level(self, level):
+        self.volume.SetMasterVolumeLevelScalar(level, None)
+
+    def set_mute(self, muted):
+        self.volume.SetMute(int(muted), None)
+
+
+class PulseAudioBackend:
+    ''' Default sink of PulseAudio or PipeWire through pactl '''
+    name = "pactl"
+
+    def __init__(self, sink="@DEFAULT_SINK@"):
+        self.sink = sink
+
+    def get_level(self):
+        output = subprocess.run(["pactl", "get-sink-volume", self.sink], capture_output=True, text=True, check=True).stdout
+        return int(re.search(r"(\d+)%", output).group(1)) / 100
+
+    def set_level(self, level):
+        subprocess.run(["pactl", "set-sink-volume", self.sink, f"{round(level * 100)}%"], check=True)
+
+    def set_mute(self, muted):
+        subprocess.run(["pactl", "set-sink-mute", self.sink, "1" if muted else "0"], check=True)
+
+
+class AlsaBackend:
+    ''' An ALSA mixer control through amixer '''
+    name = "amixer"
+
+    def __init__(self, control="Master"):
+        self.control = control
+
+    def get_level(self):
+        output = subprocess.run(["amixer", "sget", self.control], capture_output=True, text=True, check=True).stdout
+        return int(re.search(r"\[(\d+)%\]", output).group(1)) / 100
+
+    def set_level(self, level):
+        subprocess.run(["amixer", "-q", "sset", self.control, f"{round(level * 100)}%"], check=True)
+
+    def set_mute(self, muted):
+        subprocess.run(["amixer", "-q", "sset", self.control, "mute" if muted else "unmute"], check=True)
+
+
+class FakeBackend:
+    ''' In-memory volume that records every call, for tests and benchmarks '''
+    name = "fake"
+
+    def __init__(self, level=0.5):
+        self.level = level
+        self.muted = False
+        self.calls = []
+
+    def get_level(self):
+        return self.level
+
+    def set_level(self, level):
+        self.calls.append(("set_level", level))
+        self.level = level
+
+    def set_mute(self, muted):
+        self.calls.append(("set_mute", muted))
+        self.muted = muted
+
+
+BACKENDS = {backend.name: backend for backend in (PycawBackend, PulseAudioBackend, AlsaBackend, FakeBackend)}
+
+
+def create_backend(name=None):
+    ''' Volume backend named by VOLUME_BACKEND ("pycaw", "pactl", "amixer" or "fake").
+
+    By default pycaw is used on Windows, and pactl or else amixer on other systems,
+    whichever is installed.
+    '''
+    name = name or os.getenv("VOLUME_BACKEND")
+    if name is None:
+        if sys.platform == "win32":
+            name = "pycaw"
+        elif shutil.which("pactl"):
+            name = "pactl"
+        elif shutil.which("amixer"):
+            name = "amixer"
+        else:
+            raise ValueError("No volume backend found: install pactl or amixer, or set VOLUME_BACKEND")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown volume backend: {name}")
+    return BACKENDS[name]()
+
+
+class OneEuroFilter:
+    ''' One-Euro filter: an EMA whose cutoff rises with the speed of the signal.
+
+    Slow movements (a hand held still) are smoothed hard, removing landmark jitter,
+    while fast movements get a high cutoff and little lag. With beta=0 it is a plain
+    EMA with a fixed cutoff of min_cutoff Hz.
+    '''
+
+    def __init__(self, min_cutoff=1.0, beta=2.0, derivative_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivative_cutoff = derivative_cutoff
+        self.value = None
+        self.derivative = 0.0
+        self.timestamp = None
+
+    @staticmethod
+    def alpha(cutoff, elapsed):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / elapsed)
+
+    def filter(self, value, timestamp):
+        if self.value is None:
+            self.value, self.timestamp = value, timestamp
+            return value
+        elapsed = timestamp - self.timestamp
+        if elapsed <= 0:
+            return self.value
+        derivative = (value - self.value) / elapsed
+        self.derivative += self.alpha(self.derivative_cutoff, elapsed) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        self.value += self.alpha(cutoff, elapsed) * (value - self.value)
+        self.timestamp = timestamp
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.derivative = 0.0
+        self.timestamp = None
+
+
+class VolumeActuator:
+    ''' Sends volume levels from the vision loop to an audio backend on its own thread.
+
+    set_target() never blocks: levels are smoothed, dropped when they are within
+    dead_band of the last level sent, and coalesced so the backend is called at most
+    max_rate times per second with the newest level. stop() still sends a level that
+    was waiting for the rate limit, so the volume ends where the hand left it.
+    '''
+
+    def __init__(self, backend, dead_band=0.02, max_rate=10.0, smoothing=None):
+        self.backend = backend
+        self.dead_band = dead_band
+        self.min_interval = 1.0 / max_rate
+        self.smoothing = smoothing or OneEuroFilter()
+        self.condition = threading.Condition()
+        self.pending = None
+        self.last_level = None
+        self.last_sent_time = 0.0
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name="volume-actuator", daemon=True)
+        self.received = 0
+        self.sent = 0
+        self.errors = 0
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def set_target(self, level, timestamp=None):
+        ''' Ask for a volume between 0 and 1; returns True if it will be sent '''
+        level = self.smoothing.filter(level, time.perf_counter() if timestamp is None else timestamp)
+        level = min(1.0, max(0.0, level))
+        with self.condition:
+            self.received += 1
+            if self.last_level is not None and abs(level - self.last_level) < self.dead_band:
+                return False
+            self.last_level = level
+            self.pending = level
+            self.condition.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or not self.running)
+                if self.pending is None:
+                    return
+                # Rate limit; levels arriving meanwhile replace the pending one
+                wait = self.last_sent_time + self.min_interval - time.perf_counter()
+                if wait > 0 and self.running:
+                    self.condition.wait(wait)
+                    continue
+                level, self.pending = self.pending, None
+            try:
+                self.backend.set_level(level)
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1:
+                    print(f"Setting the volume failed: {e}")
+            self.last_sent_time = time.perf_counter()
+
+    def reset(self):
+        ''' Forget the smoothing state, e.g. when the hand left the frame '''
+        self.smoothing.reset()
+
+    def idle(self):
+        with self.condition:
+            return self.pending is None
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+
+    def report(self):
+        return {"backend": self.backend.name, "received": self.received, "sent": self.sent, "errors": self.errors}